@@ -7,6 +7,7 @@ from collections import (
     defaultdict,
     OrderedDict,
 )
+from functools import partial
 import operator
 import os
 
@@ -17,22 +18,68 @@ from scipy.spatial import distance
 from scipy import stats
 from munkres import Munkres
 
+from feature.datastructs.points import PointSet
+
+
+# Approximate scratch space (in bytes) used per compared feature while scoring
+# a tile of vector pairs (one float64 delta plus one boolean bound check)
+SIMILARITY_BLOCK_BYTES_PER_FEATURE = 9
+SIMILARITY_BLOCK_MEMORY = 64 * 1024 * 1024
+
+
+def similarity_block_shape(num_rows, num_cols, num_features,
+                           memory_limit=None,
+                           bytes_per_feature=SIMILARITY_BLOCK_BYTES_PER_FEATURE):
+    """ Pick a (rows, columns) tile size for scoring a num_rows x num_cols
+        block of vector pairs so that the broadcast intermediates of a
+        single tile stay within memory_limit bytes
+    """
+    if memory_limit is None:
+        memory_limit = SIMILARITY_BLOCK_MEMORY
+    pair_cost = max(1, num_features * bytes_per_feature)
+    max_pairs = max(1, int(memory_limit // pair_cost))
+    cols = max(1, min(num_cols, max_pairs))
+    rows = max(1, min(num_rows, max_pairs // cols))
+    return rows, cols
+
+
+def iter_similarity_blocks(num_rows, num_cols, block_shape):
+    """ Generate (row slice, column slice) pairs covering a score matrix """
+    row_step, col_step = block_shape
+    for row_start in range(0, num_rows, row_step):
+        rows = slice(row_start, min(row_start + row_step, num_rows))
+        for col_start in range(0, num_cols, col_step):
+            cols = slice(col_start, min(col_start + col_step, num_cols))
+            yield rows, cols
+
 
 def parameterized_feature_coefficient(fn):
     def batch_similarity(params, a, bs):
         return np.array([fn(params, a, b) for b in bs])
 
-    def similarity_matrix(params, as_, bs):
+    def similarity_matrix(params, as_, bs, memory_limit=None):
         return np.array([fn.batch_similarity(params, a, bs) for a in as_])
 
     def stream_batch_similarities(params, as_, bs):
         for a in as_:
             yield fn.batch_similarity(params, a, bs)
 
+    def stream_similarity_blocks(params, as_, bs, memory_limit=None):
+        num_rows, num_cols = len(as_), len(bs)
+        if num_rows == 0 or num_cols == 0:
+            return
+        num_features = len(as_[0])
+        # Only split rows so each block is a full slice of the score matrix
+        rows, _ = similarity_block_shape(num_rows, num_cols, num_features,
+                                         memory_limit=memory_limit)
+        for start in range(0, num_rows, rows):
+            yield fn.similarity_matrix(params, as_[start:start + rows], bs,
+                                       memory_limit=memory_limit)
+
     def stream_similarities(params, as_, bs):
-        batches = fn.stream_batch_similarities(params, as_, bs)
-        for batch in batches:
-            for score in batch:
+        blocks = fn.stream_similarity_blocks(params, as_, bs)
+        for block in blocks:
+            for score in block.flat:
                 yield score
 
     def override_batch_similarity(bulk_fn):
@@ -43,17 +90,162 @@ def parameterized_feature_coefficient(fn):
         setattr(fn, 'similarity_matrix', matrix_fn)
         return matrix_fn
 
+    def override_from_counts(ratio_fn):
+        setattr(fn, 'from_counts', ratio_fn)
+        return ratio_fn
+
     override_batch_similarity(batch_similarity)
     override_similarity_matrix(similarity_matrix)
 
     setattr(fn, 'override_batch_similarity', override_batch_similarity)
     setattr(fn, 'override_similarity_matrix', override_similarity_matrix)
+    setattr(fn, 'override_from_counts', override_from_counts)
+    setattr(fn, 'from_counts', None)
     setattr(fn, 'stream_batch_similarities', stream_batch_similarities)
+    setattr(fn, 'stream_similarity_blocks', stream_similarity_blocks)
     setattr(fn, 'stream_similarities', stream_similarities)
 
     return fn
 
 
+def cutoff_intersection_union_counts(cutoffs, as_, bs, memory_limit=None):
+    """ Count, for every pair of FEATURE vectors, the features present in
+        either vector (union) and the present features whose difference
+        falls within the cutoff (intersection). Pairs are processed in
+        tiles using broadcasting so that no single tile exceeds the memory
+        budget. Returns two integer matrices: (intersections, unions)
+    """
+    as_ = np.asarray(as_, dtype=float)
+    bs = np.asarray(bs, dtype=float)
+    cutoffs = np.asarray(cutoffs, dtype=float)
+    num_rows, num_cols = len(as_), len(bs)
+    intersections = np.zeros((num_rows, num_cols), dtype=int)
+    unions = np.zeros((num_rows, num_cols), dtype=int)
+    if num_rows == 0 or num_cols == 0:
+        return intersections, unions
+
+    num_features = as_.shape[1]
+    block_shape = similarity_block_shape(num_rows, num_cols, num_features,
+                                         memory_limit=memory_limit)
+
+    # Features that are zero in both vectors are never part of the union
+    # but always fall within a positive cutoff, so they are counted (as
+    # matrix products) and removed from the in-bounds totals afterwards
+    zerosA = (as_ == 0).astype(float)
+    zerosB = (bs == 0).astype(float)
+    positive = cutoffs > 0
+
+    deltas = np.empty(block_shape + (num_features,))
+    in_bounds = np.empty(deltas.shape, dtype=bool)
+
+    for rows, cols in iter_similarity_blocks(num_rows, num_cols, block_shape):
+        a_block = as_[rows]
+        b_block = bs[cols]
+        tile_deltas = deltas[:len(a_block), :len(b_block)]
+        tile_in_bounds = in_bounds[:len(a_block), :len(b_block)]
+
+        np.subtract(a_block[:, np.newaxis, :], b_block[np.newaxis, :, :], out=tile_deltas)
+        np.abs(tile_deltas, out=tile_deltas)
+        np.less(tile_deltas, cutoffs, out=tile_in_bounds)
+
+        both_zero = np.rint(np.dot(zerosA[rows], zerosB[cols].T)).astype(int)
+        matched_zeros = np.rint(np.dot(zerosA[rows][:, positive],
+                                       zerosB[cols][:, positive].T)).astype(int)
+
+        unions[rows, cols] = num_features - both_zero
+        intersections[rows, cols] = tile_in_bounds.sum(axis=2) - matched_zeros
+
+    return intersections, unions
+
+
+def stream_cutoff_counts(cutoffs, as_, bs, memory_limit=None):
+    """ Generate (intersections, unions) count blocks for consecutive row
+        slices of as_ against all of bs, keeping each block in budget
+    """
+    num_rows, num_cols = len(as_), len(bs)
+    if num_rows == 0 or num_cols == 0:
+        return
+    num_features = len(as_[0])
+    rows, _ = similarity_block_shape(num_rows, num_cols, num_features,
+                                     memory_limit=memory_limit)
+    for start in range(0, num_rows, rows):
+        yield cutoff_intersection_union_counts(cutoffs, as_[start:start + rows], bs,
+                                               memory_limit=memory_limit)
+
+
+def stream_symmetric_cutoff_counts(cutoffs, vectors, rows=None, include_diagonal=True,
+                                                          memory_limit=None):
+    """ Generate (intersections, unions, weight) for a set of vectors
+        compared with itself, evaluating only the upper triangle of the
+        score matrix. Off-diagonal pairs are weighted twice so totals
+        match the full product; self comparisons are weighted once or
+        skipped. rows optionally restricts the schedule to a (start, stop)
+        range of triangle rows.
+    """
+    num_vectors = len(vectors)
+    start, stop = rows or (0, num_vectors)
+    if start >= stop:
+        return
+    num_features = len(vectors[0])
+    block_rows, _ = similarity_block_shape(stop - start, num_vectors - start, num_features,
+                                           memory_limit=memory_limit)
+    for row_start in range(start, stop, block_rows):
+        row_stop = min(row_start + block_rows, stop)
+        intersections, unions = cutoff_intersection_union_counts(cutoffs,
+                                                                 vectors[row_start:row_stop],
+                                                                 vectors[row_start:],
+                                                                 memory_limit=memory_limit)
+        height = row_stop - row_start
+        upper = np.triu(np.ones(intersections.shape, dtype=bool), k=1)
+        yield intersections[upper], unions[upper], 2
+        if include_diagonal:
+            diagonal = np.arange(height)
+            yield intersections[diagonal, diagonal], unions[diagonal, diagonal], 1
+
+
+def paired_cutoff_counts(cutoffs, as_, bs):
+    """ Count intersections and unions for row-aligned vector pairs
+        (as_[i] against bs[i]) rather than for all pairs
+    """
+    as_ = np.asarray(as_, dtype=float)
+    bs = np.asarray(bs, dtype=float)
+    union = (as_ != 0) | (bs != 0)
+    in_bounds = np.abs(as_ - bs) < cutoffs
+    intersections = (union & in_bounds).sum(axis=1)
+    unions = union.sum(axis=1)
+    return intersections, unions
+
+
+def stratified_sample(strata, size, random_state=np.random):
+    """ Draw size indexes (with replacement) so that each stratum label
+        receives a share of the sample proportional to its size
+    """
+    labels, inverse = np.unique(strata, return_inverse=True)
+    sizes = np.bincount(inverse)
+    expected = size * sizes / sizes.sum()
+    allocation = np.floor(expected).astype(int)
+    shortfall = size - allocation.sum()
+    if shortfall > 0:
+        remainders = expected - allocation
+        extra = random_state.choice(len(sizes), shortfall, replace=False,
+                                    p=remainders / remainders.sum())
+        allocation[extra] += 1
+
+    order = np.argsort(inverse, kind='mergesort')
+    starts = np.cumsum(sizes) - sizes
+    chosen_strata = np.repeat(np.arange(len(sizes)), allocation)
+    offsets = (random_state.random_sample(size) * sizes[chosen_strata]).astype(int)
+    indexes = order[starts[chosen_strata] + offsets]
+    random_state.shuffle(indexes)
+    return indexes
+
+
+def _scores_or_zero(scores):
+    scores = np.asarray(scores, dtype=float)
+    scores[~np.isfinite(scores)] = 0.
+    return scores
+
+
 @parameterized_feature_coefficient
 def reference_cutoff_tanimoto_similarity(cutoffs, a, b):
     total = 0  # $all -> total
@@ -112,21 +304,23 @@ def cutoff_tanimoto_similarity(cutoffs, a, b):
         return 0.
 
 
+@cutoff_tanimoto_similarity.override_from_counts
+def cutoff_tanimoto_from_counts(intersections, unions):
+    intersections = np.asarray(intersections, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _scores_or_zero(intersections / unions)
+
+
+@cutoff_tanimoto_similarity.override_similarity_matrix
+def matrix_cutoff_tanimoto_similarity(cutoffs, as_, bs, memory_limit=None):
+    counts = cutoff_intersection_union_counts(cutoffs, as_, bs, memory_limit=memory_limit)
+    return cutoff_tanimoto_from_counts(*counts)
+
+
 @cutoff_tanimoto_similarity.override_batch_similarity
 def bulk_cutoff_tanimoto_similarity(cutoffs, a, bs):
-    n = len(bs)
-    unions = np.logical_or(a !=0, bs != 0)
-    a_repeat = np.repeat(a[np.newaxis], n, axis=0)
-    cutoffs_repeat = np.repeat(cutoffs[np.newaxis], n, axis=0)
-    in_bounds = np.abs(a_repeat - bs) < cutoffs_repeat
-    intersections = np.logical_and(unions, in_bounds)
-    union_sizes = unions.sum(axis=1)
-    intersection_sizes = intersections.sum(axis=1)
-    old_error_settings = np.seterr(divide='ignore')
-    scores = intersection_sizes / union_sizes
-    scores[~np.isfinite(scores)] = 0.
-    np.seterr(**old_error_settings)
-    return scores
+    a = np.asarray(a)
+    return matrix_cutoff_tanimoto_similarity(cutoffs, a[np.newaxis], bs)[0]
 
 
 @parameterized_feature_coefficient
@@ -151,21 +345,23 @@ def cutoff_tversky22_similarity(cutoffs, a, b):
         return 0.
 
 
+@cutoff_tversky22_similarity.override_from_counts
+def cutoff_tversky22_from_counts(intersections, unions):
+    intersections = np.asarray(intersections, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _scores_or_zero(intersections / (2. * unions - intersections))
+
+
+@cutoff_tversky22_similarity.override_similarity_matrix
+def matrix_cutoff_tversky22_similarity(cutoffs, as_, bs, memory_limit=None):
+    counts = cutoff_intersection_union_counts(cutoffs, as_, bs, memory_limit=memory_limit)
+    return cutoff_tversky22_from_counts(*counts)
+
+
 @cutoff_tversky22_similarity.override_batch_similarity
 def bulk_cutoff_tversky22_similarity(cutoffs, a, bs):
-    n = len(bs)
-    unions = np.logical_or(a !=0, bs != 0)
-    a_repeat = np.repeat(a[np.newaxis], n, axis=0)
-    cutoffs_repeat = np.repeat(cutoffs[np.newaxis], n, axis=0)
-    in_bounds = np.abs(a_repeat - bs) < cutoffs_repeat
-    intersections = np.logical_and(unions, in_bounds)
-    union_sizes = unions.sum(axis=1)
-    intersection_sizes = intersections.sum(axis=1)
-    old_error_settings = np.seterr(divide='ignore')
-    scores = intersection_sizes / (2. * union_sizes - intersection_sizes)
-    scores[~np.isfinite(scores)] = 0.
-    np.seterr(**old_error_settings)
-    return scores
+    a = np.asarray(a)
+    return matrix_cutoff_tversky22_similarity(cutoffs, a[np.newaxis], bs)[0]
 
 
 @parameterized_feature_coefficient
@@ -190,21 +386,23 @@ def cutoff_dice_similarity(cutoffs, a, b):
         return 0.
 
 
+@cutoff_dice_similarity.override_from_counts
+def cutoff_dice_from_counts(intersections, unions):
+    intersections = np.asarray(intersections, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _scores_or_zero((2.0 * intersections) / (unions - intersections))
+
+
+@cutoff_dice_similarity.override_similarity_matrix
+def matrix_cutoff_dice_similarity(cutoffs, as_, bs, memory_limit=None):
+    counts = cutoff_intersection_union_counts(cutoffs, as_, bs, memory_limit=memory_limit)
+    return cutoff_dice_from_counts(*counts)
+
+
 @cutoff_dice_similarity.override_batch_similarity
 def bulk_cutoff_dice_similarity(cutoffs, a, bs):
-    n = len(bs)
-    unions = np.logical_or(a !=0, bs != 0)
-    a_repeat = np.repeat(a[np.newaxis], n, axis=0)
-    cutoffs_repeat = np.repeat(cutoffs[np.newaxis], n, axis=0)
-    in_bounds = np.abs(a_repeat - bs) < cutoffs_repeat
-    intersections = np.logical_and(unions, in_bounds)
-    union_sizes = unions.sum(axis=1)
-    intersection_sizes = intersections.sum(axis=1)
-    old_error_settings = np.seterr(divide='ignore')
-    scores = (2.0 * intersection_sizes) / (union_sizes - intersection_sizes)
-    scores[~np.isfinite(scores)] = 0.
-    np.seterr(**old_error_settings)
-    return scores
+    a = np.asarray(a)
+    return matrix_cutoff_dice_similarity(cutoffs, a[np.newaxis], bs)[0]
 
 
 def normalize_score(score, mode):
@@ -379,10 +577,18 @@ def munkres_align(scores, shift_negative=False, maximize=False):
 
 
 def alignment_rmsd(alignment, pointsA, pointsB):
+    """ Delta RMSD of aligned points, given as name to coordinate lookups
+        or PointSets (whose points are named by their first comment)
+    """
     num_aligned = len(alignment)
     if num_aligned < 2:
         return 0
 
+    if isinstance(pointsA, PointSet):
+        pointsA = pointsA.coords_by_name()
+    if isinstance(pointsB, PointSet):
+        pointsB = pointsB.coords_by_name()
+
     coordsA = np.empty((num_aligned, 3))
     coordsB = np.empty((num_aligned, 3))
 
@@ -404,13 +610,17 @@ def alignment_rmsd(alignment, pointsA, pointsB):
     return rmsd
 
 
+def round_to_digits(value, digits):
+    return round(value, digits)
+
+
 class GaussianStats(object):
     """ A class for calculating simple statistics over streams of data """
 
     def __init__(self, n=0, mean=None, m2=None, mins=None, maxes=None, mode_bins=None,
                  mode_binning=None, store=None, store_formatter="{0:0.3f}\n".format):
         if isinstance(mode_binning, int):
-            self._bin_for_mode = lambda x: round(x, mode_binning)
+            self._bin_for_mode = partial(round_to_digits, digits=mode_binning)
         else:
             self._bin_for_mode = mode_binning
         self._store_dest = store
@@ -447,8 +657,11 @@ class GaussianStats(object):
         delta = sample - self._mean
         mean = self._mean + delta / n
         m2 = self._m2 + delta * (sample - mean)
-        mins = np.minimum(self._mins, sample)
-        maxes = np.maximum(self._maxes, sample)
+        if self.n == 0:
+            mins = maxes = sample
+        else:
+            mins = np.minimum(self._mins, sample)
+            maxes = np.maximum(self._maxes, sample)
 
         if self._mode_counts is not None:
             bin = self._bin_for_mode(item)
@@ -464,26 +677,74 @@ class GaussianStats(object):
 
         return item
 
-    def merge(self, other):
+    def record_many(self, items):
+        """ Record a block of samples (one per row) at once by combining
+            the block's moments with the running ones
         """
-        Take two OnlineStatistics-like objects and produce a third
-        From: https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
-        """
-        n = self.n + other.n
-        mean = (self.n * self.mean + other.n * other.mean) / n
+        samples = np.asarray(items, dtype=float)
+        if len(samples) == 0:
+            return items
+
+        block_n = len(samples)
+        block_mean = samples.mean(axis=0)
+        block_m2 = ((samples - block_mean) ** 2).sum(axis=0)
+        self._combine(block_n, block_mean, block_m2,
+                      samples.min(axis=0), samples.max(axis=0))
 
-        delta = other.mean - self.mean
-        scaled_delta = delta**2 * ((self.n * other.n) / n)
+        if self._mode_counts is not None:
+            self._mode_counts.update(self._bin_for_mode(item) for item in samples.tolist())
 
-        m2 = self.m2 + other.m2 + scaled_delta
+        for item in samples:
+            self.store(item)
 
-        mins = np.minimum(self.mins, other.mins)
-        maxes = np.maximum(self.maxes, other.maxes)
+        return items
 
-        #TODO: Add mode merging
+    def _combine(self, n, mean, m2, mins, maxes):
+        """ Fold another set of moments into this one
+        From: https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+        """
+        if n == 0:
+            return
+        if self.n == 0:
+            self._n = n
+            self._mean = np.array(mean)
+            self._m2 = np.array(m2)
+            self._mins = np.array(mins)
+            self._maxes = np.array(maxes)
+            return
+
+        total = self.n + n
+        delta = mean - self._mean
+        self._mean = self._mean + delta * (n / total)
+        self._m2 = self._m2 + m2 + delta**2 * ((self.n * n) / total)
+        self._mins = np.minimum(self._mins, mins)
+        self._maxes = np.maximum(self._maxes, maxes)
+        self._n = total
 
+    def merge(self, other):
+        """
+        Take two OnlineStatistics-like objects and produce a third,
+        keeping this object's mode binning and store destination
+        """
         cls = type(self)
-        return cls(n=n, mean=mean, m2=m2, mins=mins, maxes=maxes)
+        merged = cls(n=self.n, mean=self.mean, m2=self.m2, mins=self.mins, maxes=self.maxes,
+                     mode_binning=self._bin_for_mode,
+                     store=self._store_dest,
+                     store_formatter=self._store_formatter)
+        merged._combine(other.n, other.mean, other.m2, other.mins, other.maxes)
+
+        if merged._mode_counts is not None:
+            merged._mode_counts.update(self._mode_counts or {})
+            merged._mode_counts.update(other._mode_counts or {})
+
+        return merged
+
+    def __getstate__(self):
+        # Stores are open streams, so only the statistics cross processes
+        state = self.__dict__.copy()
+        state['_store_dest'] = None
+        state['_store_formatter'] = None
+        return state
 
     def store(self, item):
         if self._store_dest is not None:
@@ -560,6 +821,136 @@ class GaussianStats(object):
         return self._maxes
 
 
+class CutoffScoreHistogram(object):
+    """ Exact statistics over cutoff similarity scores. Every cutoff score
+        is a ratio of an intersection and a union count, so scores are
+        accumulated as a table of (intersection, union) occurrences and
+        the statistics are derived from the table once at the end.
+    """
+
+    def __init__(self, num_features, score_function, counts=None, mode_binning=None):
+        if isinstance(mode_binning, int):
+            self._bin_for_mode = partial(round_to_digits, digits=mode_binning)
+        else:
+            self._bin_for_mode = mode_binning
+        self._num_features = num_features
+        self._score_fn = score_function
+        size = num_features + 1
+        if counts is None:
+            counts = np.zeros((size, size), dtype=np.int64)
+        self._counts = np.array(counts, dtype=np.int64)
+        self._scores = None
+
+    def record_counts(self, intersections, unions, weight=1):
+        size = self._num_features + 1
+        cells = np.ravel(intersections) * size + np.ravel(unions)
+        occurrences = np.bincount(cells, minlength=size * size)
+        self._counts += weight * occurrences.reshape(size, size)
+
+    def merge(self, other):
+        if self._num_features != other._num_features:
+            raise ValueError("Cannot merge histograms of different feature counts")
+        cls = type(self)
+        merged = cls(self._num_features, self._score_fn, counts=self._counts + other._counts)
+        merged._bin_for_mode = self._bin_for_mode
+        return merged
+
+    def _observed(self):
+        """ Return the distinct observed scores and their occurrences """
+        if self._scores is None:
+            intersections, unions = np.indices(self._counts.shape)
+            self._scores = self._score_fn(intersections, unions)
+        observed = self._counts > 0
+        return self._scores[observed], self._counts[observed]
+
+    def get_top_n_modes(self, n):
+        if self._bin_for_mode is None or self.n == 0:
+            return None
+        bins = Counter()
+        for score, count in zip(*self._observed()):
+            bins[self._bin_for_mode(float(score))] += int(count)
+        return sorted(bins.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    def estimate_errors(self, confidence=0.95, num_resamples=100, random_state=np.random):
+        """ Estimate confidence interval half-widths for the mode, mean and
+            standard deviation when the recorded scores are a random sample.
+            Mean and std use normal approximations; the mode is bootstrapped
+            by resampling the (small) table of observed scores
+        """
+        n = self.n
+        if n < 2:
+            return np.inf, np.inf, np.inf
+        z = stats.norm.ppf(0.5 + confidence / 2.)
+        std_dev = self.std_dev
+        mean_error = z * std_dev / np.sqrt(n)
+        std_error = z * std_dev / np.sqrt(2. * (n - 1))
+
+        if self._bin_for_mode is None:
+            return None, mean_error, std_error
+        scores, counts = self._observed()
+        bins = np.array([self._bin_for_mode(float(score)) for score in scores])
+        bin_values, bin_index = np.unique(bins, return_inverse=True)
+        probabilities = counts / n
+        modes = []
+        for _ in range(num_resamples):
+            resampled = random_state.multinomial(n, probabilities)
+            bin_counts = np.bincount(bin_index, weights=resampled, minlength=len(bin_values))
+            modes.append(bin_values[np.argmax(bin_counts)])
+        low, high = np.percentile(modes, [50 * (1 - confidence), 50 * (1 + confidence)])
+        mode_error = (high - low) / 2.
+        return mode_error, mean_error, std_error
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def n(self):
+        return int(self._counts.sum())
+
+    @property
+    def mean(self):
+        scores, counts = self._observed()
+        return np.dot(scores, counts) / self.n
+
+    @property
+    def variance(self):
+        if self.n < 2:
+            return 0.
+        scores, counts = self._observed()
+        return np.dot((scores - self.mean) ** 2, counts) / (self.n - 1)
+
+    @property
+    def std_dev(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def mode(self):
+        mode = self.get_top_n_modes(1)
+        if mode is not None:
+            return mode[0][0]
+        else:
+            return None
+
+    @property
+    def mode_count(self):
+        mode = self.get_top_n_modes(1)
+        if mode is not None:
+            return mode[0][1]
+        else:
+            return None
+
+    @property
+    def mins(self):
+        scores, _ = self._observed()
+        return scores.min()
+
+    @property
+    def maxes(self):
+        scores, _ = self._observed()
+        return scores.max()
+
+
 class Indexer(defaultdict):
     """ A data structure for assigning unique indexes (ids) to a collection of items.
         Provided items must be hashable
@@ -570,6 +961,10 @@ class Indexer(defaultdict):
         items = items or []
         self.extend(items)
 
+    def __reduce__(self):
+        # The default factory refers to self, so rebuild from the keys in index order
+        return type(self), (sorted(self, key=self.get),)
+
     def extend(self, items):
         for item in items:
             self.add(item)
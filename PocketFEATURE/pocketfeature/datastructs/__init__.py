@@ -1,11 +1,13 @@
 from __future__ import absolute_import
 
-from .pdb import PDBFocus
-from .pocket import (
+from feature.datastructs.points import (
     PDBPoint,
-    Pocket
+    PointSet,
 )
 
+from .pdb import PDBFocus
+from .pocket import Pocket
+
 from .residues import (
     CenterCalculator,
     make_vector_type_key,
@@ -15,12 +17,14 @@ from .metadata import (
     PocketFeaturePointFileMetaData,
     PocketFeatureBackgroundStatisticsMetaData,
 )
+from .cache import LRUCache
 from .matrixvalues import (
     MatrixValues,
     PassThroughItems,
 )
 from .background import (
     BackgroundEnvironment,
+    TypePairTable,
     MEAN_VECTOR,
     STD_DEV_VECTOR,
     VAR_VECTOR,
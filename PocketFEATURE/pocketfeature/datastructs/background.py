@@ -3,14 +3,17 @@
 #TODO: Integrate metadata into this format to automatically include dimension names
 #TODO: Integrate this with residue definition files
 
+import collections
 import itertools
 
+import numpy as np
 from six import (
     string_types,
     moves as six_moves,
 )
 
 from pocketfeature import defaults
+from pocketfeature.algorithms import cutoff_intersection_union_counts
 from pocketfeature.datastructs.residues import CenterCalculator
 from pocketfeature.datastructs.matrixvalues import MatrixValues
 from pocketfeature.utils.ff import get_vector_type
@@ -27,6 +30,74 @@ NORMALIZED_SCORE = 'normalized'
 NORM_COLUMN = 'mode'
 
 
+class TypePairTable(object):
+    """ Normalization coefficients and allowed pairs of vector types
+        compiled into dense arrays indexed by integer type IDs """
+
+    def __init__(self, type_names, coefficients, allowed):
+        self.type_names = list(type_names)
+        self.type_ids = dict((name, idx) for idx, name in enumerate(self.type_names))
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.allowed = np.asarray(allowed, dtype=bool)
+
+    @classmethod
+    def compile(cls, normalizations=None, allowed_pairs=None):
+        """ Build a table from normalizations keyed by type pair tuples and
+            a set of allowed type pair tuples (None allows every pair
+            with a normalization)
+        """
+        keys = set()
+        if normalizations is not None:
+            keys.update(normalizations.keys())
+        if allowed_pairs is not None:
+            keys.update(allowed_pairs)
+        type_names = sorted(set(itertools.chain.from_iterable(keys)))
+        num_types = len(type_names)
+        table = cls(type_names, np.full((num_types, num_types), np.nan),
+                                np.zeros((num_types, num_types), dtype=bool))
+
+        if normalizations is not None:
+            for key, value in normalizations.items():
+                table._set_pair(table.coefficients, key, value)
+        if allowed_pairs is None:
+            table.allowed[:] = True
+        else:
+            for key in allowed_pairs:
+                table._set_pair(table.allowed, key, True)
+        return table
+
+    def _set_pair(self, values, key, value):
+        idA, idB = (self.type_ids[name] for name in key)
+        values[idA, idB] = value
+        values[idB, idA] = value
+
+    def get_type_id(self, type_name):
+        return self.type_ids.get(type_name, -1)
+
+    def get_type_ids(self, type_names):
+        return np.array([self.get_type_id(name) for name in type_names], dtype=int)
+
+    def is_allowed(self, idA, idB):
+        return idA >= 0 and idB >= 0 and self.allowed[idA, idB]
+
+    def coefficient(self, idA, idB):
+        return self.coefficients[idA, idB]
+
+    def _iter_pairs(self, mask):
+        idsA, idsB = np.nonzero(np.triu(mask))
+        for idA, idB in zip(idsA, idsB):
+            yield (self.type_names[idA], self.type_names[idB]), (idA, idB)
+
+    def get_allowed_pairs(self):
+        """ Recover the set of allowed type pair tuples """
+        return set(key for key, _ in self._iter_pairs(self.allowed))
+
+    def get_normalizations(self):
+        """ Recover the normalization coefficients keyed by type pair tuples """
+        return dict((key, float(self.coefficients[ids]))
+                    for key, ids in self._iter_pairs(~np.isnan(self.coefficients)))
+
+
 class BackgroundEnvironment(object):
     """ An object containing information about a calculated PocketFEATURE background """
 
@@ -40,7 +111,9 @@ class BackgroundEnvironment(object):
                                 scale_function=defaults.DEFAULT_SCALE_FUNCTION,
                                 scale_params=(),
                                 allowed_pairs=defaults.ALLOWED_VECTOR_TYPE_PAIRS,
-                                std_threshold=1.0):
+                                std_threshold=1.0,
+                                thresholds=None,
+                                pair_table=None):
         if isinstance(residue_centers, string_types):
             residue_centers = CenterCalculator(*defaults.NAMED_RESIDUE_CENTERS[residue_centers])
         if isinstance(allowed_pairs, string_types):
@@ -61,13 +134,21 @@ class BackgroundEnvironment(object):
         self._scale_params = scale_params
         self._centers = residue_centers
 
-        allowed_center_pairs = allowed_pairs(residue_centers)
-        if self._normalizations is not None:
-            allowed_center_pairs = set(self._normalizations.keys()).intersection(allowed_center_pairs)
+        # A precompiled table already holds the allowed pairs, which
+        # saves rebuilding the center pair sets
+        if pair_table is not None:
+            allowed_center_pairs = pair_table.get_allowed_pairs()
+            if self._normalizations is None:
+                self._normalizations = pair_table.get_normalizations()
+        else:
+            allowed_center_pairs = allowed_pairs(residue_centers)
+            if self._normalizations is not None:
+                allowed_center_pairs = set(self._normalizations.keys()).intersection(allowed_center_pairs)
 
         self._allowed_pairs = allowed_center_pairs
         self._std_threshold_scale = std_threshold
-        self._thresholds = None
+        self._thresholds = thresholds
+        self._pair_table = pair_table
 
     def normed_features(self, features):
         if self._mean is not None:
@@ -78,6 +159,32 @@ class BackgroundEnvironment(object):
     def z_features(self, features):
         return self.normed_features(features) / self._std_dev
 
+    @property
+    def pair_table(self):
+        if self._pair_table is None:
+            self._pair_table = TypePairTable.compile(self._normalizations, self._allowed_pairs)
+        return self._pair_table
+
+    def get_vector_type_ids(self, vectors):
+        """ Look up the integer type ID of each vector """
+        return self.pair_table.get_type_ids([self._vector_type(vector) for vector in vectors])
+
+    def get_file_type_ids(self, featurefile, vectors=None):
+        """ The type ID array of a feature file's vectors. It is computed once
+            and stored on the file, tagged with the type names it indexes
+        """
+        table = self.pair_table
+        if vectors is None:
+            vectors = list(featurefile.vectors)
+        stored = getattr(featurefile, 'vector_type_ids', None)
+        if stored is not None:
+            type_names, type_ids = stored
+            if type_names == table.type_names and len(type_ids) == len(vectors):
+                return type_ids
+        type_ids = self.get_vector_type_ids(vectors)
+        featurefile.vector_type_ids = (table.type_names, type_ids)
+        return type_ids
+
     def get_vector_pair_key(self, vectorA, vectorB):
         typeA = self._vector_type(vectorA)
         typeB = self._vector_type(vectorB)
@@ -88,8 +195,8 @@ class BackgroundEnvironment(object):
         if self._allowed_pairs is None:
             return True
         else:
-            key = self.get_vector_pair_key(*vectors)
-            return key in self._allowed_pairs
+            idA, idB = self.get_vector_type_ids(vectors)
+            return self.pair_table.is_allowed(idA, idB)
 
     def get_allowed_pairs(self, fileA, fileB):
         pairs = itertools.product(fileA.vectors, fileB.vectors)
@@ -107,23 +214,135 @@ class BackgroundEnvironment(object):
         return norm
 
     def vector_and_normalized_similarity(self, vectorA, vectorB):
-        key = self.get_vector_pair_key(vectorA, vectorB)
-        normalization_coeff = self._normalizations[key]
+        idA, idB = self.get_vector_type_ids((vectorA, vectorB))
+        normalization_coeff = self.pair_table.coefficient(idA, idB)
         score = self.vector_similarity(vectorA, vectorB)
         normalized = self._normalize_fn(score, normalization_coeff)
         return score, normalized
 
+    def group_vectors_by_type(self, type_ids):
+        """ Map each vector type ID to the indexes of vectors of that type """
+        groups = collections.OrderedDict()
+        for idx, type_id in enumerate(type_ids):
+            groups.setdefault(type_id, []).append(idx)
+        return groups
+
+    def get_allowed_type_blocks(self, type_idsA, type_idsB):
+        """ Generate (key, rows, columns) for every allowed pair of vector
+            types, where key is a pair of type IDs and rows and columns
+            index the vectors with type_idsA and type_idsB
+        """
+        table = self.pair_table
+        groupsA = self.group_vectors_by_type(type_idsA)
+        groupsB = self.group_vectors_by_type(type_idsB)
+        for idA, rows in groupsA.items():
+            for idB, cols in groupsB.items():
+                if table.is_allowed(idA, idB):
+                    yield (idA, idB), rows, cols
+
+    def similarity_block(self, featuresA, featuresB):
+        matrix_fn = getattr(self._compare_fn, 'similarity_matrix', None)
+        if matrix_fn is not None:
+            return matrix_fn(self.thresholds, featuresA, featuresB)
+        scores = [[self._compare_fn(self.thresholds, a, b) for b in featuresB] for a in featuresA]
+        return np.array(scores, dtype=float).reshape(len(featuresA), len(featuresB))
+
     def compare_featurefiles(self, vectorA, vectorB, normalize=True):
-        if normalize:
-            get_score = self.vector_and_normalized_similarity
-        else:
-            get_score = self.vector_similarity
-        pairs = self.get_allowed_pairs(vectorA, vectorB)
-        for vector1, vector2 in pairs:
-            key = self.get_vector_pair_key(vector1, vector2)
-            name = (vector1.name, vector2.name)
-            scores = get_score(vector1, vector2)
-            yield name, scores
+        vectorsA = list(vectorA.vectors)
+        vectorsB = list(vectorB.vectors)
+        idsA = self.get_file_type_ids(vectorA, vectorsA)
+        idsB = self.get_file_type_ids(vectorB, vectorsB)
+        featuresA = np.array([vector.features for vector in vectorsA])
+        featuresB = np.array([vector.features for vector in vectorsB])
+        shape = (len(vectorsA), len(vectorsB))
+        allowed = np.zeros(shape, dtype=bool)
+        raw = np.zeros(shape)
+        normalized = np.zeros(shape)
+
+        # Score each allowed type pair as one block
+        for key, rows, cols in self.get_allowed_type_blocks(idsA, idsB):
+            block = np.ix_(rows, cols)
+            scores = self.similarity_block(featuresA[rows], featuresB[cols])
+            allowed[block] = True
+            raw[block] = scores
+            if normalize:
+                normalized[block] = self._normalize_fn(scores, self.pair_table.coefficient(*key))
+
+        # Emit in the same (row-major) order as walking the full product
+        for i, j in zip(*np.nonzero(allowed)):
+            name = (vectorsA[i].name, vectorsB[j].name)
+            if normalize:
+                yield name, (raw[i, j], normalized[i, j])
+            else:
+                yield name, raw[i, j]
+
+    def get_allowed_pair_counts(self, fileA, fileB):
+        """ Compute intersection and union counts for all allowed vector
+            pairs, one block per allowed type pair. Returns the pair names,
+            pair keys and the matching integer count arrays
+        """
+        vectorsA = list(fileA.vectors)
+        vectorsB = list(fileB.vectors)
+        idsA = self.get_file_type_ids(fileA, vectorsA)
+        idsB = self.get_file_type_ids(fileB, vectorsB)
+        featuresA = np.array([vector.features for vector in vectorsA])
+        featuresB = np.array([vector.features for vector in vectorsB])
+        shape = (len(vectorsA), len(vectorsB))
+        intersections = np.zeros(shape, dtype=int)
+        unions = np.zeros(shape, dtype=int)
+        key_ids = np.full(shape, -1, dtype=int)
+        block_keys = []
+        for key, rows, cols in self.get_allowed_type_blocks(idsA, idsB):
+            block = np.ix_(rows, cols)
+            counts = cutoff_intersection_union_counts(self.thresholds,
+                                                      featuresA[rows],
+                                                      featuresB[cols])
+            intersections[block], unions[block] = counts
+            key_ids[block] = len(block_keys)
+            type_names = [self.pair_table.type_names[type_id] for type_id in key]
+            block_keys.append(self._centers.make_code_pair(type_names))
+
+        rows, cols = np.nonzero(key_ids >= 0)
+        names = [(vectorsA[i].name, vectorsB[j].name) for i, j in zip(rows, cols)]
+        keys = [block_keys[key_id] for key_id in key_ids[rows, cols]]
+        return names, keys, intersections[rows, cols], unions[rows, cols]
+
+    def get_comparison_matrices(self, fileA, fileB, compare_functions,
+                                                    normalizations=None,
+                                                    matrix_wrapper=MatrixValues):
+        """ Score two feature files with several cutoff similarity methods
+            from one shared intersection/union pass. Methods with a
+            normalization table (given in normalizations, keyed like
+            compare_functions, or this background's own for its method)
+            also get normalized scores. Returns an ordered mapping of
+            compare function to comparison matrix
+        """
+        if normalizations is None:
+            normalizations = {}
+        names, keys, intersections, unions = self.get_allowed_pair_counts(fileA, fileB)
+        matrices = collections.OrderedDict()
+        for method in compare_functions:
+            compare_fn = method
+            if isinstance(compare_fn, string_types):
+                compare_fn = defaults.ALLOWED_SIMILARITY_METHODS[compare_fn]
+            if getattr(compare_fn, 'from_counts', None) is None:
+                raise ValueError("Similarity method {0!r} cannot be computed from counts".format(method))
+            norms = normalizations.get(method)
+            if norms is None and compare_fn is self._compare_fn:
+                norms = self._normalizations
+
+            raw = compare_fn.from_counts(intersections, unions)
+            score_names = [RAW_SCORE]
+            if norms is not None:
+                score_names.append(NORMALIZED_SCORE)
+                coefficients = dict((key, norms[key]) for key in set(keys))
+                modes = np.array([coefficients[key] for key in keys], dtype=float)
+                normalized = self._normalize_fn(raw, modes)
+                scores = zip(names, zip(raw, normalized))
+            else:
+                scores = zip(names, ((score,) for score in raw))
+            matrices[method] = matrix_wrapper(scores, value_dims=score_names)
+        return matrices
 
     def get_comparison_matrix(self, vectorA, vectorB, normalize=True,
                                                       matrix_wrapper=MatrixValues):
@@ -157,5 +376,29 @@ class BackgroundEnvironment(object):
     def metadata(self):
         return self._metadata
 
+    @property
+    def std_threshold(self):
+        return self._std_threshold_scale
+
+    @property
+    def residue_centers(self):
+        return self._centers
+
+    @property
+    def compare_function(self):
+        return self._compare_fn
+
+    @property
+    def normalize_function(self):
+        return self._normalize_fn
+
+    @property
+    def scale_function(self):
+        return self._scale_fn
+
+    @property
+    def scale_params(self):
+        return self._scale_params
+
     def scale_alignment_score(self, sizes, score):
         return self._scale_fn(self._scale_params, sizes, score)
@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+import collections
+
+
+class LRUCache(object):
+    """ A bounded mapping that evicts the least recently used entries """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getitem__(self, key):
+        value = self._items.pop(key)
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_or_create(self, key, create):
+        """ Return the cached value for key, calling create() on a miss """
+        try:
+            value = self[key]
+        except KeyError:
+            self.misses += 1
+            value = create()
+            self[key] = value
+        else:
+            self.hits += 1
+        return value
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
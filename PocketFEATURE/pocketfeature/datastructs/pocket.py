@@ -2,7 +2,7 @@ from __future__ import absolute_import
 
 from six import text_type
 
-from feature.io.pointfile import PDBPoint
+from feature.datastructs.points import PointSet
 
 
 class Pocket(object):
@@ -16,6 +16,7 @@ class Pocket(object):
                                  name=None,
                                  residue_centers=None,
                                  points=None,
+                                 features=None,
                                  skip_partial_residues=True):
         self._pdbid = pdbid
         self._residues = residues
@@ -23,7 +24,10 @@ class Pocket(object):
         self._name = name
         self._centers = residue_centers
         self._skip_partial_residues = skip_partial_residues
+        if points is not None:
+            points = PointSet.from_points(points)
         self._points = points
+        self._features = features
 
     @property
     def pickelable(self):
@@ -31,8 +35,9 @@ class Pocket(object):
                       pdbid=self.pdbid,
                       defined_by=self.defined_by,
                       name=self.name,
-                      points=list(self.points),   # Compute to pickle
+                      points=self.points,         # Compute to pickle
                       residue_centers=None,       # Mask to picel
+                      features=self.features,
                       skip_partial_residues=self._skip_partial_residues)
 
     @property
@@ -58,14 +63,27 @@ class Pocket(object):
         elif self._centers is None:
             raise RuntimeError("Residue centers are not defined")
         else:
-            def _gen():
-                for residue in self.residues:
-                    pdbid = self._getResiduePdb(residue)
-                    points = self._get_microenvironments(residue)
-                    for point_type, point in points:
-                        comment = self._getResidueComment(residue, point_type)
-                        yield PDBPoint(*point, pdbid=pdbid, comment=comment)
-            return _gen()
+            coords = []
+            pdbids = []
+            comments = []
+            for residue in self.residues:
+                pdbid = self._getResiduePdb(residue)
+                points = self._get_microenvironments(residue)
+                for point_type, point in points:
+                    coords.append(point)
+                    pdbids.append(pdbid)
+                    comments.append(self._getResidueComment(residue, point_type))
+            return PointSet(coords, pdbids=pdbids, comments=comments)
+
+    @property
+    def features(self):
+        """ FEATURE vectors of the pocket points, if selected from a
+            precomputed center store (otherwise None)
+        """
+        return self._features
+
+    def setFeatures(self, features):
+        self._features = features
 
     @property
     def signature(self):
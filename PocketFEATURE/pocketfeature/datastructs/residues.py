@@ -2,6 +2,9 @@
 from __future__ import absolute_import
 
 import itertools
+from collections import namedtuple
+
+import numpy as np
 
 from Bio.PDB.Polypeptide import three_to_one
 from pocketfeature.utils.pdb import (
@@ -34,6 +37,11 @@ def get_center_code_set(residues_idx, centers, get_code=get_center_code, **kwarg
     return [get_center_code(name, idx, **kwargs) for name, idx in residues_idx]
 
 
+# Centers of many residues: residues[i] is the residue index (in the atom
+# arrays) of the center coded codes[i] at coords[i]
+ResidueCenters = namedtuple('ResidueCenters', ['residues', 'codes', 'coords'])
+
+
 def make_vector_type_key(vector_types):
     return tuple(sorted(map(str, vector_types)))
 
@@ -121,6 +129,89 @@ class CenterCalculator(object):
             return points
         return fn
 
+    def _get_center_slots(self, key, name):
+        """ Indices of the centers of residue type key using atom name """
+        return [idx for idx, center_atoms in enumerate(self.centers.get(key, ()))
+                    if name in center_atoms]
+
+    def get_structure_centers(self, atoms, selected=None,
+                                           skip_partial_residues=True,
+                                           ignore_unknown_residues=True):
+        """ Calculate the centers of every residue of array-form atoms (see
+            pocketfeature.io.structurecache.StructureAtoms) at once, or of
+            the residues with atoms in the selected mask. Centers are
+            ordered by residue index and then as get_center orders them.
+            Atom and residue names come from the arrays rather than
+            get_name and get_key
+        """
+        strict = self.strict and not skip_partial_residues
+        ignore_unknown = self.ignore_unknown or ignore_unknown_residues
+        picked = atoms.located
+        if selected is not None:
+            picked &= selected
+        picked = np.flatnonzero(picked)
+
+        residue_index = atoms.residue_index[picked]
+        keys = np.char.upper(np.char.strip(atoms.resname[picked]))
+        known = np.array([key in self.centers for key in keys.tolist()], dtype=bool)
+        if not ignore_unknown and not known.all():
+            key = keys[np.flatnonzero(~known)[0]]
+            raise ValueError("No residue centers defined for {0} and ignore disabled".format(key))
+
+        # Expand atoms into one row for each center they belong to
+        pairs = np.char.add(np.char.add(keys, b':'), atoms.name[picked])
+        unique_pairs, pair_index = np.unique(pairs, return_inverse=True)
+        pair_slots = [self._get_center_slots(*pair.split(':', 1)) for pair in unique_pairs.tolist()]
+        slot_counts = np.array([len(slots) for slots in pair_slots], dtype=int)
+        slot_starts = np.concatenate(([0], np.cumsum(slot_counts)[:-1]))
+        all_slots = np.array(list(itertools.chain.from_iterable(pair_slots)), dtype=int)
+        atom_counts = slot_counts[pair_index]
+        rows = np.repeat(np.arange(len(picked)), atom_counts)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(atom_counts) - atom_counts, atom_counts)
+        slots = all_slots[np.repeat(slot_starts[pair_index], atom_counts) + offsets]
+
+        # Average the atoms of each (residue, center) that has all of them
+        num_slots = max([len(centers) for centers in self.centers.values()] or [1])
+        groups = residue_index[rows].astype(np.int64) * num_slots + slots
+        group_keys, group_index, group_counts = np.unique(groups, return_inverse=True, return_counts=True)
+        # Summed in float32 and in atom order, like average_coords
+        sums = np.zeros((len(group_keys), 3), dtype=np.float32)
+        np.add.at(sums, group_index, atoms.coords[picked[rows]])
+        group_residues = group_keys // num_slots
+        group_slots = group_keys % num_slots
+        group_rows = np.zeros(len(group_keys), dtype=int)
+        group_rows[group_index] = rows  # Any atom of a group gives its residue type
+        group_keys = keys[group_rows].tolist()
+        expected = np.array([len(self.centers[key][slot])
+                             for key, slot in zip(group_keys, group_slots.tolist())], dtype=int)
+        complete = group_counts == expected
+
+        if strict:
+            self._check_complete_centers(atoms, residue_index[known], keys[known],
+                                         group_residues[complete], group_slots[complete])
+
+        codes = []
+        code_cache = {}
+        for key, slot in zip(itertools.compress(group_keys, complete), group_slots[complete].tolist()):
+            if key not in code_cache:
+                code_cache[key] = self.get_codes(key, range(len(self.centers[key])))
+            codes.append(code_cache[key][slot])
+        coords = sums[complete] / group_counts[complete].astype(np.float32)[:, np.newaxis]
+        return ResidueCenters(group_residues[complete], codes, coords)
+
+    def _check_complete_centers(self, atoms, residue_index, keys, residues, slots):
+        """ Fail on the first residue missing atoms of one of its centers """
+        found = set(zip(residues.tolist(), slots.tolist()))
+        residue_ids = None
+        for residue, key in sorted(set(zip(residue_index.tolist(), keys.tolist()))):
+            for slot, code in enumerate(self.get_codes(key, range(len(self.centers[key])))):
+                if (residue, slot) not in found:
+                    if residue_ids is None:
+                        residue_ids = atoms.get_residue_ids()
+                    res = "/".join(map(str, residue_ids[residue]))
+                    raise ValueError("Missing atoms in {0} ({1}): expected {2}".format(
+                        code, res, self.centers[key][slot]))
+
     def _build_functions(self):
         for key in self.centers.keys():
             key = self.normalize_key(key)
@@ -197,4 +288,32 @@ class CenterCalculator(object):
         return self.get_center(arg, **kwargs)
 
 
+class StructureCenters(object):
+    """ Residue centers of array-form atoms, computed in one call to
+        CenterCalculator.get_structure_centers and looked up by residue
+        like a CenterCalculator. Residues that were not selected, and
+        calls checking partial residues, fall back to the calculator
+    """
 
+    def __init__(self, calculator, atoms, selected=None):
+        self.calculator = calculator
+        centers = calculator.get_structure_centers(atoms, selected=selected)
+        residue_ids = atoms.get_residue_ids()
+        if selected is None:
+            computed = range(len(residue_ids))
+        else:
+            computed = np.unique(atoms.residue_index[selected]).tolist()
+        self.centers = dict((residue_ids[residue], []) for residue in computed)
+        for residue, code, point in zip(centers.residues.tolist(), centers.codes, centers.coords):
+            self.centers[residue_ids[residue]].append((code, point))
+
+    def get_center(self, residue, ignore_unknown_residues=True, skip_partial_residues=True):
+        residue_id = residue.get_full_id()[1:]
+        ignore_unknown = self.calculator.ignore_unknown or ignore_unknown_residues
+        if skip_partial_residues and ignore_unknown and residue_id in self.centers:
+            return list(self.centers[residue_id])
+        return self.calculator.get_center(residue, ignore_unknown_residues=ignore_unknown_residues,
+                                                   skip_partial_residues=skip_partial_residues)
+
+    def __call__(self, residue, **kwargs):
+        return self.get_center(residue, **kwargs)
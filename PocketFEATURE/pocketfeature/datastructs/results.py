@@ -19,5 +19,30 @@ PF_RUN_RESULT_FIELDS = (
     #mcss,
 )
 
+# Columns of the run_pf summary table
+COMPARISON_RESULT_FIELDS = (
+    'pocketA',
+    'pocketB',
+    'numA',
+    'numB',
+    'num_scored',
+    'num_aligned',
+    'alignment_score',
+    'scaled_score',
+    'alignment_rmsd',
+)
+
+SEARCH_RESULT_FIELDS = (
+    'pocket_a',
+    'pocket_b',
+    'num_a',
+    'num_b',
+    'num_scored',
+    'num_aligned',
+    'alignment_score',
+    'scaled_score',
+)
+
 AlignmentResults = namedtuple('AlignmentResults', ALIGNMENT_RESULT_FIELDS)
 PFRunResults = namedtuple('PFRunResults', PF_RUN_RESULT_FIELDS)
+SearchResults = namedtuple('SearchResults', SEARCH_RESULT_FIELDS)
@@ -3,6 +3,15 @@
 #TODO: Integrate metadata into this format to automatically include dimension names
 #TODO: Integrate this with residue definition files
 
+import json
+import struct
+
+import numpy as np
+from six import string_types
+
+from feature.io import metadata as metadatafile
+from feature.io.common import open_compressed
+
 from pocketfeature import defaults
 
 from pocketfeature.utils.ff import (
@@ -14,6 +23,7 @@ from pocketfeature.utils.ff import (
 from pocketfeature.datastructs.residues import CenterCalculator
 from pocketfeature.datastructs.background import (
     BackgroundEnvironment,
+    TypePairTable,
     MEAN_VECTOR,
     STD_DEV_VECTOR,
     NORM_COLUMN,
@@ -29,6 +39,12 @@ from pocketfeature.io import residuefile
 from pocketfeature.io import featurefile
 from pocketfeature.io import matrixvaluesfile
 
+COMPILED_MAGIC = b'PFBGBIN\0'
+COMPILED_VERSION = 1
+COMPILED_ALIGNMENT = 64
+# Magic, format version, header length
+COMPILED_PREFIX = struct.Struct('<8sIQ')
+
 
 def load_normalization_data(io, column=0, metadata=None):
     if metadata is None:
@@ -129,3 +145,158 @@ def load(stats_file, norms_file,
                          scale_params=scale_params,
                          residue_centers=centers)
     return background
+
+
+def _get_method_name(method, methods):
+    if method is None or isinstance(method, string_types):
+        return method
+    for name, candidate in methods.items():
+        if candidate is method:
+            return name
+    raise ValueError("Cannot store unnamed method {0!r} in a compiled background".format(method))
+
+
+def _align(offset):
+    return -(-offset // COMPILED_ALIGNMENT) * COMPILED_ALIGNMENT
+
+
+def is_compiled(path):
+    with open(path, 'rb') as f:
+        return f.read(len(COMPILED_MAGIC)) == COMPILED_MAGIC
+
+
+def dump_compiled(background, path):
+    """ Write a background as a single versioned binary file: a JSON header
+        (metadata, type names and method settings) followed by aligned raw
+        arrays for the standard deviations, means, similarity thresholds,
+        normalization table and allowed pair mask
+    """
+    table = background.pair_table
+    arrays = [
+        ('std_dev', background.standard_deviations.features),
+        ('thresholds', background.thresholds),
+        ('coefficients', table.coefficients),
+        ('allowed', table.allowed),
+    ]
+    if background.mean is not None:
+        arrays.append(('mean', background.mean.features))
+    arrays = [(name, np.ascontiguousarray(values, dtype=np.dtype(values.dtype).newbyteorder('<')))
+              for name, values in arrays]
+
+    centers = background.residue_centers
+    header = {
+        'metadata': metadatafile.dumps(background.metadata),
+        'type_names': table.type_names,
+        'residue_centers': {'centers': centers.centers, 'classes': centers.classes},
+        'compare_function': _get_method_name(background.compare_function,
+                                             defaults.ALLOWED_SIMILARITY_METHODS),
+        'normalize_function': _get_method_name(background.normalize_function,
+                                               defaults.ALLOWED_NORMALIZE_METHODS),
+        'scale_function': _get_method_name(background.scale_function,
+                                           defaults.ALLOWED_SCALE_FUNCTIONS),
+        'scale_params': [list(param) for param in background.scale_params],
+        'std_threshold': background.std_threshold,
+        'arrays': {},
+    }
+
+    # Array offsets depend on the header size, so lay them out relative
+    # to the end of the header and fix them up once its size is known
+    relative = 0
+    for name, values in arrays:
+        relative = _align(relative)
+        header['arrays'][name] = {'offset': relative,
+                                  'dtype': values.dtype.str,
+                                  'shape': list(values.shape)}
+        relative += values.nbytes
+    encoded = json.dumps(header, sort_keys=True)
+    start = _align(COMPILED_PREFIX.size + len(encoded) + 64)
+    for descriptor in header['arrays'].values():
+        descriptor['offset'] += start
+    encoded = json.dumps(header, sort_keys=True).encode('utf-8')
+    if COMPILED_PREFIX.size + len(encoded) > start:
+        raise ValueError("Compiled background header outgrew its reserved space")
+
+    with open(path, 'wb') as f:
+        f.write(COMPILED_PREFIX.pack(COMPILED_MAGIC, COMPILED_VERSION, len(encoded)))
+        f.write(encoded)
+        for name, values in arrays:
+            f.seek(header['arrays'][name]['offset'])
+            f.write(values.tobytes())
+
+
+def load_compiled(path, wrapper=BackgroundEnvironment,
+                        vector_type=get_vector_type,
+                        metadata=None,
+                        mmap_mode='r'):
+    """ Open a compiled background in one call. Arrays are memory-mapped
+        read-only by default (mmap_mode=None reads them into memory)
+    """
+    with open(path, 'rb') as f:
+        magic, version, header_size = COMPILED_PREFIX.unpack(f.read(COMPILED_PREFIX.size))
+        if magic != COMPILED_MAGIC:
+            raise ValueError("{0} is not a compiled background".format(path))
+        if version != COMPILED_VERSION:
+            raise ValueError("Unsupported compiled background version {0} in {1}".format(version, path))
+        header = json.loads(f.read(header_size).decode('utf-8'))
+
+    arrays = {}
+    for name, descriptor in header['arrays'].items():
+        dtype = np.dtype(str(descriptor['dtype']))
+        shape = tuple(descriptor['shape'])
+        if mmap_mode is None:
+            with open(path, 'rb') as f:
+                f.seek(descriptor['offset'])
+                values = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        else:
+            values = np.memmap(path, dtype=dtype, mode=mmap_mode,
+                                     offset=descriptor['offset'],
+                                     shape=shape)
+        arrays[name] = values
+
+    if metadata is None:
+        metadata = PocketFeatureBackgroundStatisticsMetaData()
+    metadata.set_raw_fields(metadatafile.get_metadata(header['metadata'].splitlines()))
+    std_dev = metadata.create_vector(name=STD_DEV_VECTOR, features=arrays['std_dev'])
+    if 'mean' in arrays:
+        mean = metadata.create_vector(name=MEAN_VECTOR, features=arrays['mean'])
+    else:
+        mean = None
+
+    centers = header['residue_centers']
+    classes = centers['classes']
+    if classes is not None:
+        classes = dict((name, tuple(tuple(member) for member in members))
+                       for name, members in classes.items())
+    centers = CenterCalculator(centers['centers'], classes)
+    table = TypePairTable(header['type_names'], arrays['coefficients'], arrays['allowed'])
+
+    background = wrapper(std_dev=std_dev,
+                         mean=mean,
+                         metadata=metadata,
+                         vector_type=vector_type,
+                         compare_function=header['compare_function'],
+                         normalize_function=header['normalize_function'],
+                         scale_function=header['scale_function'],
+                         scale_params=header['scale_params'],
+                         std_threshold=header['std_threshold'],
+                         thresholds=arrays['thresholds'],
+                         residue_centers=centers,
+                         pair_table=table)
+    return background
+
+
+def load_from_paths(stats_path, norms_path=None, **kwargs):
+    """ Load a background given file paths, accepting either a compiled
+        background or a statistics FEATURE file with its normalizations.
+        Method settings are fixed in compiled backgrounds, so only the
+        load_compiled options are used for them
+    """
+    if is_compiled(stats_path):
+        compiled_kwargs = dict((key, kwargs[key]) for key in ('wrapper', 'vector_type', 'metadata')
+                                                  if key in kwargs)
+        return load_compiled(stats_path, **compiled_kwargs)
+    if norms_path is None:
+        raise ValueError("A normalization file is required for {0}".format(stats_path))
+    with open_compressed(stats_path) as stats_file:
+        with open_compressed(norms_path) as norms_file:
+            return load(stats_file, norms_file, **kwargs)
@@ -0,0 +1,91 @@
+from __future__ import absolute_import, print_function
+
+import json
+import os
+
+import numpy as np
+
+from pocketfeature.algorithms import (
+    CutoffScoreHistogram,
+    GaussianStats,
+)
+
+
+SETTINGS_FILE = 'settings.json'
+VECTOR_STATS_FILE = 'vectors.npz'
+TYPES_DIR = 'types'
+HISTOGRAMS_DIR = 'histograms'
+
+
+def ensure_state_dirs(state_dir):
+    for path in (state_dir,
+                 os.path.join(state_dir, TYPES_DIR),
+                 os.path.join(state_dir, HISTOGRAMS_DIR)):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+
+def load_settings(state_dir):
+    path = os.path.join(state_dir, SETTINGS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def dump_settings(settings, state_dir):
+    path = os.path.join(state_dir, SETTINGS_FILE)
+    with open(path, 'w') as f:
+        json.dump(settings, f, indent=2, sort_keys=True)
+
+
+def load_vector_stats(state_dir):
+    path = os.path.join(state_dir, VECTOR_STATS_FILE)
+    if not os.path.exists(path):
+        return GaussianStats(mode_binning=None)
+    raw = np.load(path)
+    return GaussianStats(n=int(raw['n']),
+                         mean=raw['mean'],
+                         m2=raw['m2'],
+                         mins=raw['mins'],
+                         maxes=raw['maxes'],
+                         mode_binning=None)
+
+
+def dump_vector_stats(stats, state_dir):
+    path = os.path.join(state_dir, VECTOR_STATS_FILE)
+    with open(path, 'wb') as f:
+        np.savez(f, n=stats.n,
+                    mean=stats.mean,
+                    m2=stats.m2,
+                    mins=stats.mins,
+                    maxes=stats.maxes)
+
+
+def get_type_prefix(state_dir, res_type):
+    return os.path.join(state_dir, TYPES_DIR, res_type)
+
+
+def get_histogram_path(state_dir, key):
+    name = "{0}-{1}.npz".format(*key)
+    return os.path.join(state_dir, HISTOGRAMS_DIR, name)
+
+
+def load_histogram(path, num_features, score_function, mode_binning=None):
+    """ Restore a score histogram saved as its non-zero cells """
+    histogram = CutoffScoreHistogram(num_features, score_function, mode_binning=mode_binning)
+    if os.path.exists(path):
+        raw = np.load(path)
+        if int(raw['num_features']) != num_features:
+            raise ValueError("Histogram {0} has a different number of features".format(path))
+        histogram.counts.flat[raw['cells']] = raw['counts']
+    return histogram
+
+
+def dump_histogram(histogram, path):
+    counts = histogram.counts
+    cells = np.flatnonzero(counts)
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, num_features=counts.shape[0] - 1,
+                               cells=cells,
+                               counts=counts.flat[cells])
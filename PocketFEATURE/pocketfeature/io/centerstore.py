@@ -0,0 +1,148 @@
+""" Per-structure stores of FEATURE vectors for every residue center
+
+    Each structure is a column store (see pocketfeature.io.datastore) whose
+    names column holds center keys ("<chain>:<resnum>:<icode>:<code>") plus
+    a copy of the FEATURE metadata, so pockets can be built by selecting
+    rows instead of calling featurize
+"""
+from __future__ import absolute_import, print_function
+
+import os
+
+import numpy as np
+
+from feature.datastructs.features import FeatureFile
+from feature.datastructs.points import (
+    PDBPoint,
+    Point3D,
+)
+from feature.io import metadata as metadatafile
+
+from pocketfeature.datastructs.metadata import PocketFeatureFeatureFileMetaData
+from pocketfeature.io import datastore
+
+
+METADATA_SUFFIX = '.metadata'
+
+
+def make_center_key(chain, resnum, icode, code):
+    return ":".join((str(chain).strip(), str(resnum), str(icode).strip(), code))
+
+
+def get_center_key(residue, code):
+    _, _, chain, (_, resnum, icode) = residue.get_full_id()
+    return make_center_key(chain, resnum, icode, code)
+
+
+def get_structure_prefix(store_dir, pdbid):
+    return os.path.join(store_dir, pdbid.lower())
+
+
+def exists(prefix):
+    return datastore.exists(prefix) and os.path.exists(prefix + METADATA_SUFFIX)
+
+
+def iter_structure_centers(structure, residue_centers, excluded=None, skip_partial_residues=True):
+    """ Generate (residue, center code, coordinates) for every residue
+        center of a structure
+    """
+    for residue in structure.get_residues():
+        if excluded is not None and excluded(residue):
+            continue
+        centers = residue_centers(residue, skip_partial_residues=skip_partial_residues,
+                                           ignore_unknown_residues=True)
+        for code, point in centers:
+            yield residue, code, point
+
+
+def iter_atoms_centers(atoms, calculator, selected=None):
+    """ Generate (center key, center code, coordinates) for every residue
+        center of array-form atoms (see pocketfeature.io.structurecache),
+        calculated together by a CenterCalculator
+    """
+    centers = calculator.get_structure_centers(atoms, selected=selected)
+    residue_ids = atoms.get_residue_ids()
+    for residue, code, point in zip(centers.residues.tolist(), centers.codes, centers.coords):
+        model, chain, (hetflag, resnum, icode) = residue_ids[residue]
+        yield make_center_key(chain, resnum, icode, code), code, point
+
+
+def make_center_point(pdbid, residue, code, point):
+    """ A featurize input point describing a residue center """
+    return make_keyed_center_point(pdbid, get_center_key(residue, code), code, point)
+
+
+def make_keyed_center_point(pdbid, key, code, point):
+    comment = "\t#\t".join(("{0}_{1}".format(pdbid, key.replace(':', '_')), code))
+    return PDBPoint(*point, pdbid=pdbid, comment=comment)
+
+
+def dump(keys, features, prefix):
+    """ Write the vectors of one structure, with keys[i] naming the center
+        of features.vectors[i]
+    """
+    columns = datastore.vectors_to_columns(features.vectors)
+    columns = columns._replace(names=np.array(list(keys), dtype=np.string_))
+    if len(columns.names) != len(columns.features):
+        raise ValueError("Got {0} keys for {1} vectors".format(len(columns.names), len(columns.features)))
+    datastore.dump_columns(columns, prefix)
+    with open(prefix + METADATA_SUFFIX, 'w') as f:
+        metadatafile.dump(features.metadata, f)
+
+
+class CenterStore(object):
+    """ The residue center vectors of one structure """
+
+    def __init__(self, prefix, metadata=None, mmap_mode='r'):
+        self.prefix = prefix
+        self.columns = datastore.load(prefix, mmap_mode=mmap_mode)
+        if metadata is None:
+            metadata = PocketFeatureFeatureFileMetaData()
+        with open(prefix + METADATA_SUFFIX) as f:
+            metadata.set_raw_fields(metadatafile.get_metadata(line for line in f if line.strip()))
+        self.metadata = metadata
+        self.index = dict((key, idx) for idx, key in enumerate(self.columns.names.tolist()))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def select(self, keys):
+        """ Row indices of centers, failing on any that were not stored """
+        try:
+            return [self.index[key] for key in keys]
+        except KeyError as e:
+            raise ValueError("Center {0} is not in {1}".format(e.args[0], self.prefix))
+
+    def get_vectors(self, keys, names=None, comments=None, container=FeatureFile):
+        """ Build FEATURE vectors for centers, optionally renamed and
+            commented as if featurized from a pocket's points
+        """
+        rows = self.select(keys)
+        features = self.columns.features[rows]
+        coords = self.columns.coords[rows]
+        if names is None:
+            names = keys
+        if comments is None:
+            comments = [[key] for key in keys]
+        vectors = [self.metadata.create_vector(name=name,
+                                               features=vector_features,
+                                               point=Point3D(*point),
+                                               comments=list(vector_comments))
+                   for name, vector_features, point, vector_comments
+                   in zip(names, features, coords, comments)]
+        return container(self.metadata, vectors)
+
+
+def load(prefix, metadata=None, mmap_mode='r'):
+    return CenterStore(prefix, metadata=metadata, mmap_mode=mmap_mode)
+
+
+def load_structure(store_dir, pdbid, **kwargs):
+    """ Open the store of a structure, or return None if it was not computed """
+    prefix = get_structure_prefix(store_dir, pdbid)
+    if not exists(prefix):
+        return None
+    return load(prefix, **kwargs)
@@ -0,0 +1,113 @@
+from __future__ import absolute_import, print_function
+
+import os
+from collections import namedtuple
+
+import numpy as np
+from six import string_types
+
+from feature.io.featurefile import DESCRIPTION
+
+
+FEATURES_SUFFIX = '.features.npy'
+NAMES_SUFFIX = '.names.npy'
+COORDS_SUFFIX = '.coords.npy'
+PDBIDS_SUFFIX = '.pdbids.npy'
+
+FeatureColumns = namedtuple('FeatureColumns', ['features', 'names', 'coords', 'pdbids'])
+
+
+def get_column_paths(prefix):
+    return FeatureColumns(features=prefix + FEATURES_SUFFIX,
+                          names=prefix + NAMES_SUFFIX,
+                          coords=prefix + COORDS_SUFFIX,
+                          pdbids=prefix + PDBIDS_SUFFIX)
+
+
+def exists(prefix):
+    return all(os.path.exists(path) for path in get_column_paths(prefix))
+
+
+def is_current(prefix, source):
+    """ Check that a column store exists and is not older than its source """
+    if not exists(prefix):
+        return False
+    source_mtime = os.path.getmtime(source)
+    return all(os.path.getmtime(path) >= source_mtime for path in get_column_paths(prefix))
+
+
+def get_vector_pdbid(vector, comment_field=DESCRIPTION):
+    """ The source PDB of a vector. Vectors of pocket points rarely carry
+        a usable PDB ID (it is often [] or ['None']), so it is otherwise
+        taken from the first '_' token of the vector's DESCRIPTION or name
+        (e.g. 1qrd from 1qrd_A_274_FAD_11_H_1_A)
+    """
+    pdbid = vector.pdbid
+    if not isinstance(pdbid, string_types):
+        pdbid = pdbid[0] if len(pdbid) == 1 else ''
+    if pdbid and pdbid != 'None':
+        return pdbid
+    try:
+        description = vector.get_named_comment(comment_field).split()[0]
+    except (ValueError, IndexError, AttributeError):
+        description = str(vector.name)
+    return description.split('_')[0]
+
+
+def vectors_to_columns(vectors):
+    """ Gather FEATURE vectors into a feature matrix with name, coordinate
+        and source PDB side arrays
+    """
+    vectors = list(vectors)
+    if len(vectors) > 0:
+        features = np.array([vector.features for vector in vectors], dtype=float)
+    else:
+        features = np.zeros((0, 0))
+    names = np.array([str(vector.name) for vector in vectors], dtype=np.string_)
+    pdbids = np.array([get_vector_pdbid(vector) for vector in vectors], dtype=np.string_)
+    coords = np.full((len(vectors), 3), np.nan)
+    for idx, vector in enumerate(vectors):
+        if vector.coords is not None:
+            coords[idx] = vector.coords
+    return FeatureColumns(features=features, names=names, coords=coords, pdbids=pdbids)
+
+
+def dump_columns(columns, prefix):
+    paths = get_column_paths(prefix)
+    for path, values in zip(paths, columns):
+        np.save(path, values)
+    return paths
+
+
+def dump(vectors, prefix):
+    """ Write FEATURE vectors as a feature matrix with name, coordinate and
+        source PDB side arrays. All arrays are plain (non-object) .npy
+        files so they can be memory-mapped when loaded
+    """
+    return dump_columns(vectors_to_columns(vectors), prefix)
+
+
+def append(vectors, prefix):
+    """ Add FEATURE vectors to the end of a column store, creating it if
+        needed. Returns the number of rows stored before appending
+    """
+    added = vectors_to_columns(vectors)
+    if not exists(prefix):
+        dump_columns(added, prefix)
+        return 0
+    existing = load(prefix, mmap_mode=None)
+    num_existing = len(existing.features)
+    if len(added.features) > 0:
+        combined = [np.concatenate([old, new]) if len(old) > 0 else new
+                    for old, new in zip(existing, added)]
+        dump_columns(FeatureColumns(*combined), prefix)
+    return num_existing
+
+
+def load(prefix, mmap_mode='r'):
+    """ Open a column store, memory-mapping each array read-only by default """
+    paths = get_column_paths(prefix)
+    return FeatureColumns(features=np.load(paths.features, mmap_mode=mmap_mode),
+                          names=np.load(paths.names, mmap_mode=mmap_mode),
+                          coords=np.load(paths.coords, mmap_mode=mmap_mode),
+                          pdbids=np.load(paths.pdbids, mmap_mode=mmap_mode))
@@ -0,0 +1,248 @@
+""" Pocket libraries pack the FEATURE vectors of many pockets into one
+    indexed file. The file starts with a fixed header pointing at a JSON
+    index (stored last, so pockets can be appended) and holds one aligned
+    feature block and one coordinate block per pocket, with each pocket's
+    vectors grouped by residue type. Metadata is stored once per library
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from feature.datastructs.features import FeatureFile
+from feature.datastructs.points import (
+    Point3D,
+    PointSet,
+)
+from feature.io import metadata as metadatafile
+
+from pocketfeature.datastructs.metadata import PocketFeatureFeatureFileMetaData
+from pocketfeature.utils.ff import get_vector_type
+
+LIBRARY_MAGIC = b'PFPOCKET'
+LIBRARY_VERSION = 1
+LIBRARY_ALIGNMENT = 64
+# Magic, format version, index offset, index length
+LIBRARY_HEADER = struct.Struct('<8sIQQ')
+FEATURE_DTYPE = np.dtype('<f8')
+
+
+def _align(offset):
+    return -(-offset // LIBRARY_ALIGNMENT) * LIBRARY_ALIGNMENT
+
+
+def is_library(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(LIBRARY_MAGIC)) == LIBRARY_MAGIC
+
+
+def _read_index(f):
+    f.seek(0)
+    magic, version, index_offset, index_size = LIBRARY_HEADER.unpack(f.read(LIBRARY_HEADER.size))
+    if magic != LIBRARY_MAGIC:
+        raise ValueError("{0} is not a pocket library".format(getattr(f, 'name', '<stream>')))
+    if version != LIBRARY_VERSION:
+        raise ValueError("Unsupported pocket library version {0}".format(version))
+    f.seek(index_offset)
+    return index_offset, json.loads(f.read(index_size).decode('utf-8'))
+
+
+def _write_index(f, index, index_offset):
+    encoded = json.dumps(index, sort_keys=True).encode('utf-8')
+    f.seek(index_offset)
+    f.write(encoded)
+    f.truncate()
+    f.seek(0)
+    f.write(LIBRARY_HEADER.pack(LIBRARY_MAGIC, LIBRARY_VERSION, index_offset, len(encoded)))
+
+
+def _vector_type_or_blank(vector):
+    try:
+        return get_vector_type(vector)
+    except (IndexError, ValueError):
+        return ''
+
+
+def _write_pocket(f, offset, signature, features):
+    """ Write one pocket's blocks at offset, returning its index entry and
+        the offset following it
+    """
+    vectors = sorted(features.vectors, key=_vector_type_or_blank)
+    types = [_vector_type_or_blank(vector) for vector in vectors]
+    num_features = features.metadata.num_features
+    matrix = np.zeros((len(vectors), num_features), dtype=FEATURE_DTYPE)
+    coords = np.full((len(vectors), 3), np.nan, dtype=FEATURE_DTYPE)
+    for idx, vector in enumerate(vectors):
+        matrix[idx] = vector.features
+        if vector.coords is not None:
+            coords[idx] = vector.coords
+
+    type_ranges = {}
+    for idx, vector_type in enumerate(types):
+        start, _ = type_ranges.get(vector_type, (idx, idx))
+        type_ranges[vector_type] = (start, idx + 1)
+
+    features_offset = _align(offset)
+    coords_offset = _align(features_offset + matrix.nbytes)
+    f.seek(features_offset)
+    f.write(matrix.tobytes())
+    f.seek(coords_offset)
+    f.write(coords.tobytes())
+    entry = {
+        'signature': signature,
+        'count': len(vectors),
+        'features_offset': features_offset,
+        'coords_offset': coords_offset,
+        'names': [str(vector.name) for vector in vectors],
+        'comments': [list(vector.comments) for vector in vectors],
+        'types': dict((vector_type, list(bounds)) for vector_type, bounds in type_ranges.items()),
+    }
+    return entry, coords_offset + coords.nbytes
+
+
+def _write_pockets(f, index, offset, pockets):
+    known = set(entry['signature'] for entry in index['pockets'])
+    for signature, features in pockets:
+        if signature in known:
+            raise ValueError("Pocket {0} is already in the library".format(signature))
+        if index['metadata'] is None:
+            index['metadata'] = metadatafile.dumps(features.metadata)
+            index['num_features'] = features.metadata.num_features
+        elif features.metadata.num_features != index['num_features']:
+            raise ValueError("Pocket {0} has {1} features, not {2}".format(
+                signature, features.metadata.num_features, index['num_features']))
+        entry, offset = _write_pocket(f, offset, signature, features)
+        index['pockets'].append(entry)
+        known.add(signature)
+    return offset
+
+
+def dump(pockets, path):
+    """ Write (signature, FEATURE file) pairs to a new pocket library """
+    index = {'metadata': None, 'num_features': None, 'pockets': []}
+    with open(path, 'wb') as f:
+        f.write(LIBRARY_HEADER.pack(LIBRARY_MAGIC, LIBRARY_VERSION, 0, 0))
+        offset = _write_pockets(f, index, LIBRARY_HEADER.size, pockets)
+        _write_index(f, index, offset)
+    return len(index['pockets'])
+
+
+def append(pockets, path):
+    """ Add (signature, FEATURE file) pairs to a pocket library, creating
+        it if needed. Returns the number of pockets stored before appending
+    """
+    if not os.path.exists(path):
+        dump(pockets, path)
+        return 0
+    with open(path, 'r+b') as f:
+        _, index = _read_index(f)
+        num_existing = len(index['pockets'])
+        # New blocks and the new index go after the current index, which
+        # stays valid until the header is rewritten last
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        try:
+            offset = _write_pockets(f, index, end, pockets)
+        except Exception:
+            f.truncate(end)
+            raise
+        _write_index(f, index, offset)
+    return num_existing
+
+
+class PocketLibrary(object):
+    """ Read access to a pocket library. Feature blocks are memory-mapped,
+        so opening a library only reads its index
+    """
+
+    def __init__(self, path, metadata=None):
+        self.path = path
+        with open(path, 'rb') as f:
+            _, index = _read_index(f)
+        if metadata is None:
+            metadata = PocketFeatureFeatureFileMetaData()
+        if index['metadata'] is not None:
+            metadata.set_raw_fields(metadatafile.get_metadata(index['metadata'].splitlines()))
+        self.metadata = metadata
+        self.num_features = index['num_features']
+        self._entries = index['pockets']
+        self._positions = dict((entry['signature'], idx) for idx, entry in enumerate(self._entries))
+        if len(self._entries) > 0:
+            self._data = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            self._data = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, signature):
+        return signature in self._positions
+
+    @property
+    def signatures(self):
+        return [entry['signature'] for entry in self._entries]
+
+    def get_entry(self, signature):
+        return self._entries[self._positions[signature]]
+
+    def _block(self, offset, shape):
+        size = int(np.prod(shape)) * FEATURE_DTYPE.itemsize
+        return self._data[offset:offset + size].view(FEATURE_DTYPE).reshape(shape)
+
+    def get_features(self, signature, vector_type=None):
+        """ The feature matrix of a pocket, or of its vectors of one type """
+        entry = self.get_entry(signature)
+        features = self._block(entry['features_offset'], (entry['count'], self.num_features))
+        if vector_type is None:
+            return features
+        start, stop = entry['types'].get(vector_type, (0, 0))
+        return features[start:stop]
+
+    def get_coords(self, signature):
+        entry = self.get_entry(signature)
+        return self._block(entry['coords_offset'], (entry['count'], 3))
+
+    def get_vector_types(self, signature):
+        """ Map each residue type of a pocket to its (start, stop) rows """
+        return dict((vector_type, tuple(bounds))
+                    for vector_type, bounds in self.get_entry(signature)['types'].items())
+
+    def get(self, signature, container=FeatureFile):
+        """ Rebuild the FEATURE file of a pocket """
+        entry = self.get_entry(signature)
+        features = self.get_features(signature)
+        coords = self.get_coords(signature)
+        vectors = []
+        for idx, (name, comments) in enumerate(zip(entry['names'], entry['comments'])):
+            if np.isnan(coords[idx]).any():
+                point = None
+            else:
+                point = Point3D(*coords[idx])
+            vectors.append(self.metadata.create_vector(name=str(name),
+                                                      features=features[idx],
+                                                      point=point,
+                                                      comments=[str(comment) for comment in comments]))
+        return container(self.metadata, vectors)
+
+    def get_points(self, signature, pdbid=None):
+        """ Rebuild the points a pocket was featurized from """
+        entry = self.get_entry(signature)
+        if pdbid is None:
+            pdbid = signature.split('_')[0]
+        return PointSet(self.get_coords(signature),
+                        pdbids=pdbid,
+                        comments=[list(comments) for comments in entry['comments']])
+
+    def iter_pockets(self, start=None, stop=None):
+        """ Generate (signature, FEATURE file) for a slice of the library """
+        for entry in self._entries[start:stop]:
+            yield entry['signature'], self.get(entry['signature'])
+
+
+def load(path, metadata=None):
+    return PocketLibrary(path, metadata=metadata)
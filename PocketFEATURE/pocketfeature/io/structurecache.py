@@ -0,0 +1,308 @@
+""" A cache of parsed structures stored as atom arrays
+
+    PDB files are parsed once (by BioPython's PDBParser, recording each
+    atom instead of building objects) into per-atom arrays of coordinates,
+    names, elements, residue names and numbers, chains, altlocs and het
+    flags. These are written to an .npz file keyed by the PDB path, size
+    and modification time. BioPython structures are only built on request,
+    and only for the residues asked for, by replaying the atoms into a
+    StructureBuilder exactly as PDBParser would have.
+
+    Anisotropic B-factors and header records are not kept.
+"""
+from __future__ import absolute_import, print_function
+
+import gzip
+import hashlib
+import os
+import tempfile
+import warnings
+
+import numpy as np
+
+from Bio.PDB.PDBExceptions import (
+    PDBConstructionException,
+    PDBConstructionWarning,
+)
+from Bio.PDB.PDBParser import PDBParser
+from Bio.PDB.StructureBuilder import StructureBuilder
+
+
+ENTRY_SUFFIX = '.npz'
+CACHE_VERSION = 1
+
+ATOM_FIELDS = (
+    ('model', np.int32),  # Index of the model (as numbered by PDBParser)
+    ('model_serial', np.int32),  # -1 where no MODEL record gave one
+    ('segid', np.string_),
+    ('chain', np.string_),
+    ('hetflag', np.string_),  # ' ', 'W' or 'H'
+    ('resseq', np.int32),
+    ('icode', np.string_),
+    ('resname', np.string_),
+    ('name', np.string_),
+    ('fullname', np.string_),
+    ('altloc', np.string_),
+    ('coords', np.float32),  # PDBParser stores coordinates as float32
+    ('bfactor', np.float64),
+    ('occupancy', np.float64),  # NaN where PDBParser would use None
+    ('serial', np.int32),
+    ('element', np.string_),
+)
+ATOM_FIELD_NAMES = tuple(name for name, dtype in ATOM_FIELDS)
+
+
+class _AtomRecorder(StructureBuilder):
+    """ A StructureBuilder for PDBParser that records the atoms it is given
+        instead of building BioPython objects
+    """
+
+    def __init__(self):
+        StructureBuilder.__init__(self)
+        self.rows = dict((name, []) for name in ATOM_FIELD_NAMES)
+        self.model = -1
+        self.model_serial = 0
+        self.segid = None
+        self.chain = None
+        self.residue = None
+
+    def init_structure(self, structure_id):
+        pass
+
+    def init_model(self, model_id, serial_num=None):
+        self.model = model_id
+        self.model_serial = serial_num if serial_num is not None else -1
+
+    def init_seg(self, segid):
+        self.segid = segid
+
+    def init_chain(self, chain_id):
+        self.chain = chain_id
+
+    def init_residue(self, resname, field, resseq, icode):
+        self.residue = (field, resseq, icode, resname)
+
+    def init_atom(self, name, coord, b_factor, occupancy, altloc, fullname,
+                  serial_number=None, element=None):
+        hetflag, resseq, icode, resname = self.residue
+        values = (self.model, self.model_serial, self.segid, self.chain,
+                  hetflag, resseq, icode, resname,
+                  name, fullname, altloc, coord, b_factor,
+                  np.nan if occupancy is None else occupancy,
+                  serial_number or 0, element or '')
+        for field, value in zip(ATOM_FIELD_NAMES, values):
+            self.rows[field].append(value)
+
+    def set_anisou(self, anisou_array):
+        pass
+
+    def set_siguij(self, siguij_array):
+        pass
+
+    def set_sigatm(self, sigatm_array):
+        pass
+
+    def set_header(self, header):
+        pass
+
+    def get_structure(self):
+        arrays = {}
+        for name, dtype in ATOM_FIELDS:
+            values = self.rows[name]
+            if name == 'coords':
+                arrays[name] = np.array(values, dtype=dtype).reshape(-1, 3)
+            else:
+                arrays[name] = np.array(values, dtype=dtype)
+        return StructureAtoms(**arrays)
+
+
+class StructureAtoms(object):
+    """ The atoms of a parsed PDB file as parallel arrays, in file order """
+
+    def __init__(self, **arrays):
+        for name in ATOM_FIELD_NAMES:
+            setattr(self, name, arrays[name])
+        self._residue_index = None
+
+    def __len__(self):
+        return len(self.coords)
+
+    @property
+    def residue_index(self):
+        """ For each atom, the index of its residue (unique per model,
+            chain and residue id, in order of first appearance)
+        """
+        if self._residue_index is None:
+            keys = list(zip(self.model.tolist(), self.chain.tolist(), self.hetflag.tolist(),
+                            self.resseq.tolist(), self.icode.tolist()))
+            index = {}
+            self._residue_index = np.array([index.setdefault(key, len(index)) for key in keys],
+                                           dtype=np.int32)
+        return self._residue_index
+
+    @property
+    def het(self):
+        """ Atoms of het residues (ligands and waters) """
+        return self.hetflag != b' '
+
+    @property
+    def located(self):
+        """ Mask the location BioPython selects for each atom name of a
+            residue: the first atom without an altloc, or else the first
+            with the highest occupancy
+        """
+        occupancy = np.where(np.isnan(self.occupancy), -np.inf, self.occupancy)
+        priority = np.where(self.altloc == b' ', np.inf, occupancy)
+        order = np.lexsort((np.arange(len(self)), -priority, self.name, self.residue_index))
+        residues = self.residue_index[order]
+        names = self.name[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (residues[1:] != residues[:-1]) | (names[1:] != names[:-1])
+        mask = np.zeros(len(self), dtype=bool)
+        mask[order[first]] = True
+        return mask
+
+    def get_residue_ids(self):
+        """ The BioPython (model, chain, residue id) of each residue index """
+        residues, first = np.unique(self.residue_index, return_index=True)
+        ids = []
+        for model, chain, hetflag, resseq, icode, resname in zip(self.model[first].tolist(),
+                                                                self.chain[first].tolist(),
+                                                                self.hetflag[first].tolist(),
+                                                                self.resseq[first].tolist(),
+                                                                self.icode[first].tolist(),
+                                                                self.resname[first].tolist()):
+            if hetflag == 'H':
+                hetflag = 'H_' + resname
+            ids.append((model, chain, (hetflag, resseq, icode)))
+        return ids
+
+    def select_residues(self, atom_mask):
+        """ Mask every atom of any residue with an atom in atom_mask """
+        residue_index = self.residue_index
+        selected = np.unique(residue_index[atom_mask])
+        return np.in1d(residue_index, selected)
+
+    def to_structure(self, pdbid, atom_mask=None):
+        """ Build a BioPython structure from the atoms in atom_mask (or all
+            atoms). Every model and chain is created, even when none of its
+            atoms are selected, so structures built from a subset can be
+            focused like the complete structure
+        """
+        builder = StructureBuilder()
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", category=PDBConstructionWarning)
+            builder.init_structure(pdbid)
+            model = segid = chain = residue = None
+            columns = [getattr(self, name).tolist() for name in ATOM_FIELD_NAMES]
+            if atom_mask is None:
+                selected = [True] * len(self)
+            else:
+                selected = np.asarray(atom_mask, dtype=bool).tolist()
+            for use, row in zip(selected, zip(*columns)):
+                (atom_model, model_serial, atom_segid, atom_chain,
+                 hetflag, resseq, icode, resname,
+                 name, fullname, altloc, coord, bfactor, occupancy,
+                 serial, element) = row
+                # Replays PDBParser's calls to its StructureBuilder
+                if atom_model != model:
+                    model = atom_model
+                    chain = residue = None
+                    builder.init_model(model, model_serial if model_serial >= 0 else None)
+                if atom_segid != segid:
+                    segid = atom_segid
+                    builder.init_seg(segid)
+                if atom_chain != chain:
+                    chain = atom_chain
+                    residue = None
+                    builder.init_chain(chain)
+                if not use:
+                    # Skipping atoms keeps the current residue, so the rest
+                    # of a partly selected residue is added to it
+                    continue
+                if residue != (hetflag, resseq, icode, resname):
+                    residue = (hetflag, resseq, icode, resname)
+                    try:
+                        builder.init_residue(resname, hetflag, resseq, icode)
+                    except PDBConstructionException:
+                        pass
+                try:
+                    builder.init_atom(name, np.array(coord, dtype=np.float32),
+                                      bfactor,
+                                      None if np.isnan(occupancy) else occupancy,
+                                      altloc, fullname, serial, element)
+                except PDBConstructionException:
+                    pass
+            return builder.get_structure()
+
+
+def parse(stream):
+    """ Read the atoms of a PDB file from a stream """
+    parser = PDBParser(PERMISSIVE=True, QUIET=True, structure_builder=_AtomRecorder())
+    return parser.get_structure(None, stream)
+
+
+def parse_file(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path) as f:
+        return parse(f)
+
+
+def dump(atoms, path):
+    arrays = dict((name, getattr(atoms, name)) for name in ATOM_FIELD_NAMES)
+    np.savez(path, version=np.array(CACHE_VERSION), **arrays)
+
+
+def load(path):
+    with np.load(path) as data:
+        if int(data['version']) != CACHE_VERSION:
+            raise ValueError("Unsupported structure cache version in {0}".format(path))
+        return StructureAtoms(**dict((name, data[name]) for name in ATOM_FIELD_NAMES))
+
+
+class StructureCache(object):
+    """ Parsed structures stored under a cache directory """
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_entry_path(self, path):
+        stat = os.stat(path)
+        key = "{0}:{1}:{2}".format(os.path.abspath(path), stat.st_mtime, stat.st_size)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest + ENTRY_SUFFIX)
+
+    def load_atoms(self, path):
+        """ The atoms of a PDB file, parsing and storing them if needed """
+        entry_path = self.get_entry_path(path)
+        if os.path.exists(entry_path):
+            try:
+                return load(entry_path)
+            except (IOError, ValueError, KeyError):
+                pass  # Unreadable or outdated entries are rebuilt
+        atoms = parse_file(path)
+
+        # Written to a temporary file first so concurrent workers never
+        # read a partial entry
+        directory = os.path.dirname(entry_path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=ENTRY_SUFFIX)
+        with os.fdopen(fd, 'wb') as f:
+            dump(atoms, f)
+        os.rename(tmp_path, entry_path)
+        return atoms
+
+    def load_structure(self, path, pdbid):
+        """ A complete BioPython structure of a PDB file """
+        return self.load_atoms(path).to_structure(pdbid)
+
+
+def open_cache(root):
+    if root is None:
+        return None
+    return StructureCache(root)
@@ -0,0 +1,143 @@
+""" A content-addressed cache of featurized residue centers
+
+    Vectors are stored per structure, in one gzipped JSON file for each
+    (PDB file hash, FEATURE parameters) pair, and keyed within it by chain,
+    residue number, center code and coordinates. Pockets that share
+    residues, and repeated comparisons of one structure, reuse the same
+    vectors whatever pocket signature they are featurized under
+"""
+from __future__ import absolute_import, print_function
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from feature.io.locate_files import find_pdb_file
+
+from pocketfeature.datastructs.cache import LRUCache
+
+
+ENTRY_SUFFIX = '.json.gz'
+# FEATURE settings that can change computed vectors
+ENVIRONMENT_PARAMETERS = ('FEATURE_DIR',)
+# Structures kept in memory between lookups
+DEFAULT_MAX_ENTRIES = 64
+
+
+def hash_file(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_parameters(featurize_args):
+    """ Digest featurize arguments, ignoring environment paths that only
+        tell FEATURE where to find its inputs
+    """
+    featurize_args = dict(featurize_args or {})
+    environ = featurize_args.pop('environ', None) or os.environ
+    params = sorted((key, repr(value)) for key, value in featurize_args.items())
+    params.extend((key, environ.get(key)) for key in ENVIRONMENT_PARAMETERS)
+    return hashlib.sha1(json.dumps(params).encode('utf-8')).hexdigest()
+
+
+def get_point_key(point):
+    """ Identify a residue center by chain, residue number, center code and
+        coordinates. Point comments look like "<pocket>_<resnum>_<res>_<idx>_<chain>",
+        optionally followed by the center code (e.g. "Y1")
+    """
+    coords = "{0:.3f},{1:.3f},{2:.3f}".format(*point.coords)
+    comment = point.comment
+    if isinstance(comment, (list, tuple)):
+        comment = "\t#\t".join(comment)
+    parts = [part.strip() for part in comment.split('#')]
+    residue = parts[0].split()[0].rsplit('_', 4)[1:] if parts[0] else []
+    if len(residue) < 4:
+        return coords
+    resnum, resletter, idx, chain = residue
+    center = parts[1] if len(parts) > 1 and parts[1] else resletter + idx
+    return ":".join((chain, resnum, center, coords))
+
+
+class VectorCache(object):
+    """ Featurized residue centers stored under a cache directory. The most
+        recently used structures are also kept in memory
+    """
+
+    def __init__(self, root, max_entries=DEFAULT_MAX_ENTRIES):
+        self.root = root
+        self._entries = LRUCache(max_entries)
+        self._file_hashes = {}
+
+    def get_structure_hash(self, pdbid, environ=None):
+        """ Hash the PDB file FEATURE would read for pdbid (or None if it
+            cannot be found)
+        """
+        environ = environ or os.environ
+        try:
+            path = find_pdb_file(pdbid, pdbdirList=environ.get('PDB_DIR') or '')
+        except ValueError:
+            return None
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+        if key not in self._file_hashes:
+            self._file_hashes[key] = hash_file(path)
+        return self._file_hashes[key]
+
+    def get_entry_path(self, structure_hash, params_hash):
+        name = "{0}-{1}{2}".format(structure_hash, params_hash[:16], ENTRY_SUFFIX)
+        return os.path.join(self.root, structure_hash[:2], name)
+
+    def read_entry(self, structure_hash, params_hash):
+        """ Read a structure's entry from disk, bypassing memory """
+        path = self.get_entry_path(structure_hash, params_hash)
+        if os.path.exists(path):
+            with gzip.open(path, 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        return {'header': None, 'vectors': {}}
+
+    def load_entry(self, structure_hash, params_hash):
+        """ The header lines and {point key: feature text} map of a structure """
+        return self._entries.get_or_create((structure_hash, params_hash),
+                                           lambda: self.read_entry(structure_hash, params_hash))
+
+    def update_entry(self, structure_hash, params_hash, header, vectors):
+        """ Add newly featurized centers to a structure and rewrite it """
+        # Merge with the entry currently on disk so centers written by other
+        # workers since it was loaded are not dropped by the rewrite
+        entry = self.read_entry(structure_hash, params_hash)
+        cached = self._entries.get((structure_hash, params_hash))
+        for source in (cached, {'header': header, 'vectors': vectors}):
+            if source is None:
+                continue
+            if entry['header'] is None:
+                entry['header'] = source['header']
+            entry['vectors'].update(source['vectors'])
+        self._entries[structure_hash, params_hash] = entry
+
+        # Written to a temporary file first so concurrent workers never
+        # read a partial entry
+        path = self.get_entry_path(structure_hash, params_hash)
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=ENTRY_SUFFIX)
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.write(json.dumps(entry, sort_keys=True).encode('utf-8'))
+        os.rename(tmp_path, path)
+        return entry
+
+
+def open_cache(root, max_entries=DEFAULT_MAX_ENTRIES):
+    if root is None:
+        return None
+    return VectorCache(root, max_entries=max_entries)
@@ -5,12 +5,101 @@ except ImportError as e:
     def featurize_points_raw(*args, **kwargs):
         raise e
 
+from feature.io.metadata import is_metadata_line
+
 from pocketfeature.io import featurefile
+from pocketfeature.io.vectorcache import (
+    get_point_key,
+    hash_parameters,
+)
+
+
+VECTOR_LINE = "Env_{pdbid}_{idx}\t{features}\t#\t{x:.3f}\t{y:.3f}\t{z:.3f}\t#\t{comment}\n"
+
+
+def _split_vector_line(line):
+    """ Separate the name of a featurize output line from the rest """
+    name, rest = line.split('\t', 1)
+    return rest
+
+
+def _get_cached_features(line):
+    """ The feature values of a featurize output line, without comments """
+    return _split_vector_line(line).split('#', 1)[0].strip()
+
+
+def _format_point_comment(point):
+    if isinstance(point.comment, (list, tuple)):
+        return "\t#\t".join(point.comment)
+    return point.comment
+
+
+def featurize_points_raw_cached(pointslist, cache, **featurize_args):
+    """ Featurize points, only running featurize for residue centers that
+        are not already in cache. Returns featurize output lines in point
+        order
+    """
+    points = list(pointslist)
+    environ = featurize_args.get('environ')
+    params_hash = hash_parameters(featurize_args)
+
+    keys = []
+    entries = {}
+    for point in points:
+        structure_hash = cache.get_structure_hash(point.pdbid, environ=environ)
+        if structure_hash is not None and structure_hash not in entries:
+            entries[structure_hash] = cache.load_entry(structure_hash, params_hash)
+        keys.append((structure_hash, get_point_key(point)))
+
+    missing = [idx for idx, (structure_hash, key) in enumerate(keys)
+                   if structure_hash is None or key not in entries[structure_hash]['vectors']]
+
+    header = None
+    computed = {}
+    if len(missing) > 0:
+        lines = list(featurize_points_raw([points[idx] for idx in missing], **featurize_args))
+        header = [line for line in lines if is_metadata_line(line)]
+        vector_lines = [line for line in lines if line.strip() and not is_metadata_line(line)]
+        if len(vector_lines) != len(missing):
+            raise RuntimeError("featurize returned {0} vectors for {1} points".format(
+                len(vector_lines), len(missing)))
+        computed = dict(zip(missing, vector_lines))
+
+        updates = {}
+        for idx, line in computed.items():
+            structure_hash, key = keys[idx]
+            if structure_hash is not None:
+                updates.setdefault(structure_hash, {})[key] = _get_cached_features(line)
+        for structure_hash, vectors in updates.items():
+            cache.update_entry(structure_hash, params_hash, header, vectors)
+
+    if header is None:
+        header = next((entry['header'] for entry in entries.values()
+                                       if entry['header'] is not None), [])
+
+    output = list(header)
+    for idx, point in enumerate(points):
+        if idx in computed:
+            rest = _split_vector_line(computed[idx])
+            output.append("Env_{0}_{1}\t{2}".format(point.pdbid, idx, rest))
+        else:
+            structure_hash, key = keys[idx]
+            output.append(VECTOR_LINE.format(pdbid=point.pdbid,
+                                             idx=idx,
+                                             features=entries[structure_hash]['vectors'][key],
+                                             x=point.x,
+                                             y=point.y,
+                                             z=point.z,
+                                             comment=_format_point_comment(point)))
+    return output
 
 
-def featurize_points(pointslist, featurize_args=None, featurefile_args=None):
+def featurize_points(pointslist, featurize_args=None, featurefile_args=None, cache=None):
     featurize_args = featurize_args or {}
     featurefile_args = featurefile_args or {}
-    data = featurize_points_raw(pointslist, **featurize_args)
+    if cache is not None:
+        data = featurize_points_raw_cached(pointslist, cache, **featurize_args)
+    else:
+        data = featurize_points_raw(pointslist, **featurize_args)
     ff = featurefile.load(data, **featurefile_args)
     return ff
@@ -1,14 +1,22 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
+import itertools
+import operator
+
 from six import string_types
-from numpy.linalg import norm
-from Bio.PDB.NeighborSearch import NeighborSearch
+import numpy as np
+from scipy.spatial import cKDTree
 
 from pocketfeature.io import (
     residuefile,
 )
+from pocketfeature.io.centerstore import get_center_key
 from pocketfeature.datastructs.pocket import Pocket
+from pocketfeature.datastructs.residues import (
+    CenterCalculator,
+    StructureCenters,
+)
 from pocketfeature import defaults
 from pocketfeature.utils.pdb import (
     residue_name,
@@ -52,58 +60,137 @@ def focus_structure(structure, model=0, chain=None):
     return focus
 
 
+def get_center_calculator(residue_centers):
+    """ Resolve a named center set or center definitions to a
+        CenterCalculator (or None for other center functions)
+    """
+    if isinstance(residue_centers, string_types):
+        residue_centers = defaults.NAMED_RESIDUE_CENTERS[residue_centers]
+    if isinstance(residue_centers, tuple):
+        residue_centers = CenterCalculator(*residue_centers)
+    if isinstance(residue_centers, CenterCalculator):
+        return residue_centers
+    return None
+
+
+def get_residue_center_function(residue_centers):
+    """ Resolve a named center set, center definitions or CenterCalculator
+        to a function mapping residues to (code, point) centers
+    """
+    calculator = get_center_calculator(residue_centers)
+    if calculator is not None:
+        return calculator.get_center
+    return residue_centers
+
+
+class AtomIndex(object):
+    """ A KD-tree over the atoms of a structure that can answer searches
+        for any model or chain of it, so one parse and one index serve
+        every pocket extracted from a structure
+    """
+
+    def __init__(self, structure, excluded=is_het_residue):
+        self.atoms = [atom for atom in structure.get_atoms() if not excluded(atom.get_parent())]
+        if len(self.atoms) > 0:
+            self.tree = cKDTree(np.array([atom.get_coord() for atom in self.atoms], dtype=float))
+        else:
+            self.tree = None
+
+    def find_residues(self, queries, cutoff, within=None):
+        """ Residues (in structure order) with an atom within cutoff of any
+            query, optionally restricted to those inside the entity within
+        """
+        if self.tree is None or len(queries) == 0:
+            return []
+        found = sorted(set(itertools.chain.from_iterable(self.tree.query_ball_point(queries, cutoff))))
+        if within is not None:
+            prefix = within.get_full_id()
+            in_focus = lambda residue: residue.get_full_id()[:len(prefix)] == prefix
+        else:
+            in_focus = lambda residue: True
+        residues = []
+        picked = set()
+        for idx in found:
+            residue = self.atoms[idx].get_parent()
+            if residue not in picked and in_focus(residue):
+                picked.add(residue)
+                residues.append(residue)
+        return residues
+
+
 def find_neighboring_residues_and_points(structure, queries, cutoff=6.0,
                                                              ordered=True,
                                                              excluded=is_het_residue,
                                                              residue_centers=None,
-                                                             skip_partial_residues=True):
-
-    all_atoms = list(structure.get_atoms())
-    neighbors = NeighborSearch(all_atoms)
-    residues = []
-    picked = set()
-    for query in queries:  # Search through query points
-        found = neighbors.search(query, cutoff, 'R')  # Search of Residues
-        found = [res for res in found if not excluded(res) and res not in picked]
-        if residue_centers is None:  # If adding any points
-            picked.add(found)
-            residues.extend(found)
-        else:  # Check if any active sites are within cutuff
-            for residue in found:
-                centers = residue_centers(residue, skip_partial_residues=skip_partial_residues,
-                                                   ignore_unknown_residues=True)
-
-                meets_cutoff = [any((norm(q - pt) <= cutoff) for q in queries) for code, pt in centers]
-                if any(meets_cutoff):
-                    close_centers = [center for center, close in zip(centers, meets_cutoff) if close]
-                    residue_points = (residue, close_centers)
-                    residues.append(residue_points)
-                    picked.add(residue)
+                                                             skip_partial_residues=True,
+                                                             atom_index=None):
+    """ Find residues with an atom within cutoff of any query point. With
+        residue_centers, only residues having centers within cutoff of a
+        query are kept, as (residue, close centers) pairs.
+
+        All queries are answered at once from a KD-tree of the structure's
+        atoms (atom_index, if already built for the structure or a parent
+        of it), and center distances are checked against a KD-tree of the
+        queries, so large ligands do not need a search per atom
+    """
+    queries = np.asarray(queries, dtype=float).reshape(-1, 3)
+    if atom_index is None:
+        atom_index = AtomIndex(structure, excluded=excluded)
+        residues = atom_index.find_residues(queries, cutoff)
+    else:
+        residues = atom_index.find_residues(queries, cutoff, within=structure)
+
+    if residue_centers is not None:
+        residue_points = [(residue, residue_centers(residue, skip_partial_residues=skip_partial_residues,
+                                                            ignore_unknown_residues=True))
+                          for residue in residues]
+        centers = [center for residue, found_centers in residue_points for center in found_centers]
+        if len(centers) > 0:
+            query_tree = cKDTree(queries)
+            distances, _ = query_tree.query(np.array([point for code, point in centers], dtype=float))
+            close = iter(distances <= cutoff)
+        residues = []
+        for residue, found_centers in residue_points:
+            close_centers = [center for center in found_centers if next(close)]
+            if len(close_centers) > 0:
+                residues.append((residue, close_centers))
+
     if ordered:
-        residues = sorted(residues, key=lambda pair: pair[0].get_id()[1])
+        get_residue = operator.itemgetter(0) if residue_centers is not None else lambda residue: residue
+        residues = sorted(residues, key=lambda item: get_residue(item).get_id()[1])
 
     return residues
 
 
+def get_ligand_points(ligand, expand_disordered=True):
+    atoms = list(ligand)
+    if expand_disordered:
+        atoms = [atom_pos for atom in atoms
+                          for atom_pos in (atom.disordered_get_list()
+                           if atom.is_disordered() else [atom])]
+    return [atom.get_coord() for atom in atoms]
+
+
 def create_pocket_around_ligand(structure, ligand, cutoff=6.0,
                                                    name=None,
                                                    residue_centers=defaults.DEFAULT_RESIDUE_CENTERS,
                                                    exact_points=True,
                                                    expand_disordered=True,
+                                                   center_store=None,
+                                                   atom_index=None,
                                                    **options):
-    if isinstance(residue_centers, string_types):
-        residue_centers = defaults.NAMED_RESIDUE_CENTERS[residue_centers]
-    atoms = list(ligand)
-    if expand_disordered:
-        atoms = [atom_pos for atom in atoms
-                          for atom_pos in (atom.disordered_get_list()
-                           if atom.is_disordered() else [atom])]
-    points = [atom.get_coord() for atom in atoms]
+    """ Build the pocket of residue centers near a ligand. If center_store
+        (a CenterStore of the structure) is given, the pocket's FEATURE
+        vectors are selected from it instead of needing featurize
+    """
+    residue_centers = get_residue_center_function(residue_centers)
+    points = get_ligand_points(ligand, expand_disordered=expand_disordered)
 
     residue_points = find_neighboring_residues_and_points(structure, points, cutoff=cutoff,
                                                                              ordered=True,
                                                                              excluded=is_het_residue,
-                                                                             residue_centers=residue_centers)
+                                                                             residue_centers=residue_centers,
+                                                                             atom_index=atom_index)
     residue_points = list(residue_points)
     residues = [residue for residue, points in residue_points]
 
@@ -118,9 +205,22 @@ def create_pocket_around_ligand(structure, ligand, cutoff=6.0,
                               defined_by=ligand,
                               name=name,
                               residue_centers=selected_centers)
+    if center_store is not None:
+        pocket.setFeatures(select_pocket_features(pocket, residue_points, center_store))
     return pocket
 
 
+def select_pocket_features(pocket, residue_points, center_store):
+    """ Select the stored vectors of a pocket's residue centers, named
+        and commented as featurize would from the pocket's points
+    """
+    keys = [get_center_key(residue, code) for residue, centers in residue_points
+                                         for code, point in centers]
+    comments = [comment.split("\t#\t") for comment in pocket.points.comments]
+    names = [comment[0] for comment in comments]
+    return center_store.get_vectors(keys, names=names, comments=comments)
+
+
 def find_ligand_in_structure(structure, ligand_name, index=0):
     lig_id = residuefile.read_residue_id(ligand_name)
     if isinstance(lig_id, string_types):
@@ -150,3 +250,104 @@ def pick_best_ligand(structure):
         return sorted(ligands, key=len, reverse=True)[0]
     except IndexError:
         return None
+
+
+def find_selected_ligand(structure, selector, if_no_ligand=pick_best_ligand):
+    """ Find the ligand described by a (chain, residue id, ligand name)
+        selector, returning it with the part of the structure searched.
+        A None selector picks a ligand with if_no_ligand
+    """
+    if selector is None:
+        return structure, if_no_ligand(structure)
+    chain_id, res_id, ligand_name = selector
+    focus = focus_structure(structure, chain=chain_id)
+    if res_id is not None:
+        ligand = find_ligand_in_structure(focus, res_id)
+    else:
+        ligand = find_ligand_in_structure(focus, ligand_name)
+    return focus, ligand
+
+
+def extract_pockets(structure, selectors, cutoff=6.0,
+                                          residue_centers=defaults.DEFAULT_RESIDUE_CENTERS,
+                                          if_no_ligand=pick_best_ligand,
+                                          **options):
+    """ Extract the pocket of every ligand selector from one parsed
+        structure, sharing a single atom index. Returns a pocket (or None
+        if the ligand was not found) for each selector
+    """
+    residue_centers = get_residue_center_function(residue_centers)
+    atom_index = AtomIndex(structure)
+    pockets = []
+    for selector in selectors:
+        focus, ligand = find_selected_ligand(structure, selector, if_no_ligand=if_no_ligand)
+        if ligand is None:
+            pockets.append(None)
+        else:
+            pockets.append(create_pocket_around_ligand(focus, ligand, cutoff=cutoff,
+                                                                      residue_centers=residue_centers,
+                                                                      atom_index=atom_index,
+                                                                      **options))
+    return pockets
+
+
+def _get_selector_residue_mask(atoms, selectors):
+    """ Mask atoms of het residues and of any residue a ligand selector
+        could name, by residue name or number
+    """
+    mask = atoms.het.copy()
+    resnames = np.char.strip(atoms.resname)
+    for selector in selectors:
+        if selector is None:
+            continue
+        chain_id, res_id, ligand_name = selector
+        lig_id = residuefile.read_residue_id(res_id if res_id is not None else ligand_name)
+        if isinstance(lig_id, string_types):
+            mask |= resnames == lig_id
+        elif isinstance(lig_id, int):
+            mask |= atoms.resseq == lig_id
+        else:
+            pdb, model, chain, res, name = lig_id
+            if res is not None:
+                mask |= atoms.resseq == res
+            if name is not None:
+                mask |= resnames == name
+    return mask
+
+
+def extract_pockets_from_atoms(atoms, pdbid, selectors, cutoff=6.0,
+                                                        residue_centers=defaults.DEFAULT_RESIDUE_CENTERS,
+                                                        if_no_ligand=pick_best_ligand,
+                                                        **options):
+    """ Extract pockets as extract_pockets does, from the atom arrays of a
+        structure (see pocketfeature.io.structurecache). Ligands are found
+        in a structure of only het and selectable residues, and the final
+        structure is built from those plus the residues with an atom within
+        cutoff of a ligand, whose centers are all calculated in one call.
+        if_no_ligand only sees het residues
+    """
+    candidates = _get_selector_residue_mask(atoms, selectors)
+    ligand_structure = atoms.to_structure(pdbid, atoms.select_residues(candidates))
+    points = []
+    for selector in selectors:
+        focus, ligand = find_selected_ligand(ligand_structure, selector, if_no_ligand=if_no_ligand)
+        if ligand is not None:
+            points.extend(get_ligand_points(ligand, expand_disordered=True))
+
+    selected = candidates
+    protein = np.flatnonzero(~atoms.het)
+    if len(points) > 0 and len(protein) > 0:
+        tree = cKDTree(atoms.coords[protein].astype(float))
+        found = itertools.chain.from_iterable(tree.query_ball_point(np.array(points, dtype=float), cutoff))
+        neighbors = np.zeros(len(atoms), dtype=bool)
+        neighbors[protein[sorted(set(found))]] = True
+        selected = selected | neighbors
+    selected = atoms.select_residues(selected)
+    calculator = get_center_calculator(residue_centers)
+    if calculator is not None:
+        residue_centers = StructureCenters(calculator, atoms, selected=selected & ~atoms.het)
+    structure = atoms.to_structure(pdbid, selected)
+    return extract_pockets(structure, selectors, cutoff=cutoff,
+                                                 residue_centers=residue_centers,
+                                                 if_no_ligand=if_no_ligand,
+                                                 **options)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, print_function
+
+import argparse
+import itertools
+import logging
+import multiprocessing
+import sys
+
+from feature.io.common import open_compressed
+
+from pocketfeature import defaults
+from pocketfeature.datastructs.matrixvalues import PassThroughItems
+from pocketfeature.io import (
+    backgroundfile,
+    matrixvaluesfile,
+)
+from pocketfeature.operations.align import make_updated_methods
+from pocketfeature.tasks.core import (
+    Task,
+    ensure_all_imap_unordered_results_finish,
+)
+from pocketfeature.tasks.search import (
+    align_pocket_features,
+    open_pocket_library,
+)
+from pocketfeature.utils.args import LOG_LEVELS
+
+
+ALL_VS_ALL_COLUMNS = (
+    'num_a',
+    'num_b',
+    'num_scored',
+    'num_aligned',
+    'alignment_score',
+    'scaled_score',
+)
+DEFAULT_BLOCK_SIZE = 16
+
+# Pockets and settings shared by every block in a process. Workers
+# receive them once, when they are forked, instead of with every block
+_all_vs_all_state = {}
+
+
+def parse_shard(value):
+    """ Parse an "i/n" shard selection (1 <= i <= n) """
+    try:
+        index, count = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shard must look like i/n, not {0!r}".format(value))
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("Shard {0} is not between 1 and {1}".format(index, count))
+    return index, count
+
+
+def iter_symmetric_blocks(num_items, block_size):
+    """ Generate (rows, cols) index ranges covering the upper triangle of
+        an all-vs-all comparison, one pair of item blocks at a time
+    """
+    starts = range(0, num_items, block_size)
+    blocks = [range(start, min(start + block_size, num_items)) for start in starts]
+    return itertools.combinations_with_replacement(blocks, 2)
+
+
+def select_shard(tasks, shard=None):
+    """ Deterministically keep every n-th task starting at the i-th """
+    if shard is None:
+        return list(tasks)
+    index, count = shard
+    return [task for idx, task in enumerate(tasks) if idx % count == index - 1]
+
+
+def iter_block_pairs(rows, cols, include_self=True):
+    for i in rows:
+        for j in cols:
+            if i < j or (include_self and i == j):
+                yield i, j
+
+
+def compare_pocket_block(pockets, names, rows, cols, align_method, scale_function,
+                         cutoff=defaults.DEFAULT_SCORE_CUTOFF,
+                         include_self=True,
+                         background=None):
+    """ Compare every pair in a block of the upper triangle. Returns the
+        results and the pairs that could not be compared
+    """
+    results = []
+    failed = []
+    for i, j in iter_block_pairs(rows, cols, include_self=include_self):
+        try:
+            result = align_pocket_features(background, pockets[i], pockets[j],
+                                           align_method, scale_function,
+                                           cutoff=cutoff,
+                                           nameA=names[i],
+                                           nameB=names[j])
+        except Exception as e:
+            failed.append(((names[i], names[j]), str(e)))
+        else:
+            results.append(result)
+    return results, failed
+
+
+def _set_all_vs_all_state(**state):
+    _all_vs_all_state.clear()
+    _all_vs_all_state.update(state)
+
+
+def _compare_pocket_block_star(block):
+    rows, cols = block
+    return compare_pocket_block(rows=rows, cols=cols, **_all_vs_all_state)
+
+
+def merge_score_files(sources, output):
+    """ Concatenate (optionally gzipped) shard score files, keeping a
+        single header
+    """
+    header = None
+    for source in sources:
+        with open_compressed(source) as f:
+            first = next(f, None)
+            if first is None:
+                continue
+            if header is None:
+                header = first
+                output.write(header)
+            elif first != header:
+                raise ValueError("{0} does not have the same columns as the other shards".format(source))
+            for line in f:
+                output.write(line)
+
+
+class CompareAllPockets(Task):
+    BACKGROUND_FF_DEFAULT = 'background.ff'
+    BACKGROUND_COEFF_DEFAULT = 'background.coeffs'
+    DEFAULT_CUTOFF = -0.15
+
+    def run(self):
+        params = self.params
+        logging.basicConfig(stream=params.log)
+        log = logging.getLogger('pf_allvsall')
+        log.setLevel(LOG_LEVELS.get(params.log_level, 'debug'))
+        self.log = log
+
+        if params.merge:
+            log.info("Merging {0} shards".format(len(params.sources)))
+            merge_score_files(params.sources, params.output)
+            return
+
+        if len(params.sources) != 1:
+            log.error("Expected one pocket set (got {0})".format(len(params.sources)))
+            sys.exit(-1)
+
+        log.info("Loading background")
+        background = backgroundfile.load_from_paths(params.background, params.normalization,
+                                                    compare_function=params.compare_method,
+                                                    allowed_pairs=params.allowed_pairs,
+                                                    std_threshold=params.std_threshold)
+
+        library = open_pocket_library(params.sources[0], log=log)
+        names = library.signatures
+        blocks = iter_symmetric_blocks(len(names), params.block_size)
+        blocks = select_shard(blocks, params.shard)
+        if params.shard is not None:
+            log.info("Selected {0} blocks for shard {1}/{2}".format(len(blocks), *params.shard))
+
+        # Only pockets appearing in this shard need to be loaded
+        needed = sorted(set(itertools.chain.from_iterable(rows + cols for rows, cols in blocks)))
+        log.info("Loading {0} of {1} pockets".format(len(needed), len(names)))
+        pockets = dict((idx, library.get(names[idx])) for idx in needed)
+
+        _set_all_vs_all_state(background=background,
+                              pockets=pockets,
+                              names=names,
+                              align_method=make_updated_methods()[params.alignment_method],
+                              scale_function=defaults.ALLOWED_SCALE_FUNCTIONS[params.scale_method],
+                              cutoff=params.cutoff,
+                              include_self=not params.exclude_self_comparisons)
+
+        num_blocks = len(blocks)
+        if params.num_processors is not None and params.num_processors > 1:
+            log.info("Comparing with {0} workers".format(params.num_processors))
+            self.pool = multiprocessing.Pool(params.num_processors)
+            raw_results = self.pool.imap_unordered(_compare_pocket_block_star, blocks)
+            block_results = ensure_all_imap_unordered_results_finish(raw_results, expected=num_blocks)
+        else:
+            block_results = itertools.imap(_compare_pocket_block_star, blocks)
+
+        items = self.collect_results(block_results, num_blocks)
+        values_out = PassThroughItems(items, dims=2, dim_refs=dict(enumerate(ALL_VS_ALL_COLUMNS)))
+        matrixvaluesfile.dump(values_out, params.output, header=True)
+        log.info("Compared {0} pocket pairs ({1} failed)".format(self.compared, self.failed))
+
+    def collect_results(self, block_results, num_blocks):
+        """ Flatten block results into score matrix entries, logging failures """
+        self.compared = 0
+        self.failed = 0
+        for idx, (results, failed) in enumerate(block_results, start=1):
+            for key, error in failed:
+                self.log.warning("Could not compare {0}: {1}".format(":".join(key), error))
+            self.failed += len(failed)
+            self.compared += len(results)
+            for result in results:
+                key = (result.pocket_a, result.pocket_b)
+                yield key, tuple(getattr(result, column) for column in ALL_VS_ALL_COLUMNS)
+            if self.params.progress:
+                print("\r{0} of {1} blocks compared ({2} pairs, {3} failed)".format(
+                        idx, num_blocks, self.compared, self.failed), end="", file=sys.stderr)
+                sys.stderr.flush()
+        if self.params.progress:
+            print("", file=sys.stderr)
+
+    @classmethod
+    def arguments(cls, stdin, stdout, stderr, environ, task_name):
+        from argparse import ArgumentParser
+        from pocketfeature.utils.args import FileType
+
+        parser = ArgumentParser(
+            """Compare every pair of pockets in a set of featurized pockets""")
+        parser.add_argument('sources', metavar='POCKETS',
+                                       nargs='+',
+                                       help='Pocket library, directory of pocket FEATURE files or a file'
+                                            ' listing their paths (shard score files with --merge)')
+        parser.add_argument('-b', '--background', metavar='FEATURESTATS',
+                                                  default=cls.BACKGROUND_FF_DEFAULT,
+                                                  help='FEATURE file containing standard devations of background'
+                                                       ' or a compiled background [default: %(default)s]')
+        parser.add_argument('-n', '--normalization', metavar='COEFFICIENTS',
+                                      default=cls.BACKGROUND_COEFF_DEFAULT,
+                                      help='Map of normalization coefficients for residue type pairs [default: %(default)s]')
+        parser.add_argument('-p', '--allowed-pairs', metavar='PAIR_SET_NAME',
+                                      choices=defaults.ALLOWED_VECTOR_TYPE_PAIRS.keys(),
+                                      default=defaults.DEFAULT_VECTOR_TYPE_PAIRS,
+                                      help='Alignment method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-t', '--std-threshold', metavar='NSTD',
+                                     type=float,
+                                     default=1.0,
+                                     help="Number of standard deviations between to features to allow as 'similar'")
+        parser.add_argument('-C', '--compare-method', metavar='COMPARISON',
+                                              choices=defaults.ALLOWED_SIMILARITY_METHODS.keys(),
+                                              default=defaults.DEFAULT_SIMILARITY_METHOD,
+                                              help='Comparison method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-A', '--alignment-method', metavar='ALIGNMENT',
+                                              choices=defaults.ALLOWED_ALIGNMENT_METHODS.keys(),
+                                              default=defaults.DEFAULT_ALIGNMENT_METHOD,
+                                              help='Alignment method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-S', '--scale-method', metavar='SCALING',
+                                              choices=defaults.ALLOWED_SCALE_FUNCTIONS.keys(),
+                                              default=defaults.DEFAULT_SCALE_FUNCTION,
+                                              help='Scoring scaling method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-c', '--cutoff', metavar='CUTOFF',
+                                              type=float,
+                                              default=cls.DEFAULT_CUTOFF,
+                                              help='Minium score (cutoff) to align [default: %(default)s]')
+        parser.add_argument('--exclude-self-comparisons', action='store_true',
+                                                          default=False,
+                                                          help='Do not compare pockets with themselves [default: %(default)s]')
+        parser.add_argument('--block-size', metavar='POCKETS',
+                                            type=int,
+                                            default=DEFAULT_BLOCK_SIZE,
+                                            help='Number of pockets per side of a scheduled block [default: %(default)s]')
+        parser.add_argument('--shard', metavar='I/N',
+                                       type=parse_shard,
+                                       default=None,
+                                       help='Only compute the I-th of N deterministic shards [default: all]')
+        parser.add_argument('--merge', action='store_true',
+                                       default=False,
+                                       help='Merge shard score files into OUTPUT instead of comparing [default: %(default)s]')
+        parser.add_argument('-o', '--output', metavar='SCORES',
+                                              type=FileType.compressed('w'),
+                                              default=stdout,
+                                              help='Path to score matrix file [default: STDOUT]')
+        parser.add_argument('-P', '--num-processors', metavar='PROCS',
+                                                      default=1,
+                                                      type=int,
+                                                      help='Number of processes to use [default: %(default)s]')
+        parser.add_argument('--progress', action='store_true',
+                                          default=False,
+                                          help='Show interactive progress [default: %(default)s]')
+        parser.add_argument('--log', metavar='LOG',
+                                     type=FileType,
+                                     default=stderr,
+                                     help='Path to log errors [default: STDERR]')
+        parser.add_argument('--log-level', metavar='LEVEL',
+                                           choices=LOG_LEVELS.keys(),
+                                           default='info',
+                                           nargs='?',
+                                           help="Set log level (%(choices)s) [default: %(default)s]")
+        return parser
+
+
+if __name__ == '__main__':
+    sys.exit(CompareAllPockets.run_as_script())
@@ -54,8 +54,8 @@ def run_pf_comparison(root, pdbA, pdbB, cutoffs, params):
         'pdbA': open_compressed(pdbA),
         'pdbB': open_compressed(pdbB),
 
-        'background': open(params['background']),
-        'normalization': open(params['normalization']),
+        'background': params['background'],
+        'normalization': params.get('normalization'),
 
         'ptfA': open(os.path.join(comp_dir, pdbidA + ".ptf"), 'w'),
         'ptfB': open(os.path.join(comp_dir, pdbidB + ".ptf"), 'w'),
@@ -73,6 +73,7 @@ def run_pf_comparison(root, pdbA, pdbB, cutoffs, params):
 
         'ptf_cache': params.get('ptf_cache'),
         'ff_cache': params.get('ff_cache'),
+        'vector_cache': params.get('vector_cache'),
     }
     if params.get('pdb_dir'):
         job_files['pdb_dir'] = params['pdb_dir']
@@ -200,6 +201,10 @@ class BenchmarkPocketFeatureBackground(Task):
             self.ptf_cache = params.ptf_cache
         else:
             self.ptf_cache = os.path.join(cache_dir, '{pdbid}.ptf.gz')
+        if params.vector_cache:
+            self.vector_cache = params.vector_cache
+        else:
+            self.vector_cache = os.path.join(cache_dir, 'vectors')
 
         log.info("PDB_DIR is {0}".format(params.pdb_dir))
         log.info("DSSP_DIR is {0}".format(params.dssp_dir))
@@ -207,6 +212,7 @@ class BenchmarkPocketFeatureBackground(Task):
     
         log.info("FF_CACHE is {0}".format(self.ff_cache))
         log.info("PTF_CACHE is {0}".format(self.ptf_cache))
+        log.info("VECTOR_CACHE is {0}".format(self.vector_cache))
 
         if os.path.exists(params.bench_dir):
             if params.resume:
@@ -270,6 +276,7 @@ class BenchmarkPocketFeatureBackground(Task):
             'dssp_dir': self.params.dssp_dir,
             'ff_cache': self.ff_cache,
             'ptf_cache': self.ptf_cache,
+            'vector_cache': self.vector_cache,
             'compare_method': self.params.compare_method,
             'alignment_method': self.params.alignment_method,
             'scale_method': self.params.scale_method,
@@ -454,6 +461,9 @@ class BenchmarkPocketFeatureBackground(Task):
         parser.add_argument('--ptf-cache', metavar='PTF_CACHE_DIR',
                                            help='Directory to cache Point files [default: BENCH_DIR/cache]',
                                            default=None)
+        parser.add_argument('--vector-cache', metavar='VECTOR_CACHE_DIR',
+                                              help='Directory to cache featurized residue centers [default: BENCH_DIR/cache/vectors]',
+                                              default=None)
         parser.add_argument('-P', '--num-processors', metavar='PROCS',
                                                       default=1,
                                                       type=int,
@@ -8,6 +8,12 @@ import logging
 import multiprocessing
 import os
 import random
+import zlib
+
+from collections import (
+    deque,
+    OrderedDict,
+)
 
 from six import string_types
 
@@ -21,8 +27,20 @@ from feature.io.locate_files import (
     find_pdb_file,
     find_dssp_file,
 )
-from pocketfeature.algorithms import GaussianStats
+from feature.properties import PropertyList
+import numpy as np
+
+from pocketfeature.algorithms import (
+    CutoffScoreHistogram,
+    GaussianStats,
+    paired_cutoff_counts,
+    stratified_sample,
+    stream_cutoff_counts,
+    stream_symmetric_cutoff_counts,
+)
 from pocketfeature.datastructs import (
+    BackgroundEnvironment,
+    CenterCalculator,
     MatrixValues,
     PassThroughItems,
     PocketFeatureBackgroundStatisticsMetaData,
@@ -34,26 +52,33 @@ from pocketfeature.datastructs import (
 )
 from pocketfeature.io import (
     backgroundfile,
+    backgroundstate,
+    datastore,
     featurefile as featurefile_pf,
     pdbfile,
     matrixvaluesfile,
+    structurecache,
+    vectorcache,
 )
 from pocketfeature import defaults
+from pocketfeature.operations.featurize import featurize_points_raw_cached
+from pocketfeature.operations.pockets import extract_pockets_from_atoms
 from pocketfeature.tasks.core import (
     Task,
     ensure_all_imap_unordered_results_finish,
 )
-from pocketfeature.tasks.extract import (
-    create_pocket_around_ligand,
-    find_ligand_in_structure,
-    focus_structure,
-    pick_best_ligand,
-)
+from pocketfeature.tasks.extract import pick_best_ligand
 from pocketfeature.utils.args import LOG_LEVELS
 from pocketfeature.utils.ff import get_vector_type
 
 NUM_DIGITS_FOR_MODE = 3
+MIN_COMPARISONS_PER_TASK = 250000
+TASKS_PER_PROCESSOR = 8
+SAMPLE_BATCH_SIZE = 4096
+MIN_SAMPLED_COMPARISONS = 10000
+STATS_BLOCK_SIZE = 1024
 BG_COEFFS_COLUMNS = ('mode', 'mean', 'std_dev', 'n', 'min', 'max')
+SAMPLED_BG_COEFFS_COLUMNS = BG_COEFFS_COLUMNS + ('mode_ci', 'mean_ci', 'std_dev_ci', 'total')
 
 
 @contextlib.contextmanager
@@ -80,45 +105,54 @@ def existing_file(path, mode='r', resume=False):
             yield (f, False)
 
 
-def pocket_from_pocket_def(pocket_def, residue_centers,
-                           if_no_ligand=pick_best_ligand,
-                           distance_threshold=6.0):
-
-    pdb_data, ligand_data = pocket_def
-    
+def pockets_from_pdb(pdb_data, ligand_datas, residue_centers,
+                     if_no_ligand=pick_best_ligand,
+                     distance_threshold=6.0,
+                     structure_cache=None):
+    """ Extract the pockets of every pocket definition naming one PDB from
+        a single parse and atom index, building only the residues near
+        each ligand. Parsed atoms are kept in structure_cache, if given
+    """
     if isinstance(pdb_data, string_types):
         pdb_path = pdb_data
     else:
         pdb_id, pdb_path = pdb_data
-    structure = pdbfile.load_file(pdb_path)
-
-    if ligand_data is None:
-        ligand = if_no_ligand(structure)
+    if structure_cache is not None:
+        atoms = structure_cache.load_atoms(pdb_path)
     else:
-        chain_id, res_id, ligand_name = ligand_data
-        structure = focus_structure(structure, chain=chain_id)
-        if res_id is not None:
-            ligand = find_ligand_in_structure(structure, res_id)
-        else:
-            ligand = find_ligand_in_structure(structure, ligand_name)
-        
-    if ligand is not None:
-        pocket = create_pocket_around_ligand(structure, 
-                                             ligand, 
-                                             cutoff=distance_threshold,
-                                             residue_centers=residue_centers)
-    else:
-        pocket = None
-    return pocket
+        atoms = structurecache.parse_file(pdb_path)
+    pdbid = pdbfile.PDBReader.pdbIdFromFilename(pdb_path)
+    return extract_pockets_from_atoms(atoms, pdbid, ligand_datas, cutoff=distance_threshold,
+                                                                  residue_centers=residue_centers,
+                                                                  if_no_ligand=if_no_ligand)
 
 
-def _pocket_from_pocket_def_star(packed):
-    pocket_def, args, kwargs = packed
-    pocket = pocket_from_pocket_def(pocket_def, *args, **kwargs) 
-    if pocket is not None:
-        return pocket.pickelable
-    else:
-        return None
+def pocket_from_pocket_def(pocket_def, residue_centers,
+                           if_no_ligand=pick_best_ligand,
+                           distance_threshold=6.0,
+                           structure_cache=None):
+    pdb_data, ligand_data = pocket_def
+    pockets = pockets_from_pdb(pdb_data, [ligand_data], residue_centers,
+                               if_no_ligand=if_no_ligand,
+                               distance_threshold=distance_threshold,
+                               structure_cache=structure_cache)
+    return pockets[0]
+
+
+def _pockets_from_pdb_star(packed):
+    (pdb_data, ligand_datas), args, kwargs = packed
+    pockets = pockets_from_pdb(pdb_data, ligand_datas, *args, **kwargs)
+    return [pocket.pickelable if pocket is not None else None for pocket in pockets]
+
+
+def group_pocket_defs_by_pdb(pocket_defs):
+    """ Gather pocket definitions into (PDB, [ligand definitions]) groups,
+        in order of each PDB's first appearance
+    """
+    groups = OrderedDict()
+    for pdb_data, ligand_data in pocket_defs:
+        groups.setdefault(pdb_data, []).append(ligand_data)
+    return list(groups.items())
 
 
 def parse_pocket_def_line(line):
@@ -216,10 +250,13 @@ def get_ptf_list(ptf_src, log=logging):
     return ptf_locs
 
 
-def featurize_point_stream(points, featurize_args=None, load_args=None):
+def featurize_point_stream(points, featurize_args=None, load_args=None, cache=None):
     featurize_args = featurize_args or {}
     load_args = load_args or {}
-    results = featurize_points_raw(points, **featurize_args)
+    if cache is not None:
+        results = featurize_points_raw_cached(points, cache, **featurize_args)
+    else:
+        results = featurize_points_raw(points, **featurize_args)
     ff = featurefile_pf.iload(results, **load_args)
     return ff
 
@@ -228,31 +265,107 @@ def _featurize_point_stream_star(args):
     return featurize_point_stream(*args)
 
 
-def calculate_residue_pair_normalization(key, thresholds, fileA, fileB, storeFile=None, compare_method=None):
+def featurize_point_shard(points, featurize_args=None, load_args=None, cache=None):
+    """ Featurize one shard of points in a worker and return the loaded
+        vectors as a list so they can be sent back to the parent process
+    """
+    ff = featurize_point_stream(points, featurize_args=featurize_args,
+                                        load_args=load_args,
+                                        cache=cache)
+    return list(ff)
+
+
+def _featurize_point_shard_star(args):
+    return featurize_point_shard(*args)
+
+
+def shard_points_by_pdb(points):
+    """ Split a point stream into consecutive lists sharing a PDB ID """
+    for pdbid, shard in itertools.groupby(points, key=lambda point: point.pdbid):
+        yield list(shard)
+
+
+def imap_in_order(pool, func, args, window):
+    """ Like pool.imap, but args is drawn by the calling thread rather than
+        the pool's task handler, with at most window tasks pending
+    """
+    pending = deque()
+    for arg in args:
+        pending.append(pool.apply_async(func, (arg,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def load_residue_type_features(path):
+    """ Load the feature matrix of a residue type from either a column
+        store prefix (memory-mapped) or a gzipped FEATURE file
+    """
+    if datastore.exists(path):
+        return datastore.load(path)
+    with gzip.open(path) as io:
+        return featurefile.load(io)
+
+
+def calculate_residue_pair_stats(thresholds, fileA, fileB, rows=None, storeFile=None, compare_method=None,
+                                 symmetric=False, include_diagonal=True):
+    """ Accumulate score statistics for a residue type pair, optionally
+        restricted to a (start, stop) slice of the rows of fileA. The
+        returned statistics can be merged exactly with other slices.
+
+        With symmetric (for a type compared with itself) only the upper
+        triangle is scored, with self comparisons kept or dropped
+        according to include_diagonal
+    """
     compute_raw_cutoff_similarity = defaults.ALLOWED_SIMILARITY_METHODS[compare_method]
-    with gzip.open(fileA) as ioA, \
-         gzip.open(fileB) as ioB, \
-         maybe_open(storeFile, 'w', gzip.open) as ioStore:
-        stats = GaussianStats(store=ioStore, mode_binning=NUM_DIGITS_FOR_MODE)
-        ffA = featurefile.load(ioA)
-        ffB = featurefile.load(ioB)
-        #if fileA == fileB:
-        #    # TODO: Should we really be special-casing A==B to ensure we don't
-        #    #       compare each pair twice or compare the identity
-        #    pairs = unique_product(ffA.features, ffB.vectors, skip=1)
-        #else:
-        #    pairs = itertools.product(ffA.features, ffB.features)
-        if hasattr(compute_raw_cutoff_similarity, 'stream_similarities'):
+    with maybe_open(storeFile, 'w', gzip.open) as ioStore:
+        featuresA = load_residue_type_features(fileA).features
+        featuresB = load_residue_type_features(fileB).features
+        score_counts = getattr(compute_raw_cutoff_similarity, 'from_counts', None)
+        if symmetric and score_counts is None:
+            logging.warning("Symmetric pairs require a count based similarity. Comparing all pairs")
+            symmetric = False
+        if rows is not None and not symmetric:
+            featuresA = featuresA[slice(*rows)]
+        if symmetric:
+            logging.info("Symmetric histogram similarity")
+            stats = CutoffScoreHistogram(len(thresholds), score_counts,
+                                         mode_binning=NUM_DIGITS_FOR_MODE)
+            count_blocks = stream_symmetric_cutoff_counts(thresholds, featuresA, rows=rows,
+                                                          include_diagonal=include_diagonal)
+            for intersections, unions, weight in count_blocks:
+                stats.record_counts(intersections, unions, weight=weight)
+                if ioStore is not None:
+                    raw_scores = score_counts(intersections, unions)
+                    ioStore.writelines(map("{0:0.3f}\n".format, raw_scores.flat))
+        elif score_counts is not None:
+            logging.info("Histogram similarity")
+            stats = CutoffScoreHistogram(len(thresholds), score_counts,
+                                         mode_binning=NUM_DIGITS_FOR_MODE)
+            count_blocks = stream_cutoff_counts(thresholds, featuresA, featuresB)
+            for intersections, unions in count_blocks:
+                stats.record_counts(intersections, unions)
+                if ioStore is not None:
+                    raw_scores = score_counts(intersections, unions)
+                    ioStore.writelines(map("{0:0.3f}\n".format, raw_scores.flat))
+        elif hasattr(compute_raw_cutoff_similarity, 'stream_similarities'):
             logging.info("Optimized similarlity")
-            raw_scores = compute_raw_cutoff_similarity.stream_similarities(thresholds, ffA.features, ffB.features)
-            for raw_score in raw_scores:
-                stats.record(raw_score)
+            stats = GaussianStats(store=ioStore, mode_binning=NUM_DIGITS_FOR_MODE)
+            score_blocks = compute_raw_cutoff_similarity.stream_similarity_blocks(thresholds, featuresA, featuresB)
+            for score_block in score_blocks:
+                stats.record_many(score_block.ravel())
         else:
-            pairs = itertools.product(ffA.features, ffB.features)
+            stats = GaussianStats(store=ioStore, mode_binning=NUM_DIGITS_FOR_MODE)
+            pairs = itertools.product(featuresA, featuresB)
             for a, b in pairs:
                 raw_score = compute_raw_cutoff_similarity(thresholds, a, b)
                 stats.record(raw_score)
 
+    return stats
+
+
+def summarize_residue_pair_stats(stats):
     if stats.n > 0:
         mode = float(stats.mode)
         mean = float(stats.mean)
@@ -262,14 +375,201 @@ def calculate_residue_pair_normalization(key, thresholds, fileA, fileB, storeFil
         high = float(stats.maxes)
     else:
         mode = mean = std = n = low = high = 0
-    
-    return key, (mode, mean, std, n, low, high)
+    return mode, mean, std, n, low, high
+
+
+def calculate_residue_pair_normalization(key, thresholds, fileA, fileB, storeFile=None, compare_method=None,
+                                         symmetric=False, include_diagonal=True):
+    stats = calculate_residue_pair_stats(thresholds, fileA, fileB,
+                                         storeFile=storeFile,
+                                         compare_method=compare_method,
+                                         symmetric=symmetric,
+                                         include_diagonal=include_diagonal)
+    return key, summarize_residue_pair_stats(stats)
 
 
 def _calculate_residue_pair_normalization_star(args):
     return calculate_residue_pair_normalization(*args)
 
 
+def calculate_residue_pair_block_stats(key, thresholds, fileA, fileB, rows, storeFile=None, compare_method=None,
+                                       symmetric=False, include_diagonal=True):
+    stats = calculate_residue_pair_stats(thresholds, fileA, fileB, rows=rows,
+                                         storeFile=storeFile,
+                                         compare_method=compare_method,
+                                         symmetric=symmetric,
+                                         include_diagonal=include_diagonal)
+    return key, stats
+
+
+def _calculate_residue_pair_block_stats_star(args):
+    return calculate_residue_pair_block_stats(*args)
+
+
+def split_residue_pair_rows(num_rows, num_cols, max_comparisons, symmetric=False):
+    """ Split the rows of a residue pair into (start, stop) blocks of at
+        most max_comparisons comparisons each (but at least one row).
+        Symmetric pairs only score the upper triangle, so later rows are
+        cheaper and blocks grow accordingly
+    """
+    if num_rows == 0 or num_cols == 0:
+        return [(0, num_rows)]
+    if not symmetric:
+        rows_per_block = max(1, max_comparisons // num_cols)
+        return [(start, min(start + rows_per_block, num_rows))
+                for start in range(0, num_rows, rows_per_block)]
+
+    blocks = []
+    start = 0
+    comparisons = 0
+    for row in range(num_rows):
+        comparisons += num_cols - row
+        if comparisons >= max_comparisons:
+            blocks.append((start, row + 1))
+            start = row + 1
+            comparisons = 0
+    if start < num_rows:
+        blocks.append((start, num_rows))
+    return blocks
+
+
+def count_residue_pair_comparisons(num_rows, num_cols, rows=None, symmetric=False):
+    start, stop = rows or (0, num_rows)
+    if symmetric:
+        # Rows [start, stop) of the upper triangle (including the diagonal)
+        return sum(num_cols - row for row in range(start, stop))
+    else:
+        return (stop - start) * num_cols
+
+
+def merge_residue_pair_block_stats(blocks, blocks_per_key):
+    """ Merge partial statistics as they arrive and generate each pair's
+        normalization once all of its blocks are done
+    """
+    partials = {}
+    remaining = dict(blocks_per_key)
+    for key, stats in blocks:
+        if key in partials:
+            stats = partials[key].merge(stats)
+        remaining[key] -= 1
+        if remaining[key] == 0:
+            partials.pop(key, None)
+            yield key, summarize_residue_pair_stats(stats)
+        else:
+            partials[key] = stats
+
+
+def sample_residue_pair_normalization(key, thresholds, fileA, fileB, compare_method=None,
+                                      target_comparisons=None,
+                                      max_relative_error=None,
+                                      confidence=0.95,
+                                      include_diagonal=True,
+                                      seed=None):
+    """ Estimate the normalization of a residue type pair from randomly
+        sampled vector pairs, drawing rows of each side stratified by
+        source PDB. Sampling stops after target_comparisons samples or,
+        when max_relative_error is given, once the confidence intervals of
+        the mode, mean and std are all within that fraction of their
+        estimates. Never draws more samples than there are vector pairs:
+        pairs that a sample could not cover more cheaply (or that sampling
+        does not converge on) are calculated exactly
+    """
+    compute_raw_cutoff_similarity = defaults.ALLOWED_SIMILARITY_METHODS[compare_method]
+    score_counts = getattr(compute_raw_cutoff_similarity, 'from_counts', None)
+    columnsA = load_residue_type_features(fileA)
+    columnsB = load_residue_type_features(fileB)
+    same_file = fileA == fileB
+    total = len(columnsA.features) * len(columnsB.features)
+    if same_file and not include_diagonal:
+        total -= len(columnsA.features)
+    limit = min(target_comparisons or total, total)
+
+    def exact():
+        stats = calculate_residue_pair_stats(thresholds, fileA, fileB,
+                                             compare_method=compare_method,
+                                             symmetric=same_file and not include_diagonal,
+                                             include_diagonal=include_diagonal)
+        return key, summarize_residue_pair_stats(stats) + (0., 0., 0., total)
+
+    if score_counts is None:
+        return exact()
+    if target_comparisons is not None and limit >= total:
+        return exact()
+    if target_comparisons is None and total <= MIN_SAMPLED_COMPARISONS:
+        return exact()  # Too small to ever check the error bounds
+
+    if seed is None:
+        random_state = np.random.RandomState()
+    else:
+        pair_seed = zlib.crc32(":".join(key).encode('utf-8')) ^ seed
+        random_state = np.random.RandomState(pair_seed & 0xffffffff)
+
+    stats = CutoffScoreHistogram(len(thresholds), score_counts,
+                                 mode_binning=NUM_DIGITS_FOR_MODE)
+    converged = False
+    while stats.n < limit:
+        size = min(SAMPLE_BATCH_SIZE, limit - stats.n)
+        rowsA = stratified_sample(columnsA.pdbids, size, random_state=random_state)
+        rowsB = stratified_sample(columnsB.pdbids, size, random_state=random_state)
+        if same_file and not include_diagonal:
+            distinct = rowsA != rowsB
+            rowsA, rowsB = rowsA[distinct], rowsB[distinct]
+        intersections, unions = paired_cutoff_counts(thresholds,
+                                                     columnsA.features[rowsA],
+                                                     columnsB.features[rowsB])
+        stats.record_counts(intersections, unions)
+
+        if max_relative_error is not None and stats.n >= MIN_SAMPLED_COMPARISONS:
+            errors = stats.estimate_errors(confidence=confidence, random_state=random_state)
+            estimates = (stats.mode, stats.mean, stats.std_dev)
+            if all(error <= max_relative_error * abs(estimate)
+                   for error, estimate in zip(errors, estimates)):
+                converged = True
+                break
+
+    if target_comparisons is None and not converged:
+        return exact()  # As many samples as pairs bought no saving
+
+    errors = stats.estimate_errors(confidence=confidence, random_state=random_state)
+    return key, summarize_residue_pair_stats(stats) + tuple(float(error) for error in errors) + (total,)
+
+
+def _sample_residue_pair_normalization_star(args):
+    return sample_residue_pair_normalization(*args)
+
+
+def update_residue_pair_histogram(key, thresholds, prefixA, prefixB, oldA, oldB,
+                                  histogram_path, compare_method=None, include_diagonal=True):
+    """ Bring the saved score histogram of a residue type pair up to date
+        after vectors were appended to its column stores. Only comparisons
+        involving new rows are scored: new A rows against all of B, and old
+        A rows against new B rows. Returns the pair's normalization
+    """
+    compute_raw_cutoff_similarity = defaults.ALLOWED_SIMILARITY_METHODS[compare_method]
+    score_counts = compute_raw_cutoff_similarity.from_counts
+    featuresA = load_residue_type_features(prefixA).features
+    featuresB = load_residue_type_features(prefixB).features
+    stats = backgroundstate.load_histogram(histogram_path, len(thresholds), score_counts,
+                                           mode_binning=NUM_DIGITS_FOR_MODE)
+
+    for intersections, unions in stream_cutoff_counts(thresholds, featuresA[oldA:], featuresB):
+        stats.record_counts(intersections, unions)
+    for intersections, unions in stream_cutoff_counts(thresholds, featuresA[:oldA], featuresB[oldB:]):
+        stats.record_counts(intersections, unions)
+    if prefixA == prefixB and not include_diagonal:
+        # New rows were compared with themselves above
+        new = featuresA[oldA:]
+        intersections, unions = paired_cutoff_counts(thresholds, new, new)
+        stats.record_counts(intersections, unions, weight=-1)
+
+    backgroundstate.dump_histogram(stats, histogram_path)
+    return key, summarize_residue_pair_stats(stats)
+
+
+def _update_residue_pair_histogram_star(args):
+    return update_residue_pair_histogram(*args)
+
+
 def create_background_features_from_stats(stats, **metadata_fields):
     metadata = PocketFeatureBackgroundStatisticsMetaData()
     metadata.update(metadata_fields)
@@ -348,9 +648,18 @@ class GeneratePocketFeatureBackground(Task):
 
         self.point_file = os.path.join(params.ff_dir, 'points.ptf')
 
-        self.bg = self.generate_vector_stats()
-        if not params.skip_normalization:
-            self.norms = self.generate_score_stats()
+        if params.incremental:
+            self.update_background()
+        else:
+            self.bg = self.generate_vector_stats()
+            if not params.skip_normalization:
+                self.norms = self.generate_score_stats()
+
+        if params.compiled is not None:
+            if params.skip_normalization and not params.incremental:
+                log.error("Cannot compile a background without normalizations")
+                sys.exit(-1)
+            self.dump_compiled_background()
 
                 
     def generate_vector_stats(self):
@@ -405,10 +714,17 @@ class GeneratePocketFeatureBackground(Task):
         thresholds = threshold * std_dev.features
 
         pairs, resumed = self.get_allowed_ff_pairs()
+        pairs = self.convert_ff_pairs_to_columns(pairs)
         statsFiles = self.get_ff_pair_scores_files(pairs)
         num_pairs = len(pairs)
-        all_args = ((key, thresholds, fA, fB, statsFiles[key], params.compare_method) 
+        all_args = ((key, thresholds, fA, fB, statsFiles[key], params.compare_method,
+                     self.is_symmetric_pair(key), not params.exclude_self_comparisons)
                            for key, (fA, fB) in pairs.items())
+        sampling = params.target_comparisons is not None or params.max_relative_error is not None
+        if sampling:
+            coeff_columns = SAMPLED_BG_COEFFS_COLUMNS
+        else:
+            coeff_columns = BG_COEFFS_COLUMNS
 
         if self.params.resume:
             num_resumed = len(resumed)
@@ -421,7 +737,7 @@ class GeneratePocketFeatureBackground(Task):
         if num_pairs == 0:
             log.info("All residue pairs previously completed. Nothing to compute")
             with open(params.normalization) as f:
-                values = matrixvaluesfile.load(f, value_dims=BG_COEFFS_COLUMNS)
+                values = matrixvaluesfile.load(f, value_dims=coeff_columns)
             return values
 
         def display_progress(items):
@@ -435,12 +751,28 @@ class GeneratePocketFeatureBackground(Task):
             print("", file=sys.stderr)
 
         log.info("Computing background normalizations for {0} residue pairs".format(num_pairs))
-        num_processors = min(params.num_processors, num_pairs)
-        if params.num_processors is not None and num_processors > 1:
+        if sampling:
+            log.info("Estimating normalizations from sampled comparisons")
+            sample_args = ((key, thresholds, fA, fB, params.compare_method,
+                            params.target_comparisons, params.max_relative_error,
+                            params.confidence, not params.exclude_self_comparisons,
+                            params.sample_seed)
+                                for key, (fA, fB) in pairs.items())
+            if params.num_processors is not None and params.num_processors > 1:
+                self.pool = multiprocessing.Pool(params.num_processors)
+                raw_items = self.pool.imap_unordered(_sample_residue_pair_normalization_star, sample_args)
+                items = ensure_all_imap_unordered_results_finish(raw_items, expected=num_pairs)
+            else:
+                items = itertools.imap(_sample_residue_pair_normalization_star, sample_args)
+        # Pairs are split into blocks, so even a few pairs can use every worker
+        elif params.num_processors is not None and params.num_processors > 1:
             log.info("Calculating with {0} workers".format(params.num_processors))
+            tasks, blocks_per_key = self.split_pair_tasks(pairs, thresholds, statsFiles)
+            log.debug("Split {0} residue pairs into {1} tasks".format(num_pairs, len(tasks)))
             self.pool = multiprocessing.Pool(params.num_processors)
-            raw_items = self.pool.imap_unordered(_calculate_residue_pair_normalization_star, all_args)
-            items = ensure_all_imap_unordered_results_finish(raw_items, expected=num_pairs)
+            raw_blocks = self.pool.imap_unordered(_calculate_residue_pair_block_stats_star, tasks)
+            blocks = ensure_all_imap_unordered_results_finish(raw_blocks, expected=len(tasks))
+            items = merge_residue_pair_block_stats(blocks, blocks_per_key)
         else:
             log.debug("Calculating {0} pairs serially".format(num_pairs))
             items = itertools.imap(_calculate_residue_pair_normalization_star, all_args)
@@ -450,7 +782,7 @@ class GeneratePocketFeatureBackground(Task):
         if params.progress:
             items = display_progress(items)
 
-        values_out = PassThroughItems(items, dims=2, dim_refs=dict(enumerate(BG_COEFFS_COLUMNS)))
+        values_out = PassThroughItems(items, dims=2, dim_refs=dict(enumerate(coeff_columns)))
         log.debug("Writing Background normalization coefficients to {0}".format(params.normalization))
   
         with open(params.normalization, write_mode) as f:
@@ -459,31 +791,254 @@ class GeneratePocketFeatureBackground(Task):
         # If resuming re-read all values
         if self.params.resume:
             with open(params.normalization) as f:
-                values = matrixvaluesfile.load(f, value_dims=BG_COEFFS_COLUMNS, header=True)
+                values = matrixvaluesfile.load(f, value_dims=coeff_columns, header=True)
         else:
-            values = MatrixValues(local_items, value_dims=BG_COEFFS_COLUMNS)
+            values = MatrixValues(local_items, value_dims=coeff_columns)
 
         return values
 
-    def get_pockets(self, pocket_defs):
+    def dump_compiled_background(self):
+        """ Write the finished background as one memory-mappable binary file """
+        params = self.params
+        background = BackgroundEnvironment(std_dev=self.bg.get(backgroundfile.STD_DEV_VECTOR),
+                                           mean=self.bg.get(backgroundfile.MEAN_VECTOR),
+                                           normalizations=self.norms.slice_values(backgroundfile.NORM_COLUMN),
+                                           metadata=self.bg.metadata,
+                                           residue_centers=CenterCalculator(*self.residue_centers),
+                                           compare_function=params.compare_method,
+                                           allowed_pairs=params.allowed_pairs,
+                                           std_threshold=params.std_threshold)
+        self.log.debug("Writing compiled background to {0}".format(params.compiled))
+        backgroundfile.dump_compiled(background, params.compiled)
+
+    def get_state_dir(self):
+        if self.params.state_dir is not None:
+            return self.params.state_dir
+        else:
+            return self.params.background + '.state'
+
+    def update_background(self):
+        """ Add new pockets to a background, keeping mergeable state (vector
+            moments, per-type column stores and score histograms) next to
+            the background files so existing work is never repeated
+        """
+        params = self.params
+        log = self.log
+        state_dir = self.get_state_dir()
+        backgroundstate.ensure_state_dirs(state_dir)
+        settings = backgroundstate.load_settings(state_dir)
+
+        compare_fn = defaults.ALLOWED_SIMILARITY_METHODS[params.compare_method]
+        if getattr(compare_fn, 'from_counts', None) is None:
+            log.error("Incremental updates require a count based similarity method")
+            sys.exit(-1)
+        fixed_settings = {
+            'compare_method': params.compare_method,
+            'std_threshold': params.std_threshold,
+            'allowed_pairs': params.allowed_pairs,
+            'exclude_self_comparisons': params.exclude_self_comparisons,
+        }
+        for name, value in fixed_settings.items():
+            if name in settings and settings[name] != value:
+                log.error("Background state was built with {0}={1!r}, not {2!r}".format(
+                            name, settings[name], value))
+                sys.exit(-1)
+
+        # Featurize only pockets that are not part of the background yet
+        known = set(settings.get('sources', []))
+        if params.pdbs is not None:
+            sources = get_pdb_list(params.pdbs, pdb_dir=params.pdb_dir, log=log)
+            source_keys = ["{0} {1!r}".format(pdb_data[0], lig_data) for pdb_data, lig_data in sources]
+            new_sources = [src for src, src_key in zip(sources, source_keys) if src_key not in known]
+            vectors = self.get_pocket_vectors(new_sources)
+        else:
+            sources = get_ptf_list(params.ptfs, log=log)
+            source_keys = [os.path.abspath(path) for path in sources]
+            new_sources = [src for src, src_key in zip(sources, source_keys) if src_key not in known]
+            vectors = self.get_pointfile_vectors(new_sources)
+        log.info("Adding {0} new of {1} sources to background".format(len(new_sources), len(sources)))
+
+        new_stats, metadata, pdbs = self.process_vectors(vectors)
+        stats = backgroundstate.load_vector_stats(state_dir).merge(new_stats)
+        if stats.n == 0:
+            log.error("No FEATURE vectors in background")
+            sys.exit(-1)
+
+        fields = settings.get('metadata', {})
+        if metadata is not None:
+            fields.update(NUM_SHELLS=metadata.num_shells,
+                          SHELL_WIDTH=metadata.shell_width,
+                          PROPERTIES=list(metadata.properties))
+        pdb_list = sorted(set(settings.get('pdbs', [])).union(pdbs))
+        metadata_fields = dict(fields)
+        if 'PROPERTIES' in metadata_fields:
+            # Saved as a plain (JSON) list
+            metadata_fields['PROPERTIES'] = PropertyList(metadata_fields['PROPERTIES'])
+        self.bg = create_background_features_from_stats(stats,
+                PDBID_LIST=pdb_list,
+                SIMILARITY_STD_THRESHOLD=params.std_threshold,
+                **metadata_fields)
+
+        # Append new vectors to the per-type stores, remembering old sizes
+        old_sizes = {}
+        for res_type, ff_path in self.get_res_ff_files().items():
+            with gzip.open(ff_path) as f:
+                prefix = backgroundstate.get_type_prefix(state_dir, res_type)
+                old_sizes[res_type] = datastore.append(featurefile.iload(f), prefix)
+
+        types = set(os.path.basename(path).split('.')[0]
+                    for path in os.listdir(os.path.join(state_dir, backgroundstate.TYPES_DIR)))
+        for res_type in types:
+            if res_type not in old_sizes:
+                prefix = backgroundstate.get_type_prefix(state_dir, res_type)
+                old_sizes[res_type] = len(datastore.load(prefix).features)
+
+        # Histograms stay valid only while the similarity thresholds hold
+        std_dev = self.bg.get(backgroundfile.STD_DEV_VECTOR)
+        thresholds = params.std_threshold * std_dev.features
+        previous = settings.get('thresholds')
+        if previous is not None:
+            previous = np.array(previous)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                drift = np.abs(thresholds - previous) / previous
+            drift = np.nanmax(np.where(previous == 0, np.abs(thresholds), drift))
+            if drift > params.threshold_tolerance:
+                log.warning("Similarity thresholds moved by {0:.3f}. Rescoring all residue pairs".format(drift))
+                old_sizes = dict.fromkeys(old_sizes, 0)
+            else:
+                log.info("Keeping similarity thresholds (moved by {0:.3f})".format(drift))
+                thresholds = previous
+                # Scoring derives thresholds from the background STD, so
+                # it must stay the one the kept histograms were built with
+                if 'std_dev' in settings:
+                    std_dev.features = np.array(settings['std_dev'])
+                else:
+                    std_dev.features = previous / params.std_threshold
+
+        log.debug("Writing Background stats to {0}".format(params.background))
+        with open(params.background, 'w') as f:
+            featurefile.dump(self.bg, f)
+
+        allowed_pairs = self.get_allowed_type_pairs()
+        include_diagonal = not params.exclude_self_comparisons
+        all_args = []
+        for typeA, typeB in itertools.product(sorted(types), sorted(types)):
+            key = backgroundfile.make_vector_type_key((typeA, typeB))
+            if key not in allowed_pairs or key != (typeA, typeB):
+                continue
+            histogram_path = backgroundstate.get_histogram_path(state_dir, key)
+            if old_sizes[typeA] == 0 and old_sizes[typeB] == 0 and os.path.exists(histogram_path):
+                os.unlink(histogram_path)
+            all_args.append((key, thresholds,
+                             backgroundstate.get_type_prefix(state_dir, typeA),
+                             backgroundstate.get_type_prefix(state_dir, typeB),
+                             old_sizes[typeA], old_sizes[typeB],
+                             histogram_path, params.compare_method, include_diagonal))
+
+        num_pairs = len(all_args)
+        log.info("Updating background normalizations for {0} residue pairs".format(num_pairs))
+        if params.num_processors is not None and params.num_processors > 1:
+            self.pool = multiprocessing.Pool(params.num_processors)
+            raw_items = self.pool.imap_unordered(_update_residue_pair_histogram_star, all_args)
+            items = ensure_all_imap_unordered_results_finish(raw_items, expected=num_pairs)
+        else:
+            items = itertools.imap(_update_residue_pair_histogram_star, all_args)
+
+        items, local_items = itertools.tee(items)
+        values_out = PassThroughItems(items, dims=2, dim_refs=dict(enumerate(BG_COEFFS_COLUMNS)))
+        log.debug("Writing Background normalization coefficients to {0}".format(params.normalization))
+        with open(params.normalization, 'w') as f:
+            matrixvaluesfile.dump(values_out, f, header=True)
+        self.norms = MatrixValues(local_items, value_dims=BG_COEFFS_COLUMNS)
+
+        backgroundstate.dump_vector_stats(stats, state_dir)
+        settings.update(fixed_settings)
+        settings.update(thresholds=list(thresholds),
+                        std_dev=list(std_dev.features),
+                        metadata=fields,
+                        pdbs=pdb_list,
+                        sources=sorted(known.union(source_keys)))
+        backgroundstate.dump_settings(settings, state_dir)
+
+    def split_pair_tasks(self, pairs, thresholds, statsFiles):
+        """ Break residue pairs into row-block tasks of similar comparison
+            counts, largest first, so workers stay busy until the end
+        """
+        params = self.params
+        sizes = {}
+        for key, (fA, fB) in pairs.items():
+            numA = len(load_residue_type_features(fA).features)
+            numB = len(load_residue_type_features(fB).features)
+            sizes[key] = (numA, numB)
+
+        total = sum(count_residue_pair_comparisons(numA, numB, symmetric=self.is_symmetric_pair(key))
+                    for key, (numA, numB) in sizes.items())
+        max_comparisons = max(MIN_COMPARISONS_PER_TASK,
+                              total // (params.num_processors * TASKS_PER_PROCESSOR))
+
+        tasks = []
+        blocks_per_key = {}
+        include_diagonal = not params.exclude_self_comparisons
+        for key, (fA, fB) in pairs.items():
+            numA, numB = sizes[key]
+            symmetric = self.is_symmetric_pair(key)
+            if statsFiles[key] is not None:
+                # Raw scores are written to a single file per pair
+                row_blocks = [None]
+            else:
+                row_blocks = split_residue_pair_rows(numA, numB, max_comparisons,
+                                                     symmetric=symmetric)
+            blocks_per_key[key] = len(row_blocks)
+            for rows in row_blocks:
+                cost = count_residue_pair_comparisons(numA, numB, rows=rows, symmetric=symmetric)
+                args = (key, thresholds, fA, fB, rows, statsFiles[key], params.compare_method,
+                        symmetric, include_diagonal)
+                tasks.append((cost, args))
+
+        tasks.sort(key=lambda task: task[0], reverse=True)
+        return [args for cost, args in tasks], blocks_per_key
+
+    def is_symmetric_pair(self, key):
+        """ Same-type pairs can be scored as a triangle when requested """
+        typeA, typeB = key
+        symmetric = self.params.symmetric_pairs or self.params.exclude_self_comparisons
+        return symmetric and typeA == typeB
+
+    def get_pockets(self, pocket_defs, pool=None):
+        """ Extract pockets, with a worker pool of their own or the given
+            pool (which is left open for later stages). Extraction is
+            submitted before returning, so a shared pool queues it ahead
+            of work that consumes the pockets
+        """
         num_pdbs = len(pocket_defs)
-        num_successful = 0
-        num_failed = 0
         num_processors = min(self.params.num_processors, num_pdbs)
         kwargs = {
             'residue_centers': self.residue_centers,
             'distance_threshold': self.params.distance,
+            'structure_cache': structurecache.open_cache(self.params.structure_cache),
         }
-        all_args = [(pocket_def, (), kwargs) for pocket_def in pocket_defs]
-        if self.params.num_processors is not None and num_processors > 1:
+        # Each structure is parsed and indexed once for all of its pockets
+        groups = group_pocket_defs_by_pdb(pocket_defs)
+        all_args = [(group, (), kwargs) for group in groups]
+        own_pool = None
+        if pool is not None:
+            self.log.info("Extracting pockets with shared workers")
+            raw_pockets = pool.imap_unordered(_pockets_from_pdb_star, all_args)
+            pockets = ensure_all_imap_unordered_results_finish(raw_pockets, expected=len(groups))
+            pockets = itertools.chain.from_iterable(pockets)
+        elif self.params.num_processors is not None and num_processors > 1:
             self.log.info("Extracting pockets with with {0} workers".format(num_processors))
-            self.pool = multiprocessing.Pool(num_processors)
-            raw_pockets = self.pool.imap_unordered(_pocket_from_pocket_def_star, all_args, 5)
-            pockets = ensure_all_imap_unordered_results_finish(raw_pockets)
+            own_pool = multiprocessing.Pool(num_processors)
+            raw_pockets = own_pool.imap_unordered(_pockets_from_pdb_star, all_args)
+            pockets = ensure_all_imap_unordered_results_finish(raw_pockets, expected=len(groups))
+            pockets = itertools.chain.from_iterable(pockets)
         else:
-            self.pool = None
-            pockets = itertools.imap(_pocket_from_pocket_def_star, all_args)
+            pockets = itertools.chain.from_iterable(itertools.imap(_pockets_from_pdb_star, all_args))
+        return self.report_pockets(pockets, num_pdbs, own_pool=own_pool)
 
+    def report_pockets(self, pockets, num_pdbs, own_pool=None):
+        num_successful = 0
+        num_failed = 0
         for idx, pocket in enumerate(pockets, start=1):
             if pocket is not None:
                 num_successful += 1
@@ -503,15 +1058,16 @@ class GeneratePocketFeatureBackground(Task):
             if pocket is not None:
                 yield pocket
 
-        if self.pool:
-            self.pool.close()
+        if own_pool is not None:
+            own_pool.close()
+            own_pool.join()
             
         if self.params.progress:
             print("", file=sys.stderr)
 
     def get_points(self, pockets):
         for pocket in pockets:
-            points = list(pocket.points)
+            points = pocket.points
             if self.params.all_data:
                 ptf_file = self.get_ptf_file(pocket)
                 with gzip.open(ptf_file, 'w') as f:
@@ -532,11 +1088,21 @@ class GeneratePocketFeatureBackground(Task):
             self.log.info("Shuffling PDBs since max_points specified")
             random.shuffle(pocket_defs)
             pocket_defs = pocket_defs[:self.params.max_points]
-        pockets = self.get_pockets(pocket_defs)
-        points = self.get_points(pockets)
-        vectors = self.create_vectors(points)
-        for vector in vectors:
-            yield vector
+        # Pockets are extracted and featurized by the same workers, so a
+        # run never holds more than num_processors worker processes
+        pool = None
+        if self.params.num_processors is not None and self.params.num_processors > 1:
+            pool = multiprocessing.Pool(self.params.num_processors)
+        try:
+            pockets = self.get_pockets(pocket_defs, pool=pool)
+            points = self.get_points(pockets)
+            vectors = self.create_vectors(points, pool=pool)
+            for vector in vectors:
+                yield vector
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
     def get_pointfile_vectors(self, pointfiles):
         points = self.get_predefined_points(pointfiles)
@@ -544,19 +1110,24 @@ class GeneratePocketFeatureBackground(Task):
         for vector in vectors:
             yield vector
 
-    def create_vectors(self, points):
-        for vector in self.featurize_points(points):
+    def create_vectors(self, points, pool=None):
+        for vector in self.featurize_points(points, pool=pool):
             self._num_vectors += 1
             yield vector
 
     # This is a member function as it uses lots of task parameters
-    def featurize_points(self, points):
+    def featurize_points(self, points, pool=None):
+        """ Generate FEATURE vectors for points, in order. Parallel runs use
+            the given worker pool or one that is closed once the vectors
+            are used up
+        """
         points = self.preprocess_points(points)
-        points = self.record_points(points)
-        
+
+        # Limited before recording, which writes points a chunk at a time
         if self.params.max_points is not None:
             self.log.info("Limiting number of points to {0}".format(self.params.max_points))
             points = itertools.islice(points, self.params.max_points)
+        points = self.record_points(points)
 
         featurize_args = {
             'environ': {
@@ -566,26 +1137,48 @@ class GeneratePocketFeatureBackground(Task):
             },
         }
 
+        cache = vectorcache.open_cache(self.params.vector_cache)
+        if cache is not None:
+            self.log.info("Reusing featurized residue centers from {0}".format(cache.root))
+
+        # Every path featurizes one PDB at a time, so FEATURE numbers
+        # vectors the same way whether or not the run is parallel
         self.log.info("Computing FEATURE vectors")
-        if self.params.num_processors is not None and self.params.num_processors > 1 and False:
+        shards = shard_points_by_pdb(points)
+        if self.params.num_processors is not None and self.params.num_processors > 1:
             self.log.info("Calculating with {0} workers".format(self.params.num_processors))
-            args = ((point, featurize_args) for point in points)
-            pool = multiprocessing.Pool(self.params.num_processors)
-            vectors = pool.imap(_featurize_point_stream_star, args)
+            # Shards are drawn (and points recorded) in this thread and
+            # collected in submission order, matching a serial run
+            args = ((shard, featurize_args, None, cache) for shard in shards)
+            own_pool = None
+            if pool is None:
+                own_pool = pool = multiprocessing.Pool(self.params.num_processors)
+            try:
+                results = imap_in_order(pool, _featurize_point_shard_star, args,
+                                        window=2 * self.params.num_processors)
+                for vector in itertools.chain.from_iterable(results):
+                    yield vector
+            finally:
+                if own_pool is not None:
+                    own_pool.close()
+                    own_pool.join()
         else:
-            if self.params.num_processors is not None and self.params.num_processors > 1:
-                self.log.warning("Parallel FEATURE vector calculation not yet implemented")
-            self.log.debug("Calculating serially")
-            vectors = featurize_point_stream(points, featurize_args=featurize_args)
-
-        return vectors
+            self.log.debug("Calculating serially, one PDB at a time")
+            for shard in shards:
+                for vector in featurize_point_stream(shard, featurize_args=featurize_args,
+                                                            cache=cache):
+                    yield vector
             
     def process_vectors(self, vectors):
         stats = GaussianStats(mode_binning=None)
         pdbs = set()
         metadata = None
+        pending = []
         for idx, vector in enumerate(vectors, start=1):
-            stats.record(vector.features)
+            pending.append(vector.features)
+            if len(pending) >= STATS_BLOCK_SIZE:
+                stats.record_many(pending)
+                pending = []
             pdbs.update(vector.pdbid)   # vector.pdbid should be returning a list
             metadata = vector.metadata  # Store for later use
             ff_file = self.get_ff_file(vector)
@@ -596,6 +1189,7 @@ class GeneratePocketFeatureBackground(Task):
                 print("\r{0} of {1} FEATURE vectors processed".format(idx, self._num_points), 
                         end="", file=sys.stderr)
                 sys.stderr.flush()
+        stats.record_many(pending)
         if self.params.progress:
             print("", file=sys.stderr)
                 
@@ -627,9 +1221,13 @@ class GeneratePocketFeatureBackground(Task):
         if self.params.all_data:
             self.log.debug("Dumping source points to {0}".format(self.point_file))
             with open(self.point_file, 'w') as f:
-                for point in points:
-                    pointfile.dump([point], f)
-                    yield point
+                while True:
+                    chunk = list(itertools.islice(points, pointfile.DEFAULT_CHUNK_SIZE))
+                    if len(chunk) == 0:
+                        break
+                    pointfile.dump(chunk, f)
+                    for point in chunk:
+                        yield point
         else:
             for point in points:
                 yield point
@@ -655,8 +1253,15 @@ class GeneratePocketFeatureBackground(Task):
             raise ValueError("Missing PDB File: {0}".format(pdb))
         return point
 
+    def get_allowed_type_pairs(self):
+        residue_centers = self.residue_centers
+        if not isinstance(residue_centers, CenterCalculator):
+            residue_centers = CenterCalculator(*residue_centers)
+        make_pairs = defaults.ALLOWED_VECTOR_TYPE_PAIRS[self.params.allowed_pairs]
+        return make_pairs(residue_centers)
+
     def get_allowed_ff_pairs(self):
-        allowed_pairs = defaults.ALLOWED_VECTOR_TYPE_PAIRS[self.params.allowed_pairs]
+        allowed_pairs = self.get_allowed_type_pairs()
         if self.params.resume and os.path.exists(self.params.normalization):
             with open(self.params.normalization) as f:
                 completed = matrixvaluesfile.load(f)
@@ -673,6 +1278,24 @@ class GeneratePocketFeatureBackground(Task):
                 allowed_map[key] = (pathA, pathB)  # order isn't important
         return allowed_map, finished
 
+    def convert_ff_pairs_to_columns(self, pairs):
+        """ Write each residue type's vectors once into a column store so
+            normalization workers can memory-map them instead of parsing
+        """
+        columns = {}
+        for path in set(itertools.chain.from_iterable(pairs.values())):
+            prefix = self.get_column_prefix(path)
+            if not datastore.is_current(prefix, path):
+                self.log.debug("Writing column store {0}".format(prefix))
+                with gzip.open(path) as f:
+                    datastore.dump(featurefile.iload(f), prefix)
+            columns[path] = prefix
+        return dict((key, (columns[fA], columns[fB])) for key, (fA, fB) in pairs.items())
+
+    def get_column_prefix(self, ff_path):
+        res_type = os.path.basename(ff_path).split('.')[0]
+        return os.path.join(self.params.ff_dir, res_type)
+
     def get_ff_pair_scores_files(self, pairs):
         scores_map = {}
         for (typeA, typeB), (ffA, ffB) in pairs.items():
@@ -699,7 +1322,7 @@ class GeneratePocketFeatureBackground(Task):
 
     def get_res_ff_files(self):
         ff_dir = self.params.ff_dir
-        ff_files = os.listdir(ff_dir)
+        ff_files = [ff for ff in os.listdir(ff_dir) if ff.endswith('.ff.gz')]
         ff_types = [ff.split('.')[0] for ff in ff_files]
         ff_paths = [os.path.join(ff_dir, ff) for ff in ff_files]
         ff_map = dict(zip(ff_types, ff_paths))
@@ -752,6 +1375,13 @@ class GeneratePocketFeatureBackground(Task):
         parser.add_argument('-f', '--ff-dir', metavar='FF_DIR',
                                               default=cls.TEMP_FF_DIR_DEFAULT,
                                               help='Directory to store temporary FEATURE files [default: %(default)s]')
+        parser.add_argument('--vector-cache', metavar='VECTOR_CACHE_DIR',
+                                              default=None,
+                                              help='Directory of featurized residue centers shared'
+                                                   ' between pockets and runs [default: %(default)s]')
+        parser.add_argument('--structure-cache', metavar='STRUCTURE_CACHE_DIR',
+                                                 default=None,
+                                                 help='Directory of parsed structures shared between runs [default: %(default)s]')
         parser.add_argument('-p', '--allowed-pairs', metavar='PAIR_SET_NAME',
                                       choices=defaults.ALLOWED_VECTOR_TYPE_PAIRS.keys(),
                                       default=defaults.DEFAULT_VECTOR_TYPE_PAIRS,
@@ -775,6 +1405,41 @@ class GeneratePocketFeatureBackground(Task):
                                               choices=defaults.ALLOWED_SIMILARITY_METHODS,
                                               default=defaults.DEFAULT_SIMILARITY_METHOD,
                                               help='Comparisoin method to use [default: %(default)s]')
+        parser.add_argument('--symmetric-pairs', action='store_true',
+                                                 default=False,
+                                                 help='Score each unordered pair of a same-type residue pair once [default: %(default)s]')
+        parser.add_argument('--exclude-self-comparisons', action='store_true',
+                                                          default=False,
+                                                          help='Leave vectors compared with themselves out of same-type normalizations (implies --symmetric-pairs) [default: %(default)s]')
+        parser.add_argument('--target-comparisons', metavar='N',
+                                                    type=int,
+                                                    default=None,
+                                                    help='Estimate each normalization from at most N sampled comparisons')
+        parser.add_argument('--max-relative-error', metavar='FRACTION',
+                                                    type=float,
+                                                    default=None,
+                                                    help='Stop sampling once the mode, mean and std confidence intervals are within FRACTION of their estimates')
+        parser.add_argument('--confidence', metavar='LEVEL',
+                                            type=float,
+                                            default=0.95,
+                                            help='Confidence level of intervals recorded for sampled normalizations [default: %(default)s]')
+        parser.add_argument('--sample-seed', metavar='SEED',
+                                             type=int,
+                                             default=None,
+                                             help='Random seed for reproducible sampling')
+        parser.add_argument('--compiled', metavar='COMPILED',
+                                          default=None,
+                                          help='Also write the background as a single binary file for fast loading [default: %(default)s]')
+        parser.add_argument('--incremental', action='store_true',
+                                             default=False,
+                                             help='Add new pockets to an existing background using its saved state [default: %(default)s]')
+        parser.add_argument('--state-dir', metavar='STATE_DIR',
+                                           default=None,
+                                           help='Directory holding mergeable background state [default: BACKGROUND.state]')
+        parser.add_argument('--threshold-tolerance', metavar='FRACTION',
+                                                     type=float,
+                                                     default=0.02,
+                                                     help='Largest relative change in similarity thresholds that keeps saved score histograms [default: %(default)s]')
         parser.add_argument('-P', '--num-processors', metavar='PROCS',
                                                       default=1,
                                                       type=int,
@@ -3,6 +3,8 @@ from __future__ import print_function
 
 import os
 
+from six import string_types
+
 from taskbase import (
     Task,
     FileType,
@@ -26,6 +28,20 @@ from pocketfeature.defaults import (
 )
 
 
+def join_score_columns(matrices):
+    """ Join the score columns of matrices over the same pairs into one,
+        prefixing the columns of all but the first with their method
+    """
+    methods = list(matrices.keys())
+    value_dims = list(matrices[methods[0]].value_dims)
+    for method in methods[1:]:
+        value_dims.extend("{0}_{1}".format(method, dim) for dim in matrices[method].value_dims)
+    columns = [list(matrices[method].items()) for method in methods]
+    entries = [(row[0][0], [value for _, values in row for value in values])
+               for row in zip(*columns)]
+    return type(matrices[methods[0]])(entries, value_dims=value_dims)
+
+
 class FeatureFileComparison(Task):
     BACKGROUND_STAT_DEFAULT = DEFAULT_BACKGROUND_STATISTICS_FILE
     BACKGROUND_COEFF_DEFAULT = DEFAULT_BACKGROUND_NORMALIZATION_FILE
@@ -41,6 +57,7 @@ class FeatureFileComparison(Task):
     normalizations = None
     allowed_pairs_name = None
     comparison_method_name = None
+    comparison_method_names = ()
 
     def setup(self, params=None, **kwargs):
         params = params or self.params
@@ -50,9 +67,9 @@ class FeatureFileComparison(Task):
         self.setup_inputs(params, defaults=defaults, **kwargs)
 
     def load_inputs(self):
-        self.load_background = backgroundfile.load(
-            stats_file=use_file(self.statistics),
-            norms_file=use_file(self.normalizations),
+        self.background = backgroundfile.load_from_paths(
+            self.statistics,
+            self.normalizations,
             allowed_pairs=self.allowed_pairs,
             compare_function=self.comparison_method)
         self.featuresA = featurefile.load(use_file(self.feature_fileA))
@@ -65,15 +82,22 @@ class FeatureFileComparison(Task):
     def run_comparison_matrix(self):
         vectorsA = self.featuresA
         vectorsB = self.featuresB
-        scores = self.background.get_comparison_matrix(vectorsA, vectorsB, matrix_wrapper=PassThroughItems)
+        if len(self.comparison_method_names) > 1:
+            # Every method is scored from one shared intersection/union pass
+            matrices = self.background.get_comparison_matrices(vectorsA, vectorsB,
+                                                               self.comparison_method_names,
+                                                               matrix_wrapper=PassThroughItems)
+            scores = join_score_columns(matrices)
+        else:
+            scores = self.background.get_comparison_matrix(vectorsA, vectorsB, matrix_wrapper=PassThroughItems)
         self.original_scores = scores
 
     def run_clean_annotate_results(self):
         scores = self.original_scores
         fileA_name = getattr(self.feature_fileA, 'name', '<stream>')
         fileB_name = getattr(self.feature_fileB, 'name', '<stream>')
-        bg_stats_name = getattr(self.statistics, 'name', '<stream>')
-        bg_norms_name = getattr(self.normalizations, 'name', '<stream>')
+        bg_stats_name = self.statistics
+        bg_norms_name = self.normalizations or '<compiled>'
         scores = scores.round_values(4)
         scores.metadata = self.background.metadata.propagate(kind=PocketFeatureScoresMatrixMetaData,
                                                              FEATURE_FILE_A=fileA_name,
@@ -98,9 +122,17 @@ class FeatureFileComparison(Task):
             'normalizations',
         ))
 
-        if self.comparison_method_name is not None:
+        # Repeating the option scores several methods at once; the first
+        # one is the background's method and the only one normalized
+        names = self.comparison_method_name
+        if names is None or isinstance(names, string_types):
+            names = [names] if names is not None else []
+        self.comparison_method_names = list(names)
+        if len(self.comparison_method_names) > 0:
+            self.comparison_method_name = self.comparison_method_names[0]
             self.comparison_method = self.COMPARISON_METHODS[self.comparison_method_name]
         else:
+            self.comparison_method_name = None
             self.comparison_method = None
         if self.allowed_pairs_name is not None:
             self.allowed_pairs = self.VECTOR_TYPE_PAIRS[self.allowed_pairs_name]
@@ -139,16 +171,17 @@ class FeatureFileComparison(Task):
     def parameter_arguments(cls, parser, stdin, stdout, stderr, environ, **kwargs):
         parser.add_argument('-s', '--statistics',
                             metavar='FEATURESTATS',
-                            type=FileType.compressed('r'),
-                            help='FEATURE file containing standard devations of background [default: %(default)s]')
+                            help='FEATURE file containing standard devations of background'
+                                 ' or a compiled background [default: %(default)s]')
         parser.add_argument('-n', '--normalizations',
                             metavar='COEFFICIENTS',
-                            type=FileType.compressed('r'),
                             help='Map of normalization coefficients for residue type pairs [default: %(default)s]')
         parser.add_argument('--comparison-method',
                             metavar='COMPARISON_METHOD',
+                            action='append',
                             choices=cls.COMPARISON_METHODS.keys(),
-                            help='Scoring method to force (one of %(choices)s) [default: %(default)s]')
+                            help='Scoring method to force (one of %(choices)s). Repeat to add raw score'
+                                 ' columns for more methods from the same pass [default: %(default)s]')
         parser.add_argument('--allowed-pairs',
                             metavar='PAIR_SET_NAME',
                             choices=cls.VECTOR_TYPE_PAIRS.keys(),
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, print_function
+
+import logging
+import os
+import sys
+
+from feature.io import pointfile
+from feature.io.common import open_compressed
+from feature.io.locate_files import pdbidFromFilename
+
+from pocketfeature import defaults
+from pocketfeature.io import structurecache
+from pocketfeature.operations.pockets import (
+    extract_pockets_from_atoms,
+    focus_structure,
+)
+from pocketfeature.tasks.build_background import parse_pocket_def_line
+from pocketfeature.tasks.core import Task
+from pocketfeature.utils.args import LOG_LEVELS
+from pocketfeature.utils.pdb import list_ligands
+
+
+def parse_ligand_selector(selector):
+    """ Read a LIG[/CHAIN[/RESID]] selector as a (chain, residue id, ligand name)
+        triple, as found in pocket definition files
+    """
+    pdbid, lig_data = parse_pocket_def_line("- {0}".format(selector))
+    return lig_data
+
+
+def get_ligand_selector(ligand):
+    """ A selector matching exactly one ligand residue """
+    _, _, chain, (_, resnum, _) = ligand.get_full_id()
+    return (chain, resnum, ligand.get_resname().strip())
+
+
+class MultiPocketExtraction(Task):
+
+    def run(self):
+        params = self.params
+        logging.basicConfig(stream=params.log)
+        log = logging.getLogger('pf_extract_pockets')
+        log.setLevel(LOG_LEVELS.get(params.log_level, 'debug'))
+        self.log = log
+
+        pdbid = params.pdbid or pdbidFromFilename(params.pdb)
+        cache = structurecache.open_cache(params.structure_cache)
+        if cache is not None:
+            atoms = cache.load_atoms(params.pdb)
+        else:
+            atoms = structurecache.parse_file(params.pdb)
+
+        try:
+            if params.all_ligands:
+                ligand_structure = atoms.to_structure(pdbid, atoms.het)  # Ligands are het residues
+                selectors = [get_ligand_selector(ligand)
+                             for ligand in list_ligands(focus_structure(ligand_structure))]
+            else:
+                selectors = [parse_ligand_selector(selector) for selector in params.ligands]
+        except ValueError as e:
+            log.error(str(e))
+            sys.exit(-1)
+        if len(selectors) == 0:
+            selectors = [None]  # Pick the best ligand
+        log.info("Extracting {0} pockets from {1}".format(len(selectors), params.pdb))
+
+        pockets = extract_pockets_from_atoms(atoms, pdbid, selectors, cutoff=params.distance,
+                                                                      residue_centers=params.residue_centers)
+
+        if not os.path.exists(params.output_dir):
+            log.debug("Creating directory {0}".format(params.output_dir))
+            os.makedirs(params.output_dir)
+
+        num_failed = 0
+        for selector, pocket in zip(selectors, pockets):
+            if pocket is None:
+                num_failed += 1
+                log.warning("Could not find ligand {0} in {1}".format(selector, pdbid))
+                continue
+            ptf_path = os.path.join(params.output_dir,
+                                    params.template.format(signature=pocket.signature_string,
+                                                           pdbid=pdbid))
+            log.debug("Writing {0} to {1}".format(pocket.signature_string, ptf_path))
+            with open_compressed(ptf_path, 'w') as f:
+                pointfile.dump(pocket.points, f)
+            print(ptf_path, file=params.output)
+        log.info("Wrote {0} pockets ({1} failed)".format(len(pockets) - num_failed, num_failed))
+
+    @classmethod
+    def arguments(cls, stdin, stdout, stderr, environ, task_name):
+        from argparse import ArgumentParser
+        from pocketfeature.utils.args import FileType
+
+        parser = ArgumentParser(
+            """Extract the pockets of several ligands from one parse of a structure""")
+        parser.add_argument('pdb', metavar='PDB',
+                                   help='Path to PDB file')
+        parser.add_argument('ligands', metavar='LIG[/CHAIN[/RESID]]',
+                                       nargs='*',
+                                       help='Ligands to build pockets around [default: <largest>]')
+        parser.add_argument('-A', '--all-ligands', action='store_true',
+                                                   default=False,
+                                                   help='Build a pocket around every ligand in the structure [default: %(default)s]')
+        parser.add_argument('--pdbid', metavar='PDBID',
+                                       default=None,
+                                       help='PDB ID to use for input structure [default: from filename]')
+        parser.add_argument('-d', '--distance', metavar='CUTOFF',
+                                                type=float,
+                                                default=defaults.DEFAULT_LIGAND_RESIDUE_DISTANCE,
+                                                help='Residue active site distance threshold [default: %(default)s]')
+        parser.add_argument('--residue-centers', metavar='CENTERS',
+                                                 choices=defaults.NAMED_RESIDUE_CENTERS.keys(),
+                                                 default=defaults.DEFAULT_RESIDUE_CENTERS,
+                                                 help='Residue center definitions to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('--structure-cache', metavar='STRUCTURE_CACHE_DIR',
+                                                 default=None,
+                                                 help='Directory of parsed structures shared between runs [default: %(default)s]')
+        parser.add_argument('-O', '--output-dir', metavar='DIR',
+                                                  default='.',
+                                                  help='Directory to write pocket point files to [default: %(default)s]')
+        parser.add_argument('-t', '--template', metavar='TEMPLATE',
+                                                default='{signature}.ptf.gz',
+                                                help='Point file name for each pocket [default: %(default)s]')
+        parser.add_argument('-o', '--output', metavar='OUTPUT',
+                                              type=FileType.compressed('w'),
+                                              default=stdout,
+                                              help='Path to list written point files in [default: STDOUT]')
+        parser.add_argument('--log', metavar='LOG',
+                                     type=FileType,
+                                     default=stderr,
+                                     help='Path to log errors [default: STDERR]')
+        parser.add_argument('--log-level', metavar='LEVEL',
+                                           choices=LOG_LEVELS.keys(),
+                                           default='info',
+                                           nargs='?',
+                                           help="Set log level (%(choices)s) [default: %(default)s]")
+        return parser
+
+
+if __name__ == '__main__':
+    sys.exit(MultiPocketExtraction.run_as_script())
@@ -11,12 +11,14 @@ from feature.io import (
 from feature.io.common import open_compressed
 
 from pocketfeature.datastructs import NORMALIZED_SCORE
+from pocketfeature.datastructs.results import COMPARISON_RESULT_FIELDS
 
 from pocketfeature.io import (
     backgroundfile,
     featurefile,
     matrixvaluesfile,
     pdbfile,
+    vectorcache,
 )
 from pocketfeature.tasks.extract import (
     create_pocket_around_ligand,
@@ -38,16 +40,12 @@ from pocketfeature.tasks.visualize import create_alignment_visualizations
 from pocketfeature.utils.args import LOG_LEVELS
 from pocketfeature.utils.pdb import guess_pdbid_from_stream
 from pocketfeature.utils.ff import get_pocket_signature
+from pocketfeature.utils.service import (
+    ServiceError,
+    send_request,
+)
 from pocketfeature.tasks.core import Task
 
-#!/usr/bin/env python
-from __future__ import absolute_import
-
-from taskbase import Task
-
-
-
-
 
 def load_points(pdb_file,
                 points_file,
@@ -117,6 +115,7 @@ def generate_featurefile(points,
                          feature_cache=None,
                          link_cached=False,
                          featurize_args=None,
+                         vector_cache=None,
                          environ=os.environ,
                          log=logging,
                          log_label="Pocket"):
@@ -133,7 +132,8 @@ def generate_featurefile(points,
         features = featurize_points(points, 
                                     featurize_args=featurize_args,
                                     featurefile_args={
-                                        'rename_from_comment': 'DESCRIPTION'})
+                                        'rename_from_comment': 'DESCRIPTION'},
+                                    cache=vector_cache)
         using_cached = False
 
         if feature_cache is not None:
@@ -166,6 +166,14 @@ class ComparePockets(Task):
     BACKGROUND_COEFF_DEFAULT = 'background.coeffs'
 
     COULD_NOT_FIND_POCKET = 1
+    UNSUPPORTED_SERVER_OPTIONS = 2
+
+    LOCAL_ONLY_OPTIONS = (
+        'ptfA', 'ptfB', 'ffA', 'ffB',
+        'ptf_cache', 'ff_cache',
+        'raw_scores', 'alignment',
+        'pymolA', 'pymolB',
+    )
 
     def run(self):
         self.computed = {}
@@ -178,17 +186,19 @@ class ComparePockets(Task):
         log = logging.getLogger('pocketfeature')
         log.setLevel(LOG_LEVELS.get(params.log_level, 'debug'))
 
+        if params.server is not None:
+            return self.run_with_server(log)
+
         log.info("Loading background")
         log.debug("Allowed residue pairs: {0}".format(params.allowed_pairs)) 
         comparison_method = Compare.COMPARISON_METHODS[params.comparison_method]
         alignment_method = AlignScores.ALIGNMENT_METHODS[params.alignment_method]
         scale_method = AlignScores.SCALE_METHODS[params.scale_method]
 
-        background = backgroundfile.load(stats_file=params.background,
-                                         norms_file=params.normalization,
-                                         compare_function=comparison_method,
-                                         allowed_pairs=params.allowed_pairs,
-                                         std_threshold=params.std_threshold)
+        background = backgroundfile.load_from_paths(params.background, params.normalization,
+                                                    compare_function=comparison_method,
+                                                    allowed_pairs=params.allowed_pairs,
+                                                    std_threshold=params.std_threshold)
 
         log.info("Loading PDBs")
         log.debug("Extracting PDBIDs")
@@ -258,11 +268,13 @@ class ComparePockets(Task):
             log.debug("Checking for cached FEATURE files in: {0}".format(params.ff_cache))
             ffA_cache_file = params.ff_cache.format(pdbid=pdbidA, signature=signature_stringA)
             ffB_cache_file = params.ff_cache.format(pdbid=pdbidB, signature=signature_stringB)
+        vector_cache = vectorcache.open_cache(params.vector_cache)
 
         featurefileA = generate_featurefile(points=pointsA,
                                             feature_file=params.ffA,
                                             feature_cache=ffA_cache_file,
                                             link_cached=params.link_cached,
+                                            vector_cache=vector_cache,
                                             environ=environ,
                                             log=log,
                                             log_label='A')
@@ -271,6 +283,7 @@ class ComparePockets(Task):
                                             feature_file=params.ffB,
                                             feature_cache=ffB_cache_file,
                                             link_cached=params.link_cached,
+                                            vector_cache=vector_cache,
                                             environ=environ,
                                             log=log,
                                             log_label='B')
@@ -348,6 +361,53 @@ class ComparePockets(Task):
 
         return 0
 
+    def run_with_server(self, log):
+        """ Hand the comparison to a running pf_serve process, which keeps
+            the background, structures and pockets loaded between calls
+        """
+        params = self.params
+        local_only = [name for name in self.LOCAL_ONLY_OPTIONS
+                           if getattr(params, name, None) is not None]
+        if local_only:
+            log.error("Options not supported with --server (outputs and caches"
+                      " stay with the server): {0}".format(
+                      ", ".join('--' + name.replace('_', '-') for name in local_only)))
+            return self.UNSUPPORTED_SERVER_OPTIONS
+
+        log.info("Comparing with server at {0}".format(params.server))
+        request = {
+            'command': 'compare',
+            'pdbA': os.path.abspath(params.pdbA.name),
+            'pdbB': os.path.abspath(params.pdbB.name),
+            'modelA': params.modelA,
+            'modelB': params.modelB,
+            'chainA': params.chainA,
+            'chainB': params.chainB,
+            'ligandA': params.ligandA and params.ligandA.split(','),
+            'ligandB': params.ligandB and params.ligandB.split(','),
+            'background': os.path.abspath(params.background),
+            'normalization': params.normalization and os.path.abspath(params.normalization),
+            'compare_method': params.comparison_method,
+            'allowed_pairs': params.allowed_pairs,
+            'std_threshold': params.std_threshold,
+            'alignment_method': params.alignment_method,
+            'scale_method': params.scale_method,
+            'cutoff': params.cutoff,
+            'distance': params.distance,
+        }
+        try:
+            self.computed = send_request(request, socket_path=params.server)
+        except ServiceError as e:
+            log.error("Comparison failed: {0}".format(e))
+            return self.COULD_NOT_FIND_POCKET
+
+        writer = csv.DictWriter(params.output,
+                                dialect=csv.excel_tab,
+                                fieldnames=COMPARISON_RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerow(self.computed)
+        return 0
+
     @classmethod
     def defaults(cls, stdin, stdout, stderr, environ):
         background_ff = cls.BACKGROUND_FF_DEFAULT
@@ -400,6 +460,7 @@ class ComparePockets(Task):
             'ffB': None,
             'ptf_cache': None,
             'ff_cache': None,
+            'vector_cache': None,
             'pdb_dir': environ.get('PDB_DIR', '.'),
             'dssp_dir': environ.get('DSSP_DIR', '.'),
             'check_cache_first': False,
@@ -411,6 +472,7 @@ class ComparePockets(Task):
             'rescale': False,
             'log': stderr,
             'log_level': 'info',
+            'server': None,
         }
 
 
@@ -454,10 +516,9 @@ class ComparePockets(Task):
                                          nargs='?',
                                          help='Ligand ID to build second pocket around [default: <largest>]')
         parser.add_argument('-b', '--background', metavar='FEATURESTATS',
-                                      type=FileType.compressed('r'),
-                                      help='FEATURE file containing standard devations of background [default: %(default)s]')
+                                      help='FEATURE file containing standard devations of background'
+                                           ' or a compiled background [default: %(default)s]')
         parser.add_argument('-n', '--normalization', metavar='COEFFICIENTS',
-                                      type=FileType.compressed('r'),
                                       help='Map of normalization coefficients for residue type pairs [default: %(default)s')
         parser.add_argument('-p', '--allowed-pairs', metavar='PAIR_SET_NAME',
                                       choices=Compare.ALLOWED_VECTOR_TYPE_PAIRS.keys(),
@@ -512,6 +573,11 @@ class ComparePockets(Task):
                                           help='Pattern to check for cached FEATURE files'
                                                ' (variables: {pdbid, ligid, signature})'
                                                ' [default: None]')
+        parser.add_argument('--vector-cache', metavar='VECTOR_CACHE_DIR',
+                                              type=str,
+                                              nargs='?',
+                                              help='Directory of featurized residue centers shared'
+                                                   ' between pockets and runs [default: None]')
         parser.add_argument('--pdb-dir', metavar='PDB_DIR',
                                          type=str,
                                          nargs='?',
@@ -545,6 +611,11 @@ class ComparePockets(Task):
                                         help='Path to second PyMol script [default: None]')
         parser.add_argument('--rescale', action='store_true',
                                          help='EXPERIMENTAL: Rescale score to pocket size [default: No]')
+        parser.add_argument('--server', metavar='SOCKET',
+                                        nargs='?',
+                                        help='Run the comparison in a pf_serve process listening on SOCKET'
+                                             ' (not combinable with output or cache files)'
+                                             ' [default: None]')
         parser.add_argument('--log', metavar='LOG',
                                      type=FileType,
                                      help='Path to log errors [default: %(default)s]')
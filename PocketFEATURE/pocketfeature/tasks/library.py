@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, print_function
+
+import csv
+import logging
+import os
+import sys
+
+from feature.io import pointfile
+
+from pocketfeature.io import (
+    featurefile,
+    pocketlibrary,
+)
+from pocketfeature.tasks.core import Task
+from pocketfeature.tasks.search import (
+    get_library_paths,
+    get_library_pocket_name,
+    load_pocket_features,
+)
+from pocketfeature.utils.args import LOG_LEVELS
+
+
+def iter_source_pockets(sources, log=logging):
+    """ Generate (signature, FEATURE file) for FEATURE files, directories
+        of them, or files listing their paths
+    """
+    for source in sources:
+        if os.path.isdir(source) or not source.endswith(('.ff', '.ff.gz')):
+            paths = get_library_paths(source, log=log)
+        else:
+            paths = [source]
+        for path in paths:
+            log.debug("Adding {0}".format(path))
+            yield get_library_pocket_name(path), load_pocket_features(path)
+
+
+class PocketLibraryTool(Task):
+    LIST_COLUMNS = ('signature', 'num_vectors', 'vector_types')
+
+    def run(self):
+        params = self.params
+        logging.basicConfig(stream=params.log)
+        log = logging.getLogger('pf_library')
+        log.setLevel(LOG_LEVELS.get(params.log_level, 'debug'))
+        self.log = log
+
+        if len(params.sources) > 0:
+            self.add_pockets()
+        if params.list:
+            self.list_pockets()
+        if params.extract is not None:
+            self.extract_pocket()
+
+    def add_pockets(self):
+        params = self.params
+        pockets = iter_source_pockets(params.sources, log=self.log)
+        try:
+            if params.append:
+                num_existing = pocketlibrary.append(pockets, params.library)
+                log_message = "Appended to {0} existing pockets in {1}"
+                self.log.info(log_message.format(num_existing, params.library))
+            else:
+                num_pockets = pocketlibrary.dump(pockets, params.library)
+                self.log.info("Wrote {0} pockets to {1}".format(num_pockets, params.library))
+        except ValueError as e:
+            self.log.error(str(e))
+            sys.exit(-1)
+
+    def list_pockets(self):
+        library = pocketlibrary.load(self.params.library)
+        writer = csv.writer(self.params.output, dialect=csv.excel_tab)
+        writer.writerow(self.LIST_COLUMNS)
+        for signature in library.signatures[self.params.start:self.params.stop]:
+            types = library.get_vector_types(signature)
+            num_vectors = sum(stop - start for start, stop in types.values())
+            writer.writerow((signature, num_vectors, ",".join(sorted(types))))
+
+    def extract_pocket(self):
+        params = self.params
+        library = pocketlibrary.load(params.library)
+        if params.extract not in library:
+            self.log.error("Pocket {0} is not in {1}".format(params.extract, params.library))
+            sys.exit(-1)
+        if params.points:
+            pointfile.dump(library.get_points(params.extract), params.output)
+        else:
+            featurefile.dump(library.get(params.extract), params.output)
+
+    @classmethod
+    def arguments(cls, stdin, stdout, stderr, environ, task_name):
+        from argparse import ArgumentParser
+        from pocketfeature.utils.args import FileType
+
+        parser = ArgumentParser(
+            """Build, append to and read from a single-file library of featurized pockets""")
+        parser.add_argument('library', metavar='LIBRARY',
+                                       help='Path to the pocket library')
+        parser.add_argument('sources', metavar='POCKETS',
+                                       nargs='*',
+                                       help='Pocket FEATURE files, directories of them or files listing their paths'
+                                            ' to store in the library')
+        parser.add_argument('-a', '--append', action='store_true',
+                                              default=False,
+                                              help='Add pockets to an existing library instead of replacing it [default: %(default)s]')
+        parser.add_argument('-l', '--list', action='store_true',
+                                            default=False,
+                                            help='List the pockets stored in the library [default: %(default)s]')
+        parser.add_argument('--start', metavar='INDEX',
+                                       type=int,
+                                       default=None,
+                                       help='First pocket to list [default: first]')
+        parser.add_argument('--stop', metavar='INDEX',
+                                      type=int,
+                                      default=None,
+                                      help='Stop listing before this pocket [default: last]')
+        parser.add_argument('-x', '--extract', metavar='SIGNATURE',
+                                               default=None,
+                                               help='Write the FEATURE file of one pocket to OUTPUT')
+        parser.add_argument('--points', action='store_true',
+                                        default=False,
+                                        help='Extract the pocket points instead of its FEATURE vectors [default: %(default)s]')
+        parser.add_argument('-o', '--output', metavar='OUTPUT',
+                                              type=FileType.compressed('w'),
+                                              default=stdout,
+                                              help='Path to write listings or extracted pockets [default: STDOUT]')
+        parser.add_argument('--log', metavar='LOG',
+                                     type=FileType,
+                                     default=stderr,
+                                     help='Path to log errors [default: STDERR]')
+        parser.add_argument('--log-level', metavar='LEVEL',
+                                           choices=LOG_LEVELS.keys(),
+                                           default='info',
+                                           nargs='?',
+                                           help="Set log level (%(choices)s) [default: %(default)s]")
+        return parser
+
+
+if __name__ == '__main__':
+    sys.exit(PocketLibraryTool.run_as_script())
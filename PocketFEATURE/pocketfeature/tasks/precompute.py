@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, print_function
+
+import itertools
+import logging
+import multiprocessing
+import os
+import sys
+
+from feature.io.common import open_compressed
+from feature.io.locate_files import pdbidFromFilename
+
+from pocketfeature import defaults
+from pocketfeature.io import (
+    centerstore,
+    structurecache,
+    vectorcache,
+)
+from pocketfeature.operations.featurize import featurize_points
+from pocketfeature.operations.pockets import (
+    focus_structure,
+    get_center_calculator,
+    get_residue_center_function,
+)
+from pocketfeature.tasks.build_background import get_pdb_list
+from pocketfeature.tasks.core import (
+    Task,
+    ensure_all_imap_unordered_results_finish,
+)
+from pocketfeature.utils.args import LOG_LEVELS
+from pocketfeature.utils.pdb import is_het_residue
+
+
+# Shared by every structure in a process. Workers receive it once, when
+# they are forked, instead of with every PDB
+_precompute_state = {}
+
+
+def precompute_structure_centers(pdbid, pdb_path, store_dir,
+                                 residue_centers=defaults.DEFAULT_RESIDUE_CENTERS,
+                                 model=0,
+                                 featurize_args=None,
+                                 vector_cache=None,
+                                 structure_cache=None):
+    """ Featurize every residue center of a structure in one featurize run
+        and write them to the structure's center store. Returns the
+        number of centers stored
+    """
+    if structure_cache is not None:
+        atoms = structure_cache.load_atoms(pdb_path)
+    else:
+        with open_compressed(pdb_path) as f:
+            atoms = structurecache.parse(f)
+
+    keys = []
+    points = []
+    calculator = get_center_calculator(residue_centers)
+    if calculator is not None:
+        in_model = atoms.model == model
+        if not in_model.any():
+            raise ValueError("Model {0!r} not found in {1}".format(model, pdb_path))
+        for key, code, point in centerstore.iter_atoms_centers(atoms, calculator,
+                                                               selected=in_model & ~atoms.het):
+            keys.append(key)
+            points.append(centerstore.make_keyed_center_point(pdbid, key, code, point))
+    else:
+        structure = focus_structure(atoms.to_structure(pdbid), model=model)
+        residue_centers = get_residue_center_function(residue_centers)
+        for residue, code, point in centerstore.iter_structure_centers(structure, residue_centers,
+                                                                       excluded=is_het_residue):
+            keys.append(centerstore.get_center_key(residue, code))
+            points.append(centerstore.make_center_point(pdbid, residue, code, point))
+    if len(points) == 0:
+        raise ValueError("No residue centers found in {0}".format(pdb_path))
+
+    features = featurize_points(points,
+                                featurize_args=featurize_args,
+                                featurefile_args={'rename_from_comment': 'DESCRIPTION'},
+                                cache=vector_cache)
+    centerstore.dump(keys, features, centerstore.get_structure_prefix(store_dir, pdbid))
+    return len(keys)
+
+
+def _set_precompute_state(**state):
+    _precompute_state.clear()
+    _precompute_state.update(state)
+
+
+def _precompute_structure_centers_star(pdb_info):
+    pdbid, pdb_path = pdb_info
+    try:
+        return pdbid, precompute_structure_centers(pdbid, pdb_path, **_precompute_state)
+    except Exception as e:
+        return pdbid, e
+
+
+class PrecomputeCenterVectors(Task):
+
+    def run(self):
+        params = self.params
+        logging.basicConfig(stream=params.log)
+        log = logging.getLogger('pf_precompute')
+        log.setLevel(LOG_LEVELS.get(params.log_level, 'debug'))
+        self.log = log
+
+        if not os.path.exists(params.store):
+            log.debug("Creating directory {0}".format(params.store))
+            os.makedirs(params.store)
+
+        pdbs = get_pdb_list(params.pdbs, pdb_dir=params.pdb_dir, log=log, fail_on_missing=False)
+        pdbs = [(pdbidFromFilename(pdb_path), pdb_path) for (pdbid, pdb_path), lig in pdbs]
+        if not params.overwrite:
+            pending = [(pdbid, pdb_path) for pdbid, pdb_path in pdbs
+                       if not centerstore.exists(centerstore.get_structure_prefix(params.store, pdbid))]
+            log.info("Skipping {0} already computed structures".format(len(pdbs) - len(pending)))
+            pdbs = pending
+        num_pdbs = len(pdbs)
+        log.info("Featurizing residue centers of {0} structures".format(num_pdbs))
+
+        _set_precompute_state(store_dir=params.store,
+                              residue_centers=params.residue_centers,
+                              featurize_args={
+                                  'environ': {
+                                      'PDB_DIR': params.pdb_dir,
+                                      'DSSP_DIR': params.dssp_dir,
+                                      'FEATURE_DIR': params.feature_dir,
+                                  },
+                              },
+                              vector_cache=vectorcache.open_cache(params.vector_cache),
+                              structure_cache=structurecache.open_cache(params.structure_cache))
+
+        if params.num_processors is not None and params.num_processors > 1:
+            log.info("Featurizing with {0} workers".format(params.num_processors))
+            self.pool = multiprocessing.Pool(params.num_processors)
+            raw_results = self.pool.imap_unordered(_precompute_structure_centers_star, pdbs)
+            results = ensure_all_imap_unordered_results_finish(raw_results, expected=num_pdbs)
+        else:
+            results = itertools.imap(_precompute_structure_centers_star, pdbs)
+
+        failed = 0
+        num_centers = 0
+        for idx, (pdbid, result) in enumerate(results, start=1):
+            if isinstance(result, Exception):
+                failed += 1
+                log.warning("Could not featurize {0}: {1}".format(pdbid, result))
+            else:
+                num_centers += result
+                log.debug("Stored {0} centers for {1}".format(result, pdbid))
+            if params.progress:
+                print("\r{0} of {1} structures featurized ({2} failed)".format(
+                        idx, num_pdbs, failed), end="", file=sys.stderr)
+                sys.stderr.flush()
+        if params.progress:
+            print("", file=sys.stderr)
+        log.info("Stored {0} residue centers ({1} structures failed)".format(num_centers, failed))
+
+    @classmethod
+    def arguments(cls, stdin, stdout, stderr, environ, task_name):
+        from argparse import ArgumentParser
+        from pocketfeature.utils.args import FileType
+
+        parser = ArgumentParser(
+            """Featurize every residue center of a set of structures for pocket selection""")
+        parser.add_argument('pdbs', metavar='PDBS',
+                                    help='Path to a file containing PDB ids or a directory of PDB files')
+        parser.add_argument('-s', '--store', metavar='STORE_DIR',
+                                             required=True,
+                                             help='Directory to write per-structure center vectors to')
+        parser.add_argument('--pdb-dir', metavar='PDB_DIR',
+                                         default=environ.get('PDB_DIR', '.'),
+                                         help='Directory to look for PDBs in [default: %(default)s]')
+        parser.add_argument('--dssp-dir', metavar='DSSP_DIR',
+                                          default=environ.get('DSSP_DIR', '.'),
+                                          help='Directory to look for DSSP files in [default: %(default)s]')
+        parser.add_argument('--feature-dir', metavar='FEATURE_DIR',
+                                             default=environ.get('FEATURE_DIR'),
+                                             help='Directory to look for FEATURE data files in [default: %(default)s]')
+        parser.add_argument('--residue-centers', metavar='CENTERS',
+                                                 choices=defaults.NAMED_RESIDUE_CENTERS.keys(),
+                                                 default=defaults.DEFAULT_RESIDUE_CENTERS,
+                                                 help='Residue center definitions to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('--vector-cache', metavar='VECTOR_CACHE_DIR',
+                                              default=None,
+                                              help='Directory of featurized residue centers shared'
+                                                   ' between pockets and runs [default: %(default)s]')
+        parser.add_argument('--structure-cache', metavar='STRUCTURE_CACHE_DIR',
+                                                 default=None,
+                                                 help='Directory of parsed structures shared between runs [default: %(default)s]')
+        parser.add_argument('--overwrite', action='store_true',
+                                           default=False,
+                                           help='Recompute structures that are already stored [default: %(default)s]')
+        parser.add_argument('-P', '--num-processors', metavar='PROCS',
+                                                      default=1,
+                                                      type=int,
+                                                      help='Number of processes to use [default: %(default)s]')
+        parser.add_argument('--progress', action='store_true',
+                                          default=False,
+                                          help='Show interactive progress [default: %(default)s]')
+        parser.add_argument('--log', metavar='LOG',
+                                     type=FileType,
+                                     default=stderr,
+                                     help='Path to log errors [default: STDERR]')
+        parser.add_argument('--log-level', metavar='LEVEL',
+                                           choices=LOG_LEVELS.keys(),
+                                           default='info',
+                                           nargs='?',
+                                           help="Set log level (%(choices)s) [default: %(default)s]")
+        return parser
+
+
+if __name__ == '__main__':
+    sys.exit(PrecomputeCenterVectors.run_as_script())
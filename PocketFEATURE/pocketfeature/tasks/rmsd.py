@@ -25,8 +25,8 @@ class AlignmentRmsdComputation(Task):
 
     def load_inputs(self):
         alignment = matrixvaluesfile.load(use_file(self.alignment_file), cast=float)
-        pointsA = pointfile.load(use_file(self.pointfileA))
-        pointsB = pointfile.load(use_file(self.pointfileB))
+        pointsA = pointfile.load_pointset(use_file(self.pointfileA))
+        pointsB = pointfile.load_pointset(use_file(self.pointfileB))
 
         self.alignment = alignment
         self.pointsA = pointsA
@@ -20,6 +20,7 @@ from pocketfeature.io import (
     featurefile,
     matrixvaluesfile,
     pdbfile,
+    vectorcache,
 )
 
 from .extract import PocketExtraction
@@ -172,6 +173,7 @@ def generate_featurefile(points,
                          feature_cache=None,
                          link_cached=False,
                          featurize_args=None,
+                         vector_cache=None,
                          environ=os.environ,
                          log=logging,
                          log_label="Pocket"):
@@ -188,7 +190,8 @@ def generate_featurefile(points,
         features = featurize_points(points, 
                                     featurize_args=featurize_args,
                                     featurefile_args={
-                                        'rename_from_comment': 'DESCRIPTION'})
+                                        'rename_from_comment': 'DESCRIPTION'},
+                                    cache=vector_cache)
         using_cached = False
 
         if feature_cache is not None:
@@ -239,11 +242,10 @@ class ComparePockets(Task):
         alignment_method = AlignScores.ALIGNMENT_METHODS[params.alignment_method]
         scale_method = AlignScores.SCALE_METHODS[params.scale_method]
 
-        background = backgroundfile.load(stats_file=params.background,
-                                         norms_file=params.normalization,
-                                         compare_function=comparison_method,
-                                         allowed_pairs=params.allowed_pairs,
-                                         std_threshold=params.std_threshold)
+        background = backgroundfile.load_from_paths(params.background, params.normalization,
+                                                    compare_function=comparison_method,
+                                                    allowed_pairs=params.allowed_pairs,
+                                                    std_threshold=params.std_threshold)
 
         log.info("Loading PDBs")
         log.debug("Extracting PDBIDs")
@@ -313,11 +315,13 @@ class ComparePockets(Task):
             log.debug("Checking for cached FEATURE files in: {0}".format(params.ff_cache))
             ffA_cache_file = params.ff_cache.format(pdbid=pdbidA, signature=signature_stringA)
             ffB_cache_file = params.ff_cache.format(pdbid=pdbidB, signature=signature_stringB)
+        vector_cache = vectorcache.open_cache(params.vector_cache)
 
         featurefileA = generate_featurefile(points=pointsA,
                                             feature_file=params.ffA,
                                             feature_cache=ffA_cache_file,
                                             link_cached=params.link_cached,
+                                            vector_cache=vector_cache,
                                             environ=environ,
                                             log=log,
                                             log_label='A')
@@ -326,6 +330,7 @@ class ComparePockets(Task):
                                             feature_file=params.ffB,
                                             feature_cache=ffB_cache_file,
                                             link_cached=params.link_cached,
+                                            vector_cache=vector_cache,
                                             environ=environ,
                                             log=log,
                                             log_label='B')
@@ -455,6 +460,7 @@ class ComparePockets(Task):
             'ffB': None,
             'ptf_cache': None,
             'ff_cache': None,
+            'vector_cache': None,
             'pdb_dir': environ.get('PDB_DIR', '.'),
             'dssp_dir': environ.get('DSSP_DIR', '.'),
             'check_cache_first': False,
@@ -509,10 +515,9 @@ class ComparePockets(Task):
                                          nargs='?',
                                          help='Ligand ID to build second pocket around [default: <largest>]')
         parser.add_argument('-b', '--background', metavar='FEATURESTATS',
-                                      type=FileType.compressed('r'),
-                                      help='FEATURE file containing standard devations of background [default: %(default)s]')
+                                      help='FEATURE file containing standard devations of background'
+                                           ' or a compiled background [default: %(default)s]')
         parser.add_argument('-n', '--normalization', metavar='COEFFICIENTS',
-                                      type=FileType.compressed('r'),
                                       help='Map of normalization coefficients for residue type pairs [default: %(default)s')
         parser.add_argument('-p', '--allowed-pairs', metavar='PAIR_SET_NAME',
                                       choices=Compare.ALLOWED_VECTOR_TYPE_PAIRS.keys(),
@@ -567,6 +572,11 @@ class ComparePockets(Task):
                                           help='Pattern to check for cached FEATURE files'
                                                ' (variables: {pdbid, ligid, signature})'
                                                ' [default: None]')
+        parser.add_argument('--vector-cache', metavar='VECTOR_CACHE_DIR',
+                                              type=str,
+                                              nargs='?',
+                                              help='Directory of featurized residue centers shared'
+                                                   ' between pockets and runs [default: None]')
         parser.add_argument('--pdb-dir', metavar='PDB_DIR',
                                          type=str,
                                          nargs='?',
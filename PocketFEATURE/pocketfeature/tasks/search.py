@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, print_function
+
+import csv
+import heapq
+import itertools
+import logging
+import multiprocessing
+import operator
+import os
+import sys
+
+from feature.io.common import open_compressed
+
+from pocketfeature import defaults
+from pocketfeature.datastructs import NORMALIZED_SCORE
+from pocketfeature.datastructs.results import (
+    SearchResults,
+    SEARCH_RESULT_FIELDS,
+)
+from pocketfeature.io import (
+    backgroundfile,
+    featurefile,
+    pocketlibrary,
+)
+from pocketfeature.operations.align import (
+    make_updated_methods,
+    perform_alignment,
+)
+from pocketfeature.tasks.core import (
+    Task,
+    ensure_all_imap_unordered_results_finish,
+)
+from pocketfeature.utils.args import LOG_LEVELS
+from pocketfeature.utils.service import send_request
+
+
+FEATURE_FILE_EXTENSIONS = ('.ff', '.ff.gz')
+
+# Shared by every comparison in a process. Workers receive it once, when
+# they are forked, instead of with every library pocket
+_search_state = {}
+
+
+def get_library_pocket_name(path):
+    name = os.path.basename(path)
+    for extension in FEATURE_FILE_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def get_library_paths(library_src, log=logging):
+    """ Takes a directory of FEATURE files or a file listing their paths
+        (one per line) and returns the FEATURE file paths
+    """
+    if not os.path.exists(library_src):
+        raise RuntimeError("{0} not found".format(library_src))
+    elif os.path.isdir(library_src):
+        log.info("Looking for FEATURE files in directory: {0}".format(library_src))
+        names = sorted(name for name in os.listdir(library_src)
+                            if name.endswith(FEATURE_FILE_EXTENSIONS))
+        return [os.path.join(library_src, name) for name in names]
+    else:
+        log.info("Reading FEATURE file paths from file: {0}".format(library_src))
+        with open(library_src) as f:
+            paths = [line.strip() for line in f]
+        return [path for path in paths if path and not path.startswith('#')]
+
+
+def load_pocket_features(path):
+    with open_compressed(path) as f:
+        return featurefile.load(f)
+
+
+class FeatureFileSet(object):
+    """ A set of per-pocket FEATURE files, read the same way as a
+        PocketLibrary: by pocket name
+    """
+
+    def __init__(self, paths):
+        self.paths = dict((get_library_pocket_name(path), path) for path in paths)
+        self.signatures = [get_library_pocket_name(path) for path in paths]
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def __contains__(self, signature):
+        return signature in self.paths
+
+    def get(self, signature):
+        return load_pocket_features(self.paths[signature])
+
+
+def open_pocket_library(library_src, log=logging):
+    """ Opens a pocket library file, or the FEATURE files found by
+        get_library_paths, as a collection of named pockets
+    """
+    if pocketlibrary.is_library(library_src):
+        log.info("Opening pocket library: {0}".format(library_src))
+        return pocketlibrary.load(library_src)
+    else:
+        return FeatureFileSet(get_library_paths(library_src, log=log))
+
+
+def align_pocket_features(background, pocketA, pocketB, align_method, scale_function,
+                          cutoff=defaults.DEFAULT_SCORE_CUTOFF,
+                          nameA=None,
+                          nameB=None):
+    """ Score and align two featurized pockets """
+    numA = len(pocketA.vectors)
+    numB = len(pocketB.vectors)
+
+    scores = background.get_comparison_matrix(pocketA, pocketB)
+    normalized = scores.slice_values(NORMALIZED_SCORE)
+    alignment = perform_alignment(align_method, normalized, cutoff)
+    num_aligned = len(alignment)
+    total_score = sum(alignment.values())
+
+    scale_sizes = (numA, numB, len(scores), num_aligned)
+    scaled_score = scale_function((), scale_sizes, total_score)
+    return SearchResults(pocket_a=nameA,
+                         pocket_b=nameB,
+                         num_a=numA,
+                         num_b=numB,
+                         num_scored=len(scores),
+                         num_aligned=num_aligned,
+                         alignment_score=round(total_score, 3),
+                         scaled_score=round(scaled_score, 3))
+
+
+def search_library_pocket(background, query, library, name, align_method, scale_function,
+                          cutoff=defaults.DEFAULT_SCORE_CUTOFF,
+                          query_name=None):
+    """ Score and align a query pocket against one library pocket """
+    pocket = library.get(name)
+    return align_pocket_features(background, query, pocket, align_method, scale_function,
+                                 cutoff=cutoff,
+                                 nameA=query_name,
+                                 nameB=name)
+
+
+def _set_search_state(**state):
+    _search_state.clear()
+    _search_state.update(state)
+
+
+def _search_library_pocket_star(name):
+    try:
+        return name, search_library_pocket(name=name, **_search_state)
+    except Exception as e:
+        return name, e
+
+
+class SearchPocketLibrary(Task):
+    BACKGROUND_FF_DEFAULT = 'background.ff'
+    BACKGROUND_COEFF_DEFAULT = 'background.coeffs'
+    DEFAULT_CUTOFF = -0.15
+
+    def run(self):
+        params = self.params
+        logging.basicConfig(stream=params.log)
+        log = logging.getLogger('pf_search')
+        log.setLevel(LOG_LEVELS.get(params.log_level, 'debug'))
+        self.log = log
+
+        if params.server is not None:
+            self.search_with_server()
+            return
+
+        log.info("Loading background")
+        background = backgroundfile.load_from_paths(params.background, params.normalization,
+                                                    compare_function=params.compare_method,
+                                                    allowed_pairs=params.allowed_pairs,
+                                                    std_threshold=params.std_threshold)
+
+        log.info("Loading query pocket {0}".format(params.query))
+        query = load_pocket_features(params.query)
+        library = open_pocket_library(params.library, log=log)
+        names = library.signatures
+        num_pockets = len(names)
+        log.info("Searching {0} library pockets".format(num_pockets))
+
+        align_method = make_updated_methods()[params.alignment_method]
+        scale_function = defaults.ALLOWED_SCALE_FUNCTIONS[params.scale_method]
+        _set_search_state(background=background,
+                          query=query,
+                          library=library,
+                          query_name=get_library_pocket_name(params.query),
+                          align_method=align_method,
+                          scale_function=scale_function,
+                          cutoff=params.cutoff)
+
+        if params.num_processors is not None and params.num_processors > 1:
+            log.info("Searching with {0} workers".format(params.num_processors))
+            self.pool = multiprocessing.Pool(params.num_processors)
+            raw_results = self.pool.imap_unordered(_search_library_pocket_star, names)
+            results = ensure_all_imap_unordered_results_finish(raw_results, expected=num_pockets)
+        else:
+            results = itertools.imap(_search_library_pocket_star, names)
+
+        results = self.collect_results(results, num_pockets)
+        # Lower scores are better; names break ties so rankings are stable
+        ranking_key = operator.attrgetter('scaled_score', 'pocket_b')
+        if params.top is not None:
+            ranked = heapq.nsmallest(params.top, results, key=ranking_key)
+        else:
+            ranked = sorted(results, key=ranking_key)
+
+        self.write_results(ranked)
+        log.info("Searched {0} pockets ({1} failed)".format(num_pockets, self.failed))
+
+    def search_with_server(self):
+        """ Hand the search to a running pf_serve process """
+        params = self.params
+        self.log.info("Searching with server at {0}".format(params.server))
+        request = {
+            'command': 'search',
+            'query': os.path.abspath(params.query),
+            'library': os.path.abspath(params.library),
+            'top': params.top,
+            'background': os.path.abspath(params.background),
+            'normalization': os.path.abspath(params.normalization),
+            'compare_method': params.compare_method,
+            'allowed_pairs': params.allowed_pairs,
+            'std_threshold': params.std_threshold,
+            'alignment_method': params.alignment_method,
+            'scale_method': params.scale_method,
+            'cutoff': params.cutoff,
+        }
+        results = send_request(request, socket_path=params.server)
+        self.write_results(SearchResults(**result) for result in results)
+
+    def write_results(self, ranked):
+        writer = csv.writer(self.params.output, dialect=csv.excel_tab)
+        writer.writerow(('rank',) + SEARCH_RESULT_FIELDS)
+        for rank, result in enumerate(ranked, start=1):
+            writer.writerow((rank,) + tuple(result))
+
+    def collect_results(self, results, num_pockets):
+        """ Drop (and log) failed comparisons, optionally showing progress """
+        self.failed = 0
+        for idx, (name, result) in enumerate(results, start=1):
+            if isinstance(result, Exception):
+                self.failed += 1
+                self.log.warning("Could not compare {0}: {1}".format(name, result))
+            else:
+                yield result
+            if self.params.progress:
+                print("\r{0} of {1} library pockets searched ({2} failed)".format(
+                        idx, num_pockets, self.failed), end="", file=sys.stderr)
+                sys.stderr.flush()
+        if self.params.progress:
+            print("", file=sys.stderr)
+
+    @classmethod
+    def arguments(cls, stdin, stdout, stderr, environ, task_name):
+        from argparse import ArgumentParser
+        from pocketfeature.utils.args import FileType
+
+        parser = ArgumentParser(
+            """Search a library of featurized pockets for matches to a query pocket""")
+        parser.add_argument('query', metavar='QUERY',
+                                     help='FEATURE file of the query pocket')
+        parser.add_argument('library', metavar='LIBRARY',
+                                       help='Pocket library, directory of pocket FEATURE files'
+                                            ' or a file listing their paths')
+        parser.add_argument('-b', '--background', metavar='FEATURESTATS',
+                                                  default=cls.BACKGROUND_FF_DEFAULT,
+                                                  help='FEATURE file containing standard devations of background'
+                                                       ' or a compiled background [default: %(default)s]')
+        parser.add_argument('-n', '--normalization', metavar='COEFFICIENTS',
+                                      default=cls.BACKGROUND_COEFF_DEFAULT,
+                                      help='Map of normalization coefficients for residue type pairs [default: %(default)s]')
+        parser.add_argument('-p', '--allowed-pairs', metavar='PAIR_SET_NAME',
+                                      choices=defaults.ALLOWED_VECTOR_TYPE_PAIRS.keys(),
+                                      default=defaults.DEFAULT_VECTOR_TYPE_PAIRS,
+                                      help='Alignment method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-t', '--std-threshold', metavar='NSTD',
+                                     type=float,
+                                     default=1.0,
+                                     help="Number of standard deviations between to features to allow as 'similar'")
+        parser.add_argument('-C', '--compare-method', metavar='COMPARISON',
+                                              choices=defaults.ALLOWED_SIMILARITY_METHODS.keys(),
+                                              default=defaults.DEFAULT_SIMILARITY_METHOD,
+                                              help='Comparison method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-A', '--alignment-method', metavar='ALIGNMENT',
+                                              choices=defaults.ALLOWED_ALIGNMENT_METHODS.keys(),
+                                              default=defaults.DEFAULT_ALIGNMENT_METHOD,
+                                              help='Alignment method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-S', '--scale-method', metavar='SCALING',
+                                              choices=defaults.ALLOWED_SCALE_FUNCTIONS.keys(),
+                                              default=defaults.DEFAULT_SCALE_FUNCTION,
+                                              help='Scoring scaling method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-c', '--cutoff', metavar='CUTOFF',
+                                              type=float,
+                                              default=cls.DEFAULT_CUTOFF,
+                                              help='Minium score (cutoff) to align [default: %(default)s]')
+        parser.add_argument('-k', '--top', metavar='K',
+                                           type=int,
+                                           default=None,
+                                           help='Only report the K best matching pockets [default: all]')
+        parser.add_argument('-o', '--output', metavar='RESULTS',
+                                              type=FileType.compressed('w'),
+                                              default=stdout,
+                                              help='Path to ranked results file [default: STDOUT]')
+        parser.add_argument('-P', '--num-processors', metavar='PROCS',
+                                                      default=1,
+                                                      type=int,
+                                                      help='Number of processes to use [default: %(default)s]')
+        parser.add_argument('--server', metavar='SOCKET',
+                                        default=None,
+                                        help='Run the search in a pf_serve process listening on SOCKET [default: %(default)s]')
+        parser.add_argument('--progress', action='store_true',
+                                          default=False,
+                                          help='Show interactive progress [default: %(default)s]')
+        parser.add_argument('--log', metavar='LOG',
+                                     type=FileType,
+                                     default=stderr,
+                                     help='Path to log errors [default: STDERR]')
+        parser.add_argument('--log-level', metavar='LEVEL',
+                                           choices=LOG_LEVELS.keys(),
+                                           default='info',
+                                           nargs='?',
+                                           help="Set log level (%(choices)s) [default: %(default)s]")
+        return parser
+
+
+if __name__ == '__main__':
+    sys.exit(SearchPocketLibrary.run_as_script())
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+from __future__ import absolute_import, print_function
+
+import logging
+import os
+import sys
+
+from six.moves import socketserver
+
+from feature.io.common import open_compressed
+from feature.io.locate_files import pdbidFromFilename
+
+from pocketfeature import defaults
+from pocketfeature.algorithms import alignment_rmsd
+from pocketfeature.datastructs import (
+    LRUCache,
+    NORMALIZED_SCORE,
+)
+from pocketfeature.datastructs.results import COMPARISON_RESULT_FIELDS
+from pocketfeature.io import (
+    backgroundfile,
+    centerstore,
+    pdbfile,
+    pocketlibrary,
+    vectorcache,
+)
+from pocketfeature.operations.align import (
+    make_updated_methods,
+    perform_alignment,
+)
+from pocketfeature.operations.featurize import featurize_points
+from pocketfeature.operations.pockets import (
+    create_pocket_around_ligand,
+    find_one_of_ligand_in_structure,
+    focus_structure,
+    pick_best_ligand,
+)
+from pocketfeature.tasks.core import Task
+from pocketfeature.tasks.search import (
+    align_pocket_features,
+    get_library_pocket_name,
+    load_pocket_features,
+    open_pocket_library,
+)
+from pocketfeature.utils.args import LOG_LEVELS
+from pocketfeature.utils.ff import get_pocket_signature
+from pocketfeature.utils.service import (
+    DEFAULT_SOCKET,
+    decode_message,
+    encode_message,
+)
+
+
+def get_file_key(path):
+    """ Identify a file by location and modification time so cached
+        entries are dropped when it changes on disk
+    """
+    path = os.path.abspath(path)
+    return path, os.path.getmtime(path)
+
+
+def get_vector_coords(features):
+    return dict((vector.name, vector.coords) for vector in features.vectors)
+
+
+class ComparisonService(object):
+    """ Answers comparison and search requests while keeping backgrounds,
+        parsed structures and featurized pockets in bounded LRU caches
+    """
+
+    def __init__(self, settings, environ=None,
+                                 max_backgrounds=4,
+                                 max_structures=64,
+                                 max_pockets=1024,
+                                 vector_cache=None,
+                                 center_store=None,
+                                 log=logging):
+        self.settings = settings
+        self.environ = environ if environ is not None else dict(os.environ)
+        self.backgrounds = LRUCache(max_backgrounds)
+        self.structures = LRUCache(max_structures)
+        self.pockets = LRUCache(max_pockets)
+        self.vector_cache = vector_cache
+        self.center_store = center_store
+        self.alignment_methods = make_updated_methods()
+        self.log = log
+
+    def get_setting(self, request, name):
+        return request.get(name, self.settings.get(name))
+
+    def get_background(self, request):
+        background = self.get_setting(request, 'background')
+        normalization = self.get_setting(request, 'normalization')
+        options = dict((name, self.get_setting(request, name))
+                       for name in ('compare_method', 'allowed_pairs', 'std_threshold'))
+        if normalization is not None and os.path.exists(normalization):
+            normalization_key = get_file_key(normalization)
+        else:
+            normalization_key = None
+        key = (get_file_key(background), normalization_key, tuple(sorted(options.items())))
+        load = lambda: backgroundfile.load_from_paths(background, normalization,
+                                                      compare_function=options['compare_method'],
+                                                      allowed_pairs=options['allowed_pairs'],
+                                                      std_threshold=options['std_threshold'])
+        return self.backgrounds.get_or_create(key, load)
+
+    def get_structure(self, path):
+        def load():
+            with open_compressed(path) as f:
+                return pdbfile.load(f, pdbid=pdbidFromFilename(path))
+        return self.structures.get_or_create(get_file_key(path), load)
+
+    def get_feature_file_pocket(self, path):
+        """ Load a pre-featurized pocket, returning its name and vectors """
+        load = lambda: (get_library_pocket_name(path), load_pocket_features(path))
+        return self.pockets.get_or_create(('features', get_file_key(path)), load)
+
+    def get_library_pocket(self, library, name):
+        """ Load a pocket from a pocket library or set of FEATURE files """
+        if isinstance(library, pocketlibrary.PocketLibrary):
+            key = ('library', get_file_key(library.path), name)
+            return self.pockets.get_or_create(key, lambda: (name, library.get(name)))
+        return self.get_feature_file_pocket(library.paths[name])
+
+    def get_pdb_pocket(self, path, model=0, chain=None, ligands=None, distance=None):
+        """ Extract and featurize the pocket around a ligand in a PDB file,
+            returning the pocket signature and its vectors
+        """
+        if distance is None:
+            distance = defaults.DEFAULT_LIGAND_RESIDUE_DISTANCE
+        if ligands is not None:
+            ligands = tuple(ligands)
+        key = ('pdb', get_file_key(path), model, chain, ligands, distance)
+
+        def create():
+            structure = focus_structure(self.get_structure(path), model=model, chain=chain)
+            if ligands is None:
+                ligand = pick_best_ligand(structure)
+            else:
+                ligand = find_one_of_ligand_in_structure(structure, ligands)
+            if ligand is None:
+                raise ValueError("No ligand found in {0}".format(path))
+            store = None
+            if self.center_store is not None:
+                store = centerstore.load_structure(self.center_store, structure.get_full_id()[0])
+            pocket = create_pocket_around_ligand(structure, ligand, cutoff=distance,
+                                                                    center_store=store)
+            points = list(pocket.points)
+            if pocket.features is not None:
+                features = pocket.features
+            else:
+                features = featurize_points(points,
+                                            featurize_args={'environ': self.environ},
+                                            featurefile_args={'rename_from_comment': 'DESCRIPTION'},
+                                            cache=self.vector_cache)
+            return get_pocket_signature(points), features
+        return self.pockets.get_or_create(key, create)
+
+    def get_request_pocket(self, request, tag):
+        features = request.get('features' + tag)
+        if features is not None:
+            return self.get_feature_file_pocket(features)
+        return self.get_pdb_pocket(request['pdb' + tag],
+                                   model=request.get('model' + tag, 0),
+                                   chain=request.get('chain' + tag),
+                                   ligands=request.get('ligand' + tag),
+                                   distance=self.get_setting(request, 'distance'))
+
+    def get_alignment_settings(self, request):
+        return (self.alignment_methods[self.get_setting(request, 'alignment_method')],
+                defaults.ALLOWED_SCALE_FUNCTIONS[self.get_setting(request, 'scale_method')],
+                self.get_setting(request, 'cutoff'))
+
+    def compare(self, request):
+        """ Compare two pockets, replying with the run_pf summary fields """
+        background = self.get_background(request)
+        nameA, featuresA = self.get_request_pocket(request, 'A')
+        nameB, featuresB = self.get_request_pocket(request, 'B')
+        align_method, scale_function, cutoff = self.get_alignment_settings(request)
+
+        numA = len(featuresA.vectors)
+        numB = len(featuresB.vectors)
+        scores = background.get_comparison_matrix(featuresA, featuresB)
+        normalized = scores.slice_values(NORMALIZED_SCORE)
+        alignment = perform_alignment(align_method, normalized, cutoff)
+        num_aligned = len(alignment)
+        total_score = sum(alignment.values())
+        scale_sizes = (numA, numB, len(scores), num_aligned)
+        scaled_score = scale_function((), scale_sizes, total_score)
+        rmsd = alignment_rmsd(alignment.items(), get_vector_coords(featuresA),
+                                                 get_vector_coords(featuresB))
+
+        values = (nameA, nameB, numA, numB, len(scores), num_aligned,
+                  round(total_score, 3), round(scaled_score, 3), round(rmsd, 3))
+        return dict(zip(COMPARISON_RESULT_FIELDS, values))
+
+    def search(self, request):
+        """ Rank a library of pre-featurized pockets against a query """
+        background = self.get_background(request)
+        query_name, query = self.get_feature_file_pocket(request['query'])
+        align_method, scale_function, cutoff = self.get_alignment_settings(request)
+        results = []
+        library = open_pocket_library(request['library'], log=self.log)
+        for signature in library.signatures:
+            name, pocket = self.get_library_pocket(library, signature)
+            result = align_pocket_features(background, query, pocket, align_method, scale_function,
+                                           cutoff=cutoff,
+                                           nameA=query_name,
+                                           nameB=name)
+            results.append(result)
+        results.sort(key=lambda result: (result.scaled_score, result.pocket_b))
+        top = request.get('top')
+        if top is not None:
+            results = results[:top]
+        return [result._asdict() for result in results]
+
+    def stats(self, request):
+        return {
+            'backgrounds': self.backgrounds.stats(),
+            'structures': self.structures.stats(),
+            'pockets': self.pockets.stats(),
+        }
+
+    def handle(self, request):
+        commands = {
+            'compare': self.compare,
+            'search': self.search,
+            'stats': self.stats,
+        }
+        try:
+            command = commands[request.get('command')]
+        except KeyError:
+            return {'status': 'error', 'message': "Unknown command {0!r}".format(request.get('command'))}
+        try:
+            return {'status': 'ok', 'result': command(request)}
+        except Exception as e:
+            self.log.exception("Failed to handle {0} request".format(request.get('command')))
+            return {'status': 'error', 'message': str(e)}
+
+
+class ComparisonRequestHandler(socketserver.StreamRequestHandler):
+    """ Reads one JSON request per line and writes one JSON reply per line """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = decode_message(line)
+            except ValueError as e:
+                response = {'status': 'error', 'message': "Invalid request: {0}".format(e)}
+            else:
+                response = self.server.service.handle(request)
+            self.wfile.write(encode_message(response))
+            self.wfile.flush()
+
+
+class ComparisonServer(socketserver.UnixStreamServer):
+    # Requests are handled one at a time so the caches need no locking
+    def __init__(self, socket_path, service):
+        self.service = service
+        socketserver.UnixStreamServer.__init__(self, socket_path, ComparisonRequestHandler)
+
+
+class ServePocketFeature(Task):
+    BACKGROUND_FF_DEFAULT = 'background.ff'
+    BACKGROUND_COEFF_DEFAULT = 'background.coeffs'
+    DEFAULT_CUTOFF = -0.15
+
+    def run(self):
+        params = self.params
+        logging.basicConfig(stream=params.log)
+        log = logging.getLogger('pf_serve')
+        log.setLevel(LOG_LEVELS.get(params.log_level, 'debug'))
+        self.log = log
+
+        environ = dict(os.environ)
+        if params.pdb_dir is not None:
+            environ['PDB_DIR'] = params.pdb_dir
+        if params.dssp_dir is not None:
+            environ['DSSP_DIR'] = params.dssp_dir
+
+        settings = {
+            'background': params.background,
+            'normalization': params.normalization,
+            'compare_method': params.compare_method,
+            'allowed_pairs': params.allowed_pairs,
+            'std_threshold': params.std_threshold,
+            'alignment_method': params.alignment_method,
+            'scale_method': params.scale_method,
+            'cutoff': params.cutoff,
+            'distance': params.distance,
+        }
+        service = ComparisonService(settings, environ=environ,
+                                              max_backgrounds=params.max_backgrounds,
+                                              max_structures=params.max_structures,
+                                              max_pockets=params.max_pockets,
+                                              vector_cache=vectorcache.open_cache(params.vector_cache),
+                                              center_store=params.center_store,
+                                              log=log)
+        if params.preload:
+            log.info("Loading background")
+            service.get_background({})
+
+        if os.path.exists(params.socket):
+            log.warning("Removing stale socket {0}".format(params.socket))
+            os.unlink(params.socket)
+        server = ComparisonServer(params.socket, service)
+        log.info("Listening on {0}".format(params.socket))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log.info("Shutting down")
+        finally:
+            server.server_close()
+            os.unlink(params.socket)
+
+    @classmethod
+    def arguments(cls, stdin, stdout, stderr, environ, task_name):
+        from argparse import ArgumentParser
+        from pocketfeature.utils.args import FileType
+
+        parser = ArgumentParser(
+            """Serve PocketFEATURE comparisons and searches from a long-running process""")
+        parser.add_argument('-s', '--socket', metavar='SOCKET',
+                                              default=DEFAULT_SOCKET,
+                                              help='Unix socket to listen on [default: %(default)s]')
+        parser.add_argument('-b', '--background', metavar='FEATURESTATS',
+                                                  default=cls.BACKGROUND_FF_DEFAULT,
+                                                  help='FEATURE file containing standard devations of background'
+                                                       ' or a compiled background [default: %(default)s]')
+        parser.add_argument('-n', '--normalization', metavar='COEFFICIENTS',
+                                      default=cls.BACKGROUND_COEFF_DEFAULT,
+                                      help='Map of normalization coefficients for residue type pairs [default: %(default)s]')
+        parser.add_argument('-p', '--allowed-pairs', metavar='PAIR_SET_NAME',
+                                      choices=defaults.ALLOWED_VECTOR_TYPE_PAIRS.keys(),
+                                      default=defaults.DEFAULT_VECTOR_TYPE_PAIRS,
+                                      help='Alignment method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-t', '--std-threshold', metavar='NSTD',
+                                     type=float,
+                                     default=1.0,
+                                     help="Number of standard deviations between to features to allow as 'similar'")
+        parser.add_argument('-C', '--compare-method', metavar='COMPARISON',
+                                              choices=defaults.ALLOWED_SIMILARITY_METHODS.keys(),
+                                              default=defaults.DEFAULT_SIMILARITY_METHOD,
+                                              help='Comparison method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-A', '--alignment-method', metavar='ALIGNMENT',
+                                              choices=defaults.ALLOWED_ALIGNMENT_METHODS.keys(),
+                                              default=defaults.DEFAULT_ALIGNMENT_METHOD,
+                                              help='Alignment method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-S', '--scale-method', metavar='SCALING',
+                                              choices=defaults.ALLOWED_SCALE_FUNCTIONS.keys(),
+                                              default=defaults.DEFAULT_SCALE_FUNCTION,
+                                              help='Scoring scaling method to use (one of: %(choices)s) [default: %(default)s]')
+        parser.add_argument('-c', '--cutoff', metavar='CUTOFF',
+                                              type=float,
+                                              default=cls.DEFAULT_CUTOFF,
+                                              help='Minium score (cutoff) to align [default: %(default)s]')
+        parser.add_argument('-d', '--distance', metavar='DISTANCE',
+                                                type=float,
+                                                default=defaults.DEFAULT_LIGAND_RESIDUE_DISTANCE,
+                                                help='Residue active site distance threshold [default: %(default)s]')
+        parser.add_argument('--pdb-dir', metavar='PDB_DIR',
+                                         default=environ.get('PDB_DIR'),
+                                         help='Directory to look for PDBs in [default: %(default)s]')
+        parser.add_argument('--dssp-dir', metavar='DSSP_DIR',
+                                          default=environ.get('DSSP_DIR'),
+                                          help='Directory to look for DSSP files in [default: %(default)s]')
+        parser.add_argument('--max-backgrounds', metavar='N',
+                                                 type=int,
+                                                 default=4,
+                                                 help='Number of backgrounds to keep loaded [default: %(default)s]')
+        parser.add_argument('--max-structures', metavar='N',
+                                                type=int,
+                                                default=64,
+                                                help='Number of parsed structures to keep [default: %(default)s]')
+        parser.add_argument('--max-pockets', metavar='N',
+                                             type=int,
+                                             default=1024,
+                                             help='Number of featurized pockets to keep [default: %(default)s]')
+        parser.add_argument('--vector-cache', metavar='VECTOR_CACHE_DIR',
+                                              default=None,
+                                              help='Directory of featurized residue centers shared'
+                                                   ' between pockets and runs [default: %(default)s]')
+        parser.add_argument('--center-store', metavar='STORE_DIR',
+                                              default=None,
+                                              help='Directory of residue center vectors from pf_precompute'
+                                                   ' to select pockets from [default: %(default)s]')
+        parser.add_argument('--preload', action='store_true',
+                                         default=False,
+                                         help='Load the default background before accepting requests [default: %(default)s]')
+        parser.add_argument('--log', metavar='LOG',
+                                     type=FileType,
+                                     default=stderr,
+                                     help='Path to log errors [default: STDERR]')
+        parser.add_argument('--log-level', metavar='LEVEL',
+                                           choices=LOG_LEVELS.keys(),
+                                           default='info',
+                                           nargs='?',
+                                           help="Set log level (%(choices)s) [default: %(default)s]")
+        return parser
+
+
+if __name__ == '__main__':
+    sys.exit(ServePocketFeature.run_as_script())
@@ -6,6 +6,7 @@ import os
 import random
 
 
+from feature.datastructs.points import PointSet
 from feature.io import pointfile
 from pocketfeature.io import matrixvaluesfile
 
@@ -56,14 +57,19 @@ def get_point_name(point):
     return point.comment.split()[0]
 
 
+def get_point_index(points):
+    """ Map the name of each point of a PointSet to its row """
+    return {comment.split()[0]: idx for idx, comment in enumerate(points.comments)}
+
+
 def create_alignment_visualizations(pointsA, pointsB, alignment, pdbA=None, 
                                                                  pdbB=None,
                                                                  colors=None,
                                                                  radii=None):
-        pointsA = list(pointsA)
-        pointsB = list(pointsB)
-        pointMapA = {get_point_name(p): p for p in pointsA}
-        pointMapB = {get_point_name(p): p for p in pointsB}
+        pointsA = PointSet.from_points(pointsA)
+        pointsB = PointSet.from_points(pointsB)
+        pointMapA = get_point_index(pointsA)
+        pointMapB = get_point_index(pointsB)
         ligandA = ligand_to_pymol_selector(list(pointMapA.keys())[0])
         ligandB = ligand_to_pymol_selector(list(pointMapB.keys())[0])
 
@@ -71,8 +77,8 @@ def create_alignment_visualizations(pointsA, pointsB, alignment, pdbA=None,
              alignedKeysA, alignedKeysB = zip(*alignment.keys())
         else:
              alignedKeysA = alignedKeysB = ()
-        alignedA = [pointMapA[key] for key in alignedKeysA]
-        alignedB = [pointMapB[key] for key in alignedKeysB]
+        alignedA = pointsA[[pointMapA[key] for key in alignedKeysA]]
+        alignedB = pointsB[[pointMapB[key] for key in alignedKeysB]]
 
         scores = alignment.values()
         scores = [-score for score in scores]  # Lowest are stronger
@@ -95,7 +101,7 @@ def create_alignment_visualizations(pointsA, pointsB, alignment, pdbA=None,
             colors = list(colors)
         
         pdbA = "{0}.pdb".format(pointsA[0].pdbid) if pdbA is None else pdbA
-        pdbB = "{0}.pdb".format(pointsB[0].pdbid) if pdbA is None else pdbB
+        pdbB = "{0}.pdb".format(pointsB[0].pdbid) if pdbB is None else pdbB
         
         scriptA = render_pymol_python(pdbA, alignedA, radii, colors, ligandA)
         scriptB = render_pymol_python(pdbB, alignedB, radii, colors, ligandB)
@@ -106,9 +112,9 @@ def create_alignment_visualizations(pointsA, pointsB, alignment, pdbA=None,
 def create_single_visualization(pointsA, pdbA=None, 
                                          colors=None,
                                          radii=None):
-        pointsA = list(pointsA)
-        pointMapA = {get_point_name(p): p for p in pointsA}
-        ligandA = ligand_to_pymol_selector(pointMapA.keys()[0])
+        pointsA = PointSet.from_points(pointsA)
+        pointMapA = get_point_index(pointsA)
+        ligandA = ligand_to_pymol_selector(list(pointMapA.keys())[0])
 
         if radii is None:
             radii = 5
@@ -140,9 +146,9 @@ class VisAlign(Task):
         log = logging.getLogger('pocketfeature')
         log.setLevel(logging.DEBUG)
 
-        pointsA = pointfile.load(params.pointsA)
+        pointsA = pointfile.load_pointset(params.pointsA)
         if params.pointsB is not None:
-            pointsB = pointfile.load(params.pointsB)
+            pointsB = pointfile.load_pointset(params.pointsB)
         else:
             pointsB = None
         if params.alignment is not None:
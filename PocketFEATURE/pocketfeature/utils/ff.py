@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from six import string_types
+from feature.datastructs.points import PointSet
 from feature.io.featurefile import DESCRIPTION
 from pocketfeature.defaults import RESIDUE_TYPE
 from pocketfeature.utils.pdb import (
@@ -56,6 +57,8 @@ def get_point_name_lookup(points, signature_idx=0):
 
 
 def get_point_name_to_coords_lookup(points, signature_idx=0):
+    if isinstance(points, PointSet):
+        return points.coords_by_name(name_idx=signature_idx)
     lookup = get_point_name_lookup(points, signature_idx=signature_idx)
     to_coords = {key: point.coords for key, point in lookup.items()}
     return to_coords
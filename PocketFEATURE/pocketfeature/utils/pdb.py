@@ -212,7 +212,9 @@ def find_residues_by_id(structure, queries, full=True):
                 res_id, res_name = query[:2]
 
         focus = structure
-        if model is not None and focus.get_level() != 'M':
+        if focus.get_level() == 'C':
+            focus = [focus]
+        elif model is not None and focus.get_level() != 'M':
             focus = focus.get_list()[model]
         elif focus.get_level == 'S':
             focus = focus.get_chains()
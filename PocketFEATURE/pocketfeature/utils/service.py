@@ -0,0 +1,39 @@
+""" Client side of the PocketFEATURE comparison service (pf_serve).
+    Only the standard library is used here so clients start quickly
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import socket
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), '.pocketfeature.sock')
+
+
+class ServiceError(Exception):
+    pass
+
+
+def encode_message(message):
+    return json.dumps(message) + '\n'
+
+
+def decode_message(line):
+    return json.loads(line)
+
+
+def send_request(request, socket_path=DEFAULT_SOCKET):
+    """ Send one request to a running service and return its result """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+        connection.sendall(encode_message(request))
+        reply = connection.makefile('r').readline()
+    finally:
+        connection.close()
+    if not reply:
+        raise ServiceError("No reply from service at {0}".format(socket_path))
+    response = decode_message(reply)
+    if response.get('status') != 'ok':
+        raise ServiceError(response.get('message', 'Unknown service error'))
+    return response['result']
@@ -35,6 +35,12 @@ setup(name='PocketFEATURE',
             pf_task_script('full_comparison:ComparePockets', 'run_pf'),
             pf_task_script('build_background:GeneratePocketFeatureBackground', 'pf_genbg'),
             pf_task_script('benchmark:BenchmarkPocketFeatureBackground', 'pf_bench'),
+            pf_task_script('search:SearchPocketLibrary', 'pf_search'),
+            pf_task_script('all_vs_all:CompareAllPockets', 'pf_allvsall'),
+            pf_task_script('serve:ServePocketFeature', 'pf_serve'),
+            pf_task_script('library:PocketLibraryTool', 'pf_library'),
+            pf_task_script('precompute:PrecomputeCenterVectors', 'pf_precompute'),
+            pf_task_script('extract_pockets:MultiPocketExtraction', 'pf_extract_pockets'),
         ]
       }
 )
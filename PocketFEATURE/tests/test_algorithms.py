@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
 from pocketfeature import algorithms
 
 
@@ -15,3 +18,130 @@ def test_dev_config():
     assert app.config['ENV'] == 'dev'
     assert app.config['DEBUG'] is True
     assert app.config['ASSETS_DEBUG'] is True
+
+
+CUTOFF_SIMILARITIES = [
+    algorithms.cutoff_tanimoto_similarity,
+    algorithms.cutoff_tversky22_similarity,
+    algorithms.cutoff_dice_similarity,
+]
+
+
+def make_sparse_features(num_vectors, num_features=24, seed=0):
+    """ Random FEATURE-like vectors, about half of whose features are zero """
+    random_state = np.random.RandomState(seed)
+    values = random_state.normal(size=(num_vectors, num_features))
+    present = random_state.random_sample((num_vectors, num_features)) < 0.5
+    return np.where(present, values, 0.)
+
+
+def make_cutoffs(num_features=24, seed=1):
+    cutoffs = np.random.RandomState(seed).random_sample(num_features)
+    cutoffs[::5] = 0.  # Zero cutoffs never match, even for shared zeros
+    return cutoffs
+
+
+@pytest.mark.parametrize('similarity', CUTOFF_SIMILARITIES)
+def test_similarity_matrix_matches_pairwise_scores(similarity):
+    cutoffs = make_cutoffs()
+    as_ = make_sparse_features(7)
+    bs = make_sparse_features(11, seed=2)
+    expected = np.array([[similarity(cutoffs, a, b) for b in bs] for a in as_])
+
+    # A tiny memory budget forces the matrix to be scored in many tiles
+    matrix = similarity.similarity_matrix(cutoffs, as_, bs, memory_limit=500)
+    assert matrix.shape == expected.shape
+    assert np.allclose(matrix, expected)
+
+
+def test_cutoff_counts_match_pairwise_counts():
+    cutoffs = make_cutoffs()
+    as_ = make_sparse_features(7)
+    bs = make_sparse_features(11, seed=2)
+    intersections, unions = algorithms.cutoff_intersection_union_counts(cutoffs, as_, bs,
+                                                                        memory_limit=500)
+    for i, a in enumerate(as_):
+        paired = algorithms.paired_cutoff_counts(cutoffs, np.tile(a, (len(bs), 1)), bs)
+        assert np.array_equal(intersections[i], paired[0])
+        assert np.array_equal(unions[i], paired[1])
+
+
+@pytest.mark.parametrize('similarity', CUTOFF_SIMILARITIES)
+def test_scores_from_counts_match_pairwise_scores(similarity):
+    cutoffs = make_cutoffs()
+    as_ = make_sparse_features(7)
+    bs = make_sparse_features(11, seed=2)
+    expected = np.array([[similarity(cutoffs, a, b) for b in bs] for a in as_])
+    counts = algorithms.cutoff_intersection_union_counts(cutoffs, as_, bs)
+    assert np.allclose(similarity.from_counts(*counts), expected)
+
+
+def test_score_histogram_matches_gaussian_stats():
+    similarity = algorithms.cutoff_tversky22_similarity
+    cutoffs = make_cutoffs()
+    as_ = make_sparse_features(9)
+    bs = make_sparse_features(13, seed=2)
+    intersections, unions = algorithms.cutoff_intersection_union_counts(cutoffs, as_, bs)
+
+    histogram = algorithms.CutoffScoreHistogram(as_.shape[1], similarity.from_counts, mode_binning=3)
+    histogram.record_counts(intersections[:4], unions[:4])
+    rest = algorithms.CutoffScoreHistogram(as_.shape[1], similarity.from_counts)
+    rest.record_counts(intersections[4:], unions[4:])
+    histogram = histogram.merge(rest)
+
+    stats = algorithms.GaussianStats(mode_binning=3)
+    for score in similarity.from_counts(intersections, unions).flat:
+        stats.record(score)
+
+    assert histogram.n == stats.n
+    assert histogram.mean == pytest.approx(float(stats.mean))
+    assert histogram.std_dev == pytest.approx(float(stats.std_dev))
+    assert histogram.mins == pytest.approx(float(stats.mins))
+    assert histogram.maxes == pytest.approx(float(stats.maxes))
+    # Modes may tie, so only require the histogram's mode to be a top bin
+    assert histogram.mode_count == stats.mode_count
+    assert dict(stats.get_top_n_modes(stats.n))[histogram.mode] == stats.mode_count
+
+
+def test_record_many_matches_record():
+    samples = make_sparse_features(25)
+    expected = algorithms.GaussianStats()
+    for sample in samples:
+        expected.record(sample)
+
+    first = algorithms.GaussianStats()
+    first.record_many(samples[:10])
+    second = algorithms.GaussianStats()
+    second.record_many(samples[10:])
+    stats = first.merge(second)
+
+    assert stats.n == expected.n
+    assert np.allclose(stats.mean, expected.mean)
+    assert np.allclose(stats.std_dev, expected.std_dev)
+    assert np.array_equal(stats.mins, expected.mins)
+    assert np.array_equal(stats.maxes, expected.maxes)
+
+
+def test_symmetric_counts_match_full_product():
+    similarity = algorithms.cutoff_tversky22_similarity
+    cutoffs = make_cutoffs()
+    vectors = make_sparse_features(17)
+    num_features = vectors.shape[1]
+
+    intersections, unions = algorithms.cutoff_intersection_union_counts(cutoffs, vectors, vectors)
+    full = algorithms.CutoffScoreHistogram(num_features, similarity.from_counts)
+    full.record_counts(intersections, unions)
+    off_diagonal = algorithms.CutoffScoreHistogram(num_features, similarity.from_counts)
+    mask = ~np.eye(len(vectors), dtype=bool)
+    off_diagonal.record_counts(intersections[mask], unions[mask])
+
+    for include_diagonal, expected in ((True, full), (False, off_diagonal)):
+        symmetric = algorithms.CutoffScoreHistogram(num_features, similarity.from_counts)
+        # Split into row ranges and tiles, as the background build does
+        for rows in ((0, 6), (6, 17)):
+            for counts in algorithms.stream_symmetric_cutoff_counts(cutoffs, vectors,
+                                                                    rows=rows,
+                                                                    include_diagonal=include_diagonal,
+                                                                    memory_limit=2000):
+                symmetric.record_counts(*counts)
+        assert np.array_equal(symmetric.counts, expected.counts)
@@ -1,12 +1,51 @@
 # -*- coding: utf-8 -*-
+import os
+import pickle
+
+import numpy as np
 import pytest
 
-from zinc.data.forms import (
-    LoginForm,
-    RegisterForm,
+try:
+    from zinc.data.forms import (
+        LoginForm,
+        RegisterForm,
+    )
+    from .factories import UserFactory
+except ImportError:
+    LoginForm = RegisterForm = UserFactory = None
+
+from pocketfeature import defaults
+from pocketfeature.datastructs.residues import CenterCalculator
+from pocketfeature.io import (
+    backgroundfile,
+    featurefile,
+    structurecache,
 )
-from .factories import UserFactory
 
+requires_forms = pytest.mark.skipif(LoginForm is None, reason="zinc forms are not installed")
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'data')
+REFERENCE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'reference')
+
+
+def load_background(**kwargs):
+    return backgroundfile.load_from_paths(os.path.join(DATA_DIR, 'background.ff'),
+                                          os.path.join(DATA_DIR, 'background.coeffs'),
+                                          **kwargs)
+
+
+def load_pocket(name):
+    """ A reference pocket, with residue types added from the descriptions """
+    lines = []
+    with open(os.path.join(REFERENCE_DIR, name)) as f:
+        for line in f:
+            description = line.rstrip('\n').rsplit('\t', 1)[-1]
+            parts = description.split('_')
+            lines.append("{0}\t#\t{1}{2}\n".format(line.rstrip('\n'), parts[5], parts[6]))
+    return featurefile.load(lines)
+
+
+@requires_forms
 class TestRegisterForm:
 
     def test_validate_user_already_registered(self, user):
@@ -31,6 +70,7 @@ class TestRegisterForm:
         assert form.validate() is True
 
 
+@requires_forms
 class TestLoginForm:
 
     def test_validate_success(self, user):
@@ -60,4 +100,91 @@ class TestLoginForm:
         # Correct username and password, but user is not activated
         form = LoginForm(username=user.username, password='example')
         assert form.validate() is False
-        assert 'User not activated' in form.username.errors
\ No newline at end of file
+        assert 'User not activated' in form.username.errors
+
+
+class TestBackgroundEnvironment:
+
+    def test_type_ids_are_stored_on_the_file(self):
+        background = load_background()
+        pocket = load_pocket('1qrd_FAD.ff')
+        type_ids = background.get_file_type_ids(pocket)
+        assert len(type_ids) == len(pocket.vectors)
+        assert background.get_file_type_ids(pocket) is type_ids
+        assert list(type_ids) == list(background.get_vector_type_ids(pocket.vectors))
+
+    def test_pickle_round_trip(self):
+        background = load_background()
+        pocketA = load_pocket('1qrd_FAD.ff')
+        pocketB = load_pocket('1qhx_ATP.ff')
+        expected = background.get_comparison_matrix(pocketA, pocketB)
+
+        restored = pickle.loads(pickle.dumps(background, pickle.HIGHEST_PROTOCOL))
+        scores = restored.get_comparison_matrix(pocketA, pocketB)
+        assert len(scores) > 0
+        assert sorted(scores.items()) == sorted(expected.items())
+
+    def test_comparison_matrices_match_single_method_matrices(self):
+        pocketA = load_pocket('1qrd_FAD.ff')
+        pocketB = load_pocket('1qhx_ATP.ff')
+        methods = ['tversky22', 'tanimoto', 'dice']
+        matrices = load_background(compare_function='tversky22').get_comparison_matrices(pocketA, pocketB, methods)
+        assert list(matrices.keys()) == methods
+
+        for method in methods:
+            background = load_background(compare_function=method)
+            expected = background.get_comparison_matrix(pocketA, pocketB, normalize=method == 'tversky22')
+            scores = matrices[method]
+            assert list(scores.keys()) == list(expected.keys())
+            for key, values in expected.items():
+                if method != 'tversky22':
+                    values = (values,)
+                assert scores[key] == pytest.approx(values)
+
+
+def get_residue_centers(calculator, atoms, structure, **kwargs):
+    """ Centers of every residue in structure, one residue at a time """
+    codes = []
+    coords = []
+    for model, chain, residue_id in atoms.get_residue_ids():
+        chain = structure[model][chain]
+        if residue_id in chain:
+            for code, point in calculator.get_center(chain[residue_id], **kwargs):
+                codes.append(code)
+                coords.append(point)
+    return codes, np.array(coords, dtype=np.float32).reshape(-1, 3)
+
+
+class TestStructureCenters:
+
+    def setup_method(self, method):
+        self.calculator = CenterCalculator(*defaults.NAMED_RESIDUE_CENTERS['standard'])
+        self.atoms = structurecache.parse_file(os.path.join(DATA_DIR, '1qrd.pdb'))
+
+    def test_centers_match_residue_centers(self):
+        structure = self.atoms.to_structure('1qrd')
+        expected_codes, expected_coords = get_residue_centers(self.calculator, self.atoms, structure)
+        centers = self.calculator.get_structure_centers(self.atoms)
+        assert len(centers.codes) > 0
+        assert centers.codes == expected_codes
+        np.testing.assert_array_equal(centers.coords, expected_coords)
+
+    def test_selected_partial_residues_match_residue_centers(self):
+        # Dropping atoms leaves partial residues, whose incomplete centers are skipped
+        selected = np.arange(len(self.atoms)) % 7 != 0
+        selected &= self.atoms.residue_index < 200
+        structure = self.atoms.to_structure('1qrd', atom_mask=selected)
+        expected_codes, expected_coords = get_residue_centers(self.calculator, self.atoms, structure)
+        centers = self.calculator.get_structure_centers(self.atoms, selected=selected)
+        assert len(centers.codes) > 0
+        assert set(centers.residues.tolist()) <= set(range(200))
+        assert centers.codes == expected_codes
+        np.testing.assert_array_equal(centers.coords, expected_coords)
+
+    def test_strict_partial_residues_fail(self):
+        selected = np.arange(len(self.atoms)) % 7 != 0
+        structure = self.atoms.to_structure('1qrd', atom_mask=selected)
+        with pytest.raises(ValueError):
+            get_residue_centers(self.calculator, self.atoms, structure, skip_partial_residues=False)
+        with pytest.raises(ValueError):
+            self.calculator.get_structure_centers(self.atoms, selected=selected, skip_partial_residues=False)
@@ -3,13 +3,38 @@
 
 See: http://webtest.readthedocs.org/
 """
+import os
+
+import numpy as np
 import pytest
-from flask import url_for
+from Bio.PDB.PDBParser import PDBParser
+
+try:
+    from flask import url_for
+
+    from drake.data.user.models import User
+    from .factories import UserFactory
+except ImportError:
+    url_for = User = UserFactory = None
+
+from pocketfeature.io import (
+    backgroundfile,
+    datastore,
+    pocketlibrary,
+    structurecache,
+)
+from pocketfeature.utils.ff import get_vector_type
+
+from .test_datastructs import (
+    DATA_DIR,
+    load_background,
+    load_pocket,
+)
 
-from drake.data.user.models import User
-from .factories import UserFactory
+requires_app = pytest.mark.skipif(User is None, reason="the web app is not installed")
 
 
+@requires_app
 class TestLoggingIn:
 
     def test_can_log_in_returns_200(self, user, testapp):
@@ -60,6 +85,7 @@ class TestLoggingIn:
         assert "Unknown user" in res
 
 
+@requires_app
 class TestRegistering:
 
     def test_can_register(self, user, testapp):
@@ -109,3 +135,195 @@ class TestRegistering:
         res = form.submit()
         # sees error
         assert "Username already registered" in res
+
+
+class TestDatastore:
+
+    def test_dump_load_round_trip(self, tmpdir):
+        pocket = load_pocket('1qrd_FAD.ff')
+        prefix = str(tmpdir.join('pockets'))
+        datastore.dump(pocket.vectors, prefix)
+        assert datastore.exists(prefix)
+
+        columns = datastore.load(prefix)
+        assert isinstance(columns.features, np.memmap)
+        assert np.array_equal(columns.features, [vector.features for vector in pocket.vectors])
+        assert np.array_equal(columns.coords, [vector.coords for vector in pocket.vectors])
+        assert list(columns.names) == [str(vector.name).encode() for vector in pocket.vectors]
+        assert set(columns.pdbids) == {b'1qrd'}
+
+    def test_append_matches_dump(self, tmpdir):
+        vectors = load_pocket('1qrd_FAD.ff').vectors + load_pocket('1qhx_ATP.ff').vectors
+        split = len(vectors) // 3
+        prefix = str(tmpdir.join('appended'))
+        assert datastore.append(vectors[:split], prefix) == 0
+        assert datastore.append([], prefix) == split
+        assert datastore.append(vectors[split:], prefix) == split
+
+        expected_prefix = str(tmpdir.join('dumped'))
+        datastore.dump(vectors, expected_prefix)
+        expected = datastore.load(expected_prefix)
+        appended = datastore.load(prefix)
+        for name in expected._fields:
+            assert np.array_equal(getattr(appended, name), getattr(expected, name))
+
+
+class TestCompiledBackground:
+
+    def test_dump_load_round_trip(self, tmpdir):
+        background = load_background()
+        path = str(tmpdir.join('background.pfbg'))
+        backgroundfile.dump_compiled(background, path)
+        assert backgroundfile.is_compiled(path)
+        assert not backgroundfile.is_compiled(os.path.join(DATA_DIR, 'background.ff'))
+
+        compiled = backgroundfile.load_compiled(path)
+        assert np.array_equal(compiled.standard_deviations.features,
+                              background.standard_deviations.features)
+        assert np.array_equal(compiled.thresholds, background.thresholds)
+        assert compiled.pair_table.type_names == background.pair_table.type_names
+        np.testing.assert_array_equal(compiled.pair_table.coefficients,
+                                      background.pair_table.coefficients)
+        assert np.array_equal(compiled.pair_table.allowed, background.pair_table.allowed)
+        assert compiled.compare_function == background.compare_function
+        assert list(compiled.scale_params) == list(background.scale_params)
+
+        pocketA = load_pocket('1qrd_FAD.ff')
+        pocketB = load_pocket('1qhx_ATP.ff')
+        expected = background.get_comparison_matrix(pocketA, pocketB)
+        scores = compiled.get_comparison_matrix(pocketA, pocketB)
+        assert len(scores) > 0
+        assert sorted(scores.items()) == sorted(expected.items())
+
+    def test_load_from_paths_detects_compiled_files(self, tmpdir):
+        background = load_background()
+        path = str(tmpdir.join('background.pfbg'))
+        backgroundfile.dump_compiled(background, path)
+        compiled = backgroundfile.load_from_paths(path)
+        assert np.array_equal(compiled.thresholds, background.thresholds)
+
+        with pytest.raises(ValueError):
+            backgroundfile.load_from_paths(os.path.join(DATA_DIR, 'background.ff'))
+
+
+def assert_same_pocket(library, signature, pocket):
+    restored = library.get(signature)
+    expected = sorted(pocket.vectors, key=lambda vector: str(vector.name))
+    vectors = sorted(restored.vectors, key=lambda vector: str(vector.name))
+    assert [str(vector.name) for vector in vectors] == [str(vector.name) for vector in expected]
+    assert np.array_equal([vector.features for vector in vectors],
+                          [vector.features for vector in expected])
+    assert np.array_equal([vector.coords for vector in vectors],
+                          [vector.coords for vector in expected])
+
+
+class TestPocketLibrary:
+
+    def test_dump_load_round_trip(self, tmpdir):
+        pockets = [('1qrd_FAD', load_pocket('1qrd_FAD.ff')),
+                   ('1qhx_ATP', load_pocket('1qhx_ATP.ff'))]
+        path = str(tmpdir.join('pockets.pfl'))
+        assert pocketlibrary.dump(pockets, path) == 2
+        assert pocketlibrary.is_library(path)
+
+        library = pocketlibrary.load(path)
+        assert library.signatures == ['1qrd_FAD', '1qhx_ATP']
+        for signature, pocket in pockets:
+            assert_same_pocket(library, signature, pocket)
+            for vector_type, (start, stop) in library.get_vector_types(signature).items():
+                expected = [vector for vector in pocket.vectors
+                            if get_vector_type(vector) == vector_type]
+                assert len(library.get_features(signature, vector_type)) == len(expected) == stop - start
+
+    def test_append_matches_dump(self, tmpdir):
+        pockets = [('1qrd_FAD', load_pocket('1qrd_FAD.ff')),
+                   ('1qhx_ATP', load_pocket('1qhx_ATP.ff'))]
+        path = str(tmpdir.join('pockets.pfl'))
+        assert pocketlibrary.append(pockets[:1], path) == 0
+        assert pocketlibrary.append(pockets[1:], path) == 1
+
+        library = pocketlibrary.load(path)
+        assert library.signatures == ['1qrd_FAD', '1qhx_ATP']
+        for signature, pocket in pockets:
+            assert_same_pocket(library, signature, pocket)
+
+    def test_failed_append_leaves_library_unchanged(self, tmpdir):
+        pocketA = load_pocket('1qrd_FAD.ff')
+        pocketB = load_pocket('1qhx_ATP.ff')
+        path = str(tmpdir.join('pockets.pfl'))
+        pocketlibrary.dump([('1qrd_FAD', pocketA)], path)
+        with open(path, 'rb') as f:
+            original = f.read()
+
+        # The new pocket is written before the duplicate is found
+        with pytest.raises(ValueError):
+            pocketlibrary.append([('1qhx_ATP', pocketB), ('1qrd_FAD', pocketA)], path)
+        with open(path, 'rb') as f:
+            assert f.read() == original
+
+        library = pocketlibrary.load(path)
+        assert library.signatures == ['1qrd_FAD']
+        assert_same_pocket(library, '1qrd_FAD', pocketA)
+        assert pocketlibrary.append([('1qhx_ATP', pocketB)], path) == 1
+        assert_same_pocket(pocketlibrary.load(path), '1qhx_ATP', pocketB)
+
+
+def get_atom_records(atoms):
+    if hasattr(atoms, 'get_atoms'):
+        atoms = atoms.get_atoms()
+    records = []
+    for atom in atoms:
+        residue = atom.get_parent()
+        chain = residue.get_parent()
+        records.append((chain.get_parent().id, chain.id, residue.id, residue.resname,
+                        atom.get_id(), atom.get_altloc(), atom.element,
+                        atom.get_bfactor(), atom.get_occupancy(), tuple(atom.get_coord())))
+    return records
+
+
+class TestStructureCache:
+
+    def parse(self, name):
+        path = os.path.join(DATA_DIR, name)
+        with open(path) as f:
+            expected = PDBParser(PERMISSIVE=True, QUIET=True).get_structure(name[:4], f)
+        return path, expected
+
+    def test_structure_matches_pdb_parser(self):
+        path, expected = self.parse('1qrd.pdb')
+        structure = structurecache.parse_file(path).to_structure('1qrd')
+        assert structure.id == '1qrd'
+        assert get_atom_records(structure) == get_atom_records(expected)
+
+    def test_selected_residues_match_pdb_parser(self):
+        path, expected = self.parse('1qrd.pdb')
+        atoms = structurecache.parse_file(path)
+        mask = atoms.select_residues(atoms.het & (atoms.resname == b'FAD'))
+        structure = atoms.to_structure('1qrd', atom_mask=mask)
+
+        residues = [residue for residue in expected.get_residues() if residue.resname == 'FAD']
+        assert len(residues) > 0
+        assert [chain.id for chain in structure.get_chains()] == [chain.id for chain in expected.get_chains()]
+        assert [residue.get_full_id() for residue in structure.get_residues()] == \
+               [residue.get_full_id() for residue in residues]
+        assert len(list(structure.get_atoms())) == sum(len(residue) for residue in residues)
+
+    def test_partly_selected_residues(self):
+        path, expected = self.parse('1qrd.pdb')
+        atoms = structurecache.parse_file(path)
+        mask = np.arange(len(atoms)) % 2 == 0
+        structure = atoms.to_structure('1qrd', atom_mask=mask)
+        serials = set(atoms.serial[mask].tolist())
+        expected_atoms = [atom for atom in expected.get_atoms() if atom.get_serial_number() in serials]
+        assert get_atom_records(structure) == get_atom_records(expected_atoms)
+
+    def test_cache_round_trip(self, tmpdir):
+        path, expected = self.parse('1qrd.pdb')
+        cache = structurecache.StructureCache(str(tmpdir))
+        atoms = cache.load_atoms(path)
+        assert os.path.exists(cache.get_entry_path(path))
+
+        cached = cache.load_atoms(path)
+        for name in structurecache.ATOM_FIELD_NAMES:
+            np.testing.assert_array_equal(getattr(cached, name), getattr(atoms, name))
+        assert get_atom_records(cache.load_structure(path, '1qrd')) == get_atom_records(expected)
@@ -1,12 +1,31 @@
 # -*- coding: utf-8 -*-
 """Model unit tests."""
 import datetime as dt
+import gzip
+import logging
+import os
+import sys
+from distutils.spawn import find_executable
 
+import numpy as np
 import pytest
 
-from zinc.user.models import User, Role
-from .factories import UserFactory
+try:
+    from zinc.user.models import User, Role
+    from .factories import UserFactory
+except ImportError:
+    User = Role = UserFactory = None
 
+from .test_algorithms import (
+    make_cutoffs,
+    make_sparse_features,
+)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'data')
+REFERENCE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'reference')
+
+
+@pytest.mark.skipif(User is None, reason="zinc models are not installed")
 @pytest.mark.usefixtures('db')
 class TestUser:
 
@@ -54,4 +73,200 @@ class TestUser:
         u = UserFactory()
         u.roles.append(role)
         u.save()
-        assert role in u.roles
\ No newline at end of file
+        assert role in u.roles
+
+
+@pytest.mark.skipif(find_executable('featurize') is None, reason="FEATURE is not installed")
+def test_benchmark_pair_scores(tmpdir):
+    from pocketfeature.tasks.benchmark import run_pf_comparison
+
+    params = {
+        'background': os.path.join(DATA_DIR, 'background.ff'),
+        'normalization': os.path.join(DATA_DIR, 'background.coeffs'),
+        'distance': 6.0,
+        'allowed_pairs': 'classes',
+        'std_threshold': 1.0,
+        'ligandA': None,
+        'ligandB': None,
+        'pdb_dir': DATA_DIR,
+        'dssp_dir': DATA_DIR,
+        'compare_method': 'tversky22',
+        'alignment_method': 'onlybest',
+        'scale_method': 'none',
+    }
+    key, sizes, scores, scaled_scores = run_pf_comparison(str(tmpdir),
+                                                          os.path.join(DATA_DIR, '1qrd.pdb'),
+                                                          os.path.join(DATA_DIR, '1qhx.pdb'),
+                                                          [-0.15],
+                                                          params)
+    assert key == ('1qrd', '1qhx')
+    assert sizes != (0, 0, 0, 0)
+    assert scores is not None and len(scores) == 1
+
+
+def fake_featurize_points_raw(points, **kwargs):
+    """ FEATURE's output format, with features taken from the point and
+        vectors numbered by their position in the input
+    """
+    for idx, point in enumerate(points):
+        features = "\t".join("{0:.3f}".format(point.coords[shell % 3] + shell)
+                              for shell in range(480))
+        yield "Env_{0}_{1}\t{2}\t#\t{3:.3f}\t{4:.3f}\t{5:.3f}\t#\t{6}\n".format(
+            point.pdbid, idx, features, point.x, point.y, point.z, point.comment)
+
+
+def load_reference_pocket_points():
+    from feature.datastructs.points import PDBPoint
+    from feature.io import pointfile
+
+    points = []
+    for name in ('1qrd_FAD.ptf', '1qhx_ATP.ptf'):
+        with open(os.path.join(REFERENCE_DIR, name)) as f:
+            for point in pointfile.load(f):
+                parts = point.comment.split('_')
+                comment = "{0}\t#\t{1}{2}".format(point.comment, parts[5], parts[6])
+                points.append(PDBPoint(point.x, point.y, point.z,
+                                       pdbid=point.pdbid,
+                                       comment=comment))
+    return points
+
+
+def featurize_background_points(ff_dir, points, *args):
+    from pocketfeature.tasks.build_background import GeneratePocketFeatureBackground as cls
+
+    task = cls()
+    task.params = cls.arguments(sys.stdin, sys.stdout, sys.stderr, os.environ, 'pf_bgbuild').parse_args(
+        ['-', '--ff-dir', ff_dir, '--pdb-dir', REFERENCE_DIR, '--dssp-dir', REFERENCE_DIR] + list(args))
+    task.log = logging.getLogger('pf_bgbuild')
+    task._num_points = task._num_vectors = 0
+    task.point_file = os.path.join(ff_dir, 'points.ptf')
+    task.process_vectors(task.create_vectors(iter(points)))
+
+    outputs = {}
+    for name in sorted(os.listdir(ff_dir)):
+        if name.endswith('.ff.gz'):
+            with gzip.open(os.path.join(ff_dir, name)) as f:
+                outputs[name] = f.read()
+    return outputs
+
+
+def test_background_vectors_match_serial_run(tmpdir, monkeypatch):
+    from pocketfeature.operations import featurize
+    from pocketfeature.tasks import build_background
+
+    monkeypatch.setattr(build_background, 'featurize_points_raw', fake_featurize_points_raw)
+    monkeypatch.setattr(featurize, 'featurize_points_raw', fake_featurize_points_raw)
+    points = load_reference_pocket_points()
+
+    serial = featurize_background_points(str(tmpdir.mkdir('serial')), points)
+    parallel = featurize_background_points(str(tmpdir.mkdir('parallel')), points, '-P', '2')
+    cached = featurize_background_points(str(tmpdir.mkdir('cached')), points,
+                                         '--vector-cache', str(tmpdir.join('cache')))
+
+    assert len(serial) > 1
+    assert parallel == serial
+    assert cached == serial
+
+
+def dump_feature_store(prefix, features):
+    from pocketfeature.io import datastore
+
+    num_vectors = len(features)
+    datastore.dump_columns(datastore.FeatureColumns(features=features,
+                                                    names=np.array(['Env'] * num_vectors, dtype=np.string_),
+                                                    coords=np.zeros((num_vectors, 3)),
+                                                    pdbids=np.array(['1abc'] * num_vectors, dtype=np.string_)),
+                           prefix)
+
+
+@pytest.mark.parametrize('same_type,include_diagonal', [
+    (False, True),
+    (True, True),
+    (True, False),
+])
+def test_incremental_histogram_matches_full_rebuild(tmpdir, same_type, include_diagonal):
+    from pocketfeature.tasks.build_background import (
+        calculate_residue_pair_normalization,
+        update_residue_pair_histogram,
+    )
+
+    thresholds = make_cutoffs()
+    featuresA = make_sparse_features(30, seed=2)
+    featuresB = featuresA if same_type else make_sparse_features(20, seed=3)
+    prefixA = str(tmpdir.join('A'))
+    prefixB = prefixA if same_type else str(tmpdir.join('B'))
+    key = ('A', 'A') if same_type else ('A', 'B')
+    histogram_path = str(tmpdir.join('histogram.npz'))
+
+    # Build from the first vectors, then add the rest as an update would
+    oldA, oldB = 18, 18 if same_type else 12
+    dump_feature_store(prefixA, featuresA[:oldA])
+    dump_feature_store(prefixB, featuresB[:oldB])
+    update_residue_pair_histogram(key, thresholds, prefixA, prefixB, 0, 0,
+                                  histogram_path, 'tversky22', include_diagonal)
+    dump_feature_store(prefixA, featuresA)
+    dump_feature_store(prefixB, featuresB)
+    updated = update_residue_pair_histogram(key, thresholds, prefixA, prefixB, oldA, oldB,
+                                            histogram_path, 'tversky22', include_diagonal)
+
+    expected = calculate_residue_pair_normalization(key, thresholds, prefixA, prefixB,
+                                                    compare_method='tversky22',
+                                                    symmetric=same_type,
+                                                    include_diagonal=include_diagonal)
+    if same_type:
+        num_comparisons = 900 if include_diagonal else 870
+    else:
+        num_comparisons = 600
+    assert updated[0] == expected[0]
+    assert updated[1][3] == expected[1][3] == num_comparisons
+    assert updated[1] == pytest.approx(expected[1])
+
+
+def run_background_task(tmpdir, name, *args):
+    from pocketfeature.tasks.build_background import GeneratePocketFeatureBackground as cls
+
+    output_dir = tmpdir.join(name)
+    task = cls()
+    task.params = cls.arguments(sys.stdin, sys.stdout, sys.stderr, os.environ, 'pf_bgbuild').parse_args(
+        ['--pdb-dir', DATA_DIR, '--dssp-dir', DATA_DIR,
+         '--ff-dir', str(output_dir),
+         '--background', str(output_dir) + '.ff',
+         '--normalization', str(output_dir) + '.coeffs'] + list(args))
+    task.run()
+    return task
+
+
+def test_incremental_background_matches_full_rebuild(tmpdir, monkeypatch):
+    from feature.io import pointfile
+    from pocketfeature.operations import featurize
+    from pocketfeature.tasks import build_background
+
+    monkeypatch.setattr(build_background, 'featurize_points_raw', fake_featurize_points_raw)
+    monkeypatch.setattr(featurize, 'featurize_points_raw', fake_featurize_points_raw)
+    points = load_reference_pocket_points()
+    ptf_dir = tmpdir.mkdir('ptfs')
+    for pdbid in ('1qrd', '1qhx'):
+        with open(str(ptf_dir.join(pdbid + '.ptf')), 'w') as f:
+            pointfile.dump([point for point in points if point.pdbid == pdbid], f)
+
+    full = run_background_task(tmpdir, 'full', '--ptfs', str(ptf_dir))
+
+    # Adding a pocket moves the thresholds, so no tolerance rescores every pair
+    state_dir = str(tmpdir.join('state'))
+    incremental_ptfs = tmpdir.mkdir('incremental_ptfs')
+    ptf_dir.join('1qrd.ptf').copy(incremental_ptfs)
+    run_background_task(tmpdir, 'first', '--ptfs', str(incremental_ptfs),
+                        '--incremental', '--state-dir', state_dir, '--threshold-tolerance', '0')
+    ptf_dir.join('1qhx.ptf').copy(incremental_ptfs)
+    updated = run_background_task(tmpdir, 'second', '--ptfs', str(incremental_ptfs),
+                                  '--incremental', '--state-dir', state_dir, '--threshold-tolerance', '0')
+
+    for name in ('std_dev', 'mean'):
+        vector_name = getattr(build_background.backgroundfile, name.upper() + '_VECTOR')
+        np.testing.assert_allclose(updated.bg.get(vector_name).features,
+                                   full.bg.get(vector_name).features)
+    assert sorted(updated.bg.metadata.get('PDBID_LIST')) == sorted(full.bg.metadata.get('PDBID_LIST'))
+    assert len(full.norms.keys()) > 0
+    assert sorted(updated.norms.keys()) == sorted(full.norms.keys())
+    for key, values in full.norms.items():
+        assert updated.norms[key] == pytest.approx(values)
@@ -73,7 +73,7 @@ def _try_to_featurize_points(points, _iter=True, **kwargs):
 
 
 def featurize_points_raw(pointlist, **kwargs):
-    points = pointfile.dumpi(pointlist)
+    points = pointfile.dumpi_buffered(pointlist)
     result = _try_to_featurize_points(points, _iter=True, **kwargs)
     return result
 
@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 
 import numpy as np
+from six import string_types
 
 
 class Point3D(object):
@@ -46,3 +47,81 @@ class PDBPoint(Point3D):
         cls_name = type(self).__name__
         args = list(self.coords) + [repr(self.pdbid)]
         return "{0}({1}, {2}, {3}, pdbid={4})".format(cls_name, *args)
+
+    @classmethod
+    def view(cls, coords, pdbid, comment=""):
+        """ A point sharing (not copying) a coordinate array """
+        point = cls.__new__(cls)
+        point.coords = coords
+        point.pdbid = pdbid
+        point.comment = comment
+        return point
+
+
+def _object_column(values, size):
+    """ An object array of values (or a repeated scalar), keeping list
+        and tuple values whole instead of letting numpy broadcast them
+    """
+    column = np.empty(size, dtype=object)
+    if values is None or isinstance(values, string_types):
+        column.fill('' if values is None else values)
+    else:
+        values = list(values)
+        if len(values) != size:
+            raise ValueError("Got {0} values for {1} points".format(len(values), size))
+        for idx, value in enumerate(values):
+            column[idx] = value
+    return column
+
+
+class PointSet(object):
+    """
+        N points stored as one (N, 3) coordinate array with parallel pdbid
+        and comment columns. Indexing and iteration create PDBPoint views
+        of the shared coordinates; slices and index arrays create PointSets
+    """
+    def __init__(self, coords=(), pdbids=None, comments=None):
+        self.coords = np.asarray(coords, dtype=np.float).reshape(-1, 3)
+        self.pdbids = _object_column(pdbids, len(self.coords))
+        self.comments = _object_column(comments, len(self.coords))
+
+    @classmethod
+    def from_points(cls, points):
+        if isinstance(points, cls):
+            return points
+        points = list(points)
+        return cls([point.coords for point in points],
+                   pdbids=[point.pdbid for point in points],
+                   comments=[point.comment for point in points])
+
+    @classmethod
+    def concatenate(cls, pointsets):
+        pointsets = list(pointsets)
+        if len(pointsets) == 0:
+            return cls()
+        return cls(np.concatenate([points.coords for points in pointsets]),
+                   pdbids=np.concatenate([points.pdbids for points in pointsets]),
+                   comments=np.concatenate([points.comments for points in pointsets]))
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __iter__(self):
+        for coords, pdbid, comment in zip(self.coords, self.pdbids, self.comments):
+            yield PDBPoint.view(coords, pdbid, comment)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return PDBPoint.view(self.coords[idx], self.pdbids[idx], self.comments[idx])
+        return PointSet(self.coords[idx], pdbids=self.pdbids[idx], comments=self.comments[idx])
+
+    def coords_by_name(self, name_idx=0):
+        """ Map each point's name (a token of its comment) to its row of
+            the shared coordinates, without creating points
+        """
+        names = [comment.split()[name_idx] for comment in self.comments]
+        return dict(zip(names, self.coords))
+
+    def __repr__(self):
+        cls_name = type(self).__name__
+        return "<{0} of {1} points>".format(cls_name, len(self))
@@ -1,14 +1,32 @@
 from __future__ import absolute_import, print_function
 
+import itertools
+
+import numpy as np
 from six import moves
 
-from feature.datastructs.points import PDBPoint
+from feature.datastructs.points import (
+    PDBPoint,
+    PointSet,
+)
 
 COORDS_LINE = "{:.3f}\t{:.3f}\t{:.3f}"
 POINT_LINE = "{}\t" + COORDS_LINE
 NON_COMMENT_LINE = POINT_LINE + "\n"
 COMMENT_LINE = POINT_LINE + "\t#\t{}" + "\n"
 
+# printf-style equivalents of the lines above, for formatting many points
+# with a single operation
+NON_COMMENT_TEMPLATE = "%s\t%.3f\t%.3f\t%.3f\n"
+COMMENT_TEMPLATE = "%s\t%.3f\t%.3f\t%.3f\t#\t%s\n"
+
+DEFAULT_CHUNK_SIZE = 4096
+
+def _join_comment(comment):
+    if isinstance(comment, (tuple, list)):  # Multiple comments
+        return "\t#\t".join(comment)
+    return comment
+
 
 def dumpi(pointlist):
     for point in pointlist:
@@ -25,11 +43,62 @@ def dumpi(pointlist):
         yield tpl.format(*line)
 
 
-def dump(pointlist, io, **kwargs):
-    """ Write a point list to a file-like object """
-    lines = dumpi(pointlist)
-    for line in lines:
-        io.write(line)
+def _format_lines(pdbids, coords, comments):
+    """ Format parallel pdbids, coordinate lists and comments as
+        pointfile text with a single printf-style operation
+    """
+    templates = []
+    values = []
+    for pdbid, (x, y, z), comment in zip(pdbids, coords, comments):
+        comment = _join_comment(comment)
+        if comment:
+            templates.append(COMMENT_TEMPLATE)
+            values.extend((pdbid, x, y, z, comment))
+        else:
+            templates.append(NON_COMMENT_TEMPLATE)
+            values.extend((pdbid, x, y, z))
+    return "".join(templates) % tuple(values)
+
+
+def format_pointset(points):
+    """ Format a PointSet as pointfile text """
+    return _format_lines(points.pdbids, points.coords.tolist(), points.comments)
+
+
+def format_points(points):
+    """ Format points as pointfile text """
+    return _format_lines([point.pdbid for point in points],
+                         [point.coords.tolist() for point in points],
+                         [point.comment for point in points])
+
+
+def dumpi_chunks(pointlist, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Generate pointfile text for up to chunk_size points at a time
+        from points or a PointSet
+    """
+    if isinstance(pointlist, PointSet):
+        for start in range(0, len(pointlist), chunk_size):
+            yield format_pointset(pointlist[start:start + chunk_size])
+    else:
+        points = iter(pointlist)
+        while True:
+            chunk = list(itertools.islice(points, chunk_size))
+            if len(chunk) == 0:
+                break
+            yield format_points(chunk)
+
+
+def dumpi_buffered(pointlist, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Generate the same lines as dumpi, formatted a chunk at a time """
+    for chunk in dumpi_chunks(pointlist, chunk_size=chunk_size):
+        for line in chunk.splitlines(True):
+            yield line
+
+
+def dump(pointlist, io, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+    """ Write a point list (or PointSet) to a file-like object """
+    for chunk in dumpi_chunks(pointlist, chunk_size=chunk_size):
+        io.write(chunk)
 
 
 def loadi(src, wrapper=PDBPoint, ignore_invalid=False):
@@ -56,6 +125,38 @@ def load(io, **kwargs):
     return tuple(loadi(io, **kwargs))
 
 
+def _parses_as_floats(values):
+    try:
+        [float(value) for value in values]
+        return True
+    except ValueError:
+        return False
+
+
+def load_pointset(src, ignore_invalid=False):
+    """ Load a pointfile into a PointSet without creating points.
+        Coordinates are converted all at once
+    """
+    pdbids = []
+    coords = []
+    comments = []
+    for line in src:
+        body, _, comment = line.partition('#')
+        fields = body.split()
+        if len(fields) == 0:
+            continue
+        if len(fields) != 4 or (ignore_invalid and not _parses_as_floats(fields[1:])):
+            if ignore_invalid:
+                continue
+            raise ValueError("Invalid point line: {0!r}".format(line))
+        pdbids.append(fields[0])
+        coords.append(fields[1:])
+        comments.append(comment.strip())
+    return PointSet(np.array(coords, dtype=float).reshape(-1, 3),
+                    pdbids=pdbids,
+                    comments=comments)
+
+
 def dumps(pointlist, **kwargs):
     buf = moves.StringIO()
     dump(pointlist, buf, **kwargs)